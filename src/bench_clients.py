@@ -0,0 +1,120 @@
+"""
+Benchmarks of clients against a cluster: closed-loop increments under each kind of fault
+(--workload), the ways of serving reads (--reads), PreVote and CheckQuorum (--elections),
+and moving leadership away from a leader serving clients (--failover).
+"""
+
+from random import Random
+from world_broker import WorldBroker
+from events import PowerDown, TransferLeadership
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+from fuzz import ADVERSE_EVENTS
+from bench_runner import no_faults, faults_of_kind, run_scenario, print_ops_header
+from bench_runner import print_ops_row
+
+
+def workload(clients, steps, faults_per_step, **settings):
+    """
+    Runs closed-loop clients against a fault-free cluster, then against each kind of
+    adverse event. Any other settings are passed on to the WorldBroker.
+    """
+    print_ops_header()
+    print_ops_row('no faults', run_scenario(5, steps, no_faults, clients=clients, **settings))
+    for name, draw in ADVERSE_EVENTS.items():
+        print_ops_row(name, run_scenario(5, steps, faults_of_kind(draw, faults_per_step),
+                                         clients=clients, **settings))
+
+
+def compare_reads(clients, steps, faults_per_step, **settings):
+    """
+    Runs clients that only read, through the log, by ReadIndex and on leader leases, with
+    and without clock skew. Any other settings are passed on to the WorldBroker.
+    """
+    print("{:>28} {:>12} {:>9} {:>9} {:>13} {:>12}".format(
+        '', 'reads/sim-s', 'p50 ms', 'p99 ms', 'messages/op', 'writes/op'))
+    for read_mode in ('log', 'read_index', 'lease'):
+        for name, faults in (('no faults', no_faults),
+                             ('ClockSkew', faults_of_kind(ADVERSE_EVENTS['ClockSkew'],
+                                                          faults_per_step))):
+            metrics = run_scenario(5, steps, faults, clients=clients, read_fraction=1.0,
+                                   read_mode=read_mode, leader_leases=read_mode == 'lease',
+                                   **settings)
+            print("{:>28} {:>12.1f} {:>9} {:>9} {:>13.2f} {:>12.2f}".format(
+                "{}, {}".format(read_mode, name), metrics['ops_per_sim_sec'],
+                metrics['op_p50_ms'], metrics['op_p99_ms'], metrics['messages_per_op'],
+                metrics['writes_per_op']))
+
+
+def compare_elections(clients, steps, faults_per_step, **settings):
+    """
+    Runs clients fault-free and under each kind of adverse event, with PreVote and
+    CheckQuorum each on and off. Any other settings are passed on to the WorldBroker.
+    """
+    print("{:>28} {:>9} {:>13} {:>15} {:>13} {:>12}".format(
+        '', 'pre_vote', 'check_quorum', 'leader changes', 'leaderless ms', 'ops/sim-s'))
+    scenarios = [('no faults', no_faults)]
+    scenarios.extend((name, faults_of_kind(draw, faults_per_step))
+                     for name, draw in ADVERSE_EVENTS.items())
+    for name, faults in scenarios:
+        for pre_vote in (False, True):
+            for check_quorum in (False, True):
+                metrics = run_scenario(5, steps, faults, clients=clients, pre_vote=pre_vote,
+                                       check_quorum=check_quorum, **settings)
+                print("{:>28} {:>9} {:>13} {:>15} {:>13} {:>12.1f}".format(
+                    name, 'on' if pre_vote else 'off', 'on' if check_quorum else 'off',
+                    metrics['leader_changes'], metrics['leaderless_ms'],
+                    metrics['ops_per_sim_sec']))
+
+
+def time_failover(method, clients, seed, **settings):
+    """
+    Runs clients for a second, then moves leadership away from the leader with method,
+    'PowerDown' or 'TransferLeadership', drawing message delays from a PRNG seeded with seed.
+    Any other settings are passed on to the WorldBroker. Returns the longest gap in ms
+    between client replies, and the ms without a leader, over the following two seconds.
+    """
+    rng = Random(seed)
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), ms_per_step=1, clients=clients,
+                         **settings)
+
+    def step(adverse_events):
+        "Runs a step with fresh message delays"
+        delays = [rng.randint(1, broker.message_send_delay) for _ in range(rng.randint(1, 20))]
+        broker.execute_step({'delays': delays, 'adverse_events': adverse_events})
+
+    while broker.current_time < 1000 or broker.client_broker['leader'] is None:
+        step([])
+    start_time = broker.current_time
+    if method == 'PowerDown':
+        event = PowerDown(start_time=start_time, event_length=2000,
+                          affected_node=broker.client_broker['leader'])
+    else:
+        event = TransferLeadership(start_time=start_time, target_node=None)
+    start_leaderless = broker.leaderless_time()
+    last_reply, longest_gap = start_time, 0
+    ops_completed = broker.client_broker['ops_completed']
+    step([event])
+    while broker.current_time < start_time + 2000:
+        if broker.client_broker['ops_completed'] > ops_completed:
+            ops_completed = broker.client_broker['ops_completed']
+            longest_gap = max(longest_gap, broker.current_time - last_reply)
+            last_reply = broker.current_time
+        step([])
+    longest_gap = max(longest_gap, broker.current_time - last_reply)
+    return longest_gap, broker.leaderless_time() - start_leaderless
+
+
+def failover(clients, trials, **settings):
+    """
+    Compares powering the leader down with transferring leadership, over trials seeds.
+    Any other settings are passed on to the WorldBroker.
+    """
+    print("{:>20} {:>14} {:>14} {:>18}".format(
+        '', 'p50 stall ms', 'max stall ms', 'leaderless ms/run'))
+    for method in ('PowerDown', 'TransferLeadership'):
+        results = [time_failover(method, clients, seed, **settings) for seed in range(trials)]
+        stalls = sorted(result[0] for result in results)
+        print("{:>20} {:>14} {:>14} {:>18.1f}".format(
+            method, stalls[len(stalls) // 2], stalls[-1],
+            sum(result[1] for result in results) / float(trials)))
@@ -0,0 +1,140 @@
+"""
+Benchmarks of the cluster's shape: adding a node as a learner or a voter (--membership),
+running many Raft groups on the same hosts (--groups), and a cluster of processes against
+the simulator's prediction for it (--runtime).
+"""
+
+import asyncio
+import collections
+import time
+from world_broker import WorldBroker
+from events import PowerDown, StopPowerDown, AddNode
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+from bench_runner import percentile
+import runtime
+
+
+def time_add_node(learner, history, **settings):
+    """
+    Runs a three node cluster committing an entry each ms for history ms, then powers a
+    follower down for two seconds while adding a fourth node, as a learner if learner is set.
+    Any other settings are passed on to the WorldBroker. Returns the commit latencies, as a
+    histogram, of the entries proposed over those two seconds.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), ms_per_step=10, cluster_size=3,
+                         spare_nodes=1, proposal_interval=1, **settings)
+    no_faults_step = {'delays': [], 'adverse_events': []}
+    while broker.current_time < history or broker.client_broker['leader'] is None:
+        broker.execute_step(no_faults_step)
+    leader = broker.client_broker['leader']
+    follower = next(node_id for node_id in range(3) if node_id != leader)
+    start_time = broker.current_time
+    before = collections.Counter(broker.client_broker['commit_latencies'])
+    broker.execute_step({'delays': [], 'adverse_events': [
+        PowerDown(start_time=start_time, event_length=2000, affected_node=follower),
+        AddNode(start_time=start_time, node_id=3, learner=learner)]})
+    while broker.current_time < start_time + 2000:
+        broker.execute_step(no_faults_step)
+    return broker.client_broker['commit_latencies'] - before
+
+
+def add_node(histories, **settings):
+    "Compares adding a node as a learner with adding it as a voter, after each history"
+    print("{:>10} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+        'history', 'joins as', 'committed', 'p50 ms', 'p99 ms', 'max ms'))
+    for history in histories:
+        for learner in (True, False):
+            latencies = time_add_node(learner, history, **settings)
+            print("{:>10} {:>10} {:>12} {:>10} {:>10} {:>10}".format(
+                history, 'learner' if learner else 'voter', sum(latencies.values()),
+                percentile(latencies, 0.5), percentile(latencies, 0.99),
+                max(latencies) if latencies else 0))
+
+
+def scale_groups(group_counts, steps, **settings):
+    """
+    Runs each number of groups on five hosts for steps steps without faults. Any other
+    settings are passed on to the WorldBroker.
+    """
+    print("{:>8} {:>14} {:>14} {:>10} {:>18} {:>14} {:>12}".format(
+        'groups', 'host messages', 'group messages', 'coalesced', 'msgs/group/sim-s',
+        'cpu s', 'sim-ms/s'))
+    for groups in group_counts:
+        start = time.process_time()
+        broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), groups=groups, **settings)
+        for _ in range(steps):
+            broker.execute_step({'delays': [], 'adverse_events': []})
+        elapsed = time.process_time() - start
+        # A single group runs without hosts, so each of its messages goes out on its own.
+        group_messages = broker.group_messages_sent or broker.messages_sent
+        print("{:>8} {:>14} {:>14} {:>9.1f}x {:>18.1f} {:>14.2f} {:>12.0f}".format(
+            groups, broker.messages_sent, group_messages,
+            group_messages / broker.messages_sent,
+            broker.messages_sent * 1000 / groups / broker.current_time, elapsed,
+            broker.current_time / elapsed))
+
+
+def simulate_cluster(cluster_size, trials, quiet_seconds):
+    """
+    Does in the simulator what runtime.measure_cluster does with processes: times the first
+    election, measures the traffic once there is a leader, then repeatedly crashes the
+    leader, times the election of the next one and restarts the crashed node.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), ms_per_step=1,
+                         cluster_size=cluster_size, crash_on_power_down=True)
+    no_faults_step = {'delays': [], 'adverse_events': []}
+
+    def run_for(ms):
+        "Runs the world for ms"
+        end = broker.current_time + ms
+        while broker.current_time < end:
+            broker.execute_step(no_faults_step)
+    while broker.client_broker['leader'] is None:
+        broker.execute_step(no_faults_step)
+    first_election = broker.current_time
+    run_for(1500)
+    messages = broker.messages_sent
+    run_for(quiet_seconds * 1000)
+    heartbeats = {'messages': (broker.messages_sent - messages) / quiet_seconds}
+    failovers = []
+    for _ in range(trials):
+        leader, killed_at = broker.client_broker['leader'], broker.current_time
+        # The node stays down until the new leader is elected, then restarts from its disk.
+        broker.execute_step({'delays': [], 'adverse_events': [
+            PowerDown(start_time=killed_at, event_length=10000, affected_node=leader)]})
+        while broker.client_broker['leader'] == leader:
+            broker.execute_step(no_faults_step)
+        failovers.append(broker.current_time - killed_at)
+        broker.execute_step({'delays': [], 'adverse_events': [
+            StopPowerDown(start_time=broker.current_time, affected_node=leader)]})
+        run_for(500)
+    return {'first_election_ms': first_election, 'heartbeats': heartbeats,
+            'failover_ms': failovers}
+
+
+def compare_runtime(cluster_size, trials, quiet_seconds):
+    "Compares a cluster of processes with the simulator's prediction for it"
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    real = loop.run_until_complete(runtime.measure_cluster(cluster_size, trials,
+                                                           quiet_seconds))
+    loop.close()
+    simulated = simulate_cluster(cluster_size, trials, quiet_seconds)
+    print("{:>22} {:>12} {:>12} {:>12} {:>12}".format(
+        '', 'runtime p50', 'runtime max', 'sim p50', 'sim max'))
+    for label, real_values, simulated_values in (
+            ('first election ms', [real['first_election_ms']],
+             [simulated['first_election_ms']]),
+            ('failover ms', real['failover_ms'], simulated['failover_ms'])):
+        real_values = collections.Counter(int(value) for value in real_values)
+        simulated_values = collections.Counter(simulated_values)
+        print("{:>22} {:>12} {:>12} {:>12} {:>12}".format(
+            label, percentile(real_values, 0.5), max(real_values, default=0),
+            percentile(simulated_values, 0.5), max(simulated_values, default=0)))
+    print("{:>22} {:>12.1f} {:>12} {:>12.1f} {:>12}".format(
+        'heartbeat msgs/s', real['heartbeats']['messages'], '',
+        simulated['heartbeats']['messages'], ''))
+    print("")
+    print("Heartbeat traffic between processes: {:.0f} bytes/s in {:.1f} socket writes/s".format(
+        real['heartbeats']['bytes'], real['heartbeats']['writes']))
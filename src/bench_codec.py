@@ -0,0 +1,89 @@
+"""
+Benchmarks of the binary codec against pickle, and of the encoded bytes sent over each
+link (--codec).
+"""
+
+import pickle
+import time
+from random import Random
+from world_broker import WorldBroker
+from message import AppendEntries, AppendEntriesResponse
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+import codec
+
+
+def time_calls(function, argument, seconds=0.2):
+    "Returns how many times a second function can be called with argument"
+    calls = 0
+    batch = 100
+    start = time.perf_counter()
+    while True:
+        for _ in range(batch):
+            function(argument)
+        calls += batch
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+
+def read_entries(data):
+    "Decodes a message and every command its entries hold"
+    message = codec.decode(data)
+    for _ in getattr(message, 'entries', ()):
+        pass
+
+
+def codec_throughput(batch_sizes):
+    """
+    Times encoding and decoding a heartbeat, a response, and AppendEntries of each batch size
+    holding commands of four client requests each, with the codec and with pickle. Decoding
+    only finds the entries; reading them decodes each command.
+    """
+    def command(index):
+        "Returns the requests of four clients, as the leader would propose them"
+        return tuple((client_id, 1000 + index, False) for client_id in range(4))
+
+    messages = [('heartbeat', AppendEntries(7, 2, 12345, 7, [], 12340, 17)),
+                ('response', AppendEntriesResponse(7, True, 12345, read_round=17))]
+    for batch_size in batch_sizes:
+        messages.append(('{} entries'.format(batch_size),
+                         AppendEntries(7, 2, 12345, 7,
+                                       [(7, command(index)) for index in range(batch_size)],
+                                       12340)))
+    print("{:>12} {:>7} {:>8} {:>12} {:>9} {:>12} {:>9} {:>12} {:>12}".format(
+        'message', 'bytes', 'pickled', 'encodes/s', 'enc MB/s', 'decodes/s', 'dec MB/s',
+        'reads/s', 'unpickles/s'))
+    for name, message in messages:
+        data = codec.encode(message)
+        pickled = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        encodes = time_calls(codec.encode, message)
+        decodes = time_calls(codec.decode, data)
+        print("{:>12} {:>7} {:>8} {:>12.0f} {:>9.1f} {:>12.0f} {:>9.1f} {:>12.0f} {:>12.0f}"
+              .format(name, len(data), len(pickled), encodes, encodes * len(data) / 1e6,
+                      decodes, decodes * len(data) / 1e6, time_calls(read_entries, data),
+                      time_calls(pickle.loads, pickled)))
+
+
+def link_traffic(clients, steps, **settings):
+    """
+    Runs clients against a fault-free cluster for steps steps, counting the encoded bytes of
+    every message, and prints the KB each node sent each other per simulated second. Any
+    other settings are passed on to the WorldBroker.
+    """
+    rng = Random(0)
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), clients=clients,
+                         count_bytes=True, **settings)
+    for _ in range(steps):
+        delays = [rng.randint(1, broker.message_send_delay) for _ in range(rng.randint(1, 20))]
+        broker.execute_step({'delays': delays, 'adverse_events': []})
+    seconds = broker.current_time / 1000.0
+    print("KB sent per simulated second, from (rows) to (columns):")
+    print("{:>6}".format('') + ''.join("{:>10}".format(k) for k in broker.node_ids))
+    for origin in broker.node_ids:
+        print("{:>6}".format(origin) + ''.join(
+            "{:>10.1f}".format(broker.link_bytes[origin, destination] / 1000 / seconds)
+            for destination in broker.node_ids))
+    total = sum(broker.link_bytes.values())
+    print("{} messages of {:.1f} bytes on average, {:.1f} KB per simulated second".format(
+        broker.messages_sent, total / max(1, broker.messages_sent), total / 1000 / seconds))
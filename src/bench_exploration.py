@@ -0,0 +1,206 @@
+"""
+Benchmarks of exploring runs: forking branches from a checkpoint against replaying their
+prefix (--checkpoints), checking client histories are linearizable (--linearizability),
+and drawing steps from a PRNG against Hypothesis (--fuzz).
+"""
+
+import collections
+import subprocess
+import sys
+import time
+from random import Random
+from world_broker import WorldBroker
+from log_sinks import NullSink
+from fuzz import draw_step, draw_adverse_event
+from tracing import Tracer, OFF
+import linearizability
+
+
+# pylint: disable=too-many-locals
+def time_branches(prefix_steps, branches, branch_steps, **settings):
+    """
+    Runs branches of branch_steps fault steps after the same prefix_steps steps, by replay
+    and by forking. Any other settings are passed on to the WorldBroker. Returns the wall
+    time of each way, and of the checkpoint and the average fork.
+    """
+    def new_world():
+        "Returns a world with faults and clients"
+        return WorldBroker(log=NullSink(), tracer=Tracer(OFF), catastrophy_level=3, **settings)
+    rng = Random(0)
+    prefix = []
+    world = new_world()
+    for _ in range(prefix_steps):
+        prefix.append(draw_step(world, rng))
+        world.execute_step(prefix[-1])
+    traces = []
+    for _ in range(branches):
+        traces.append([draw_step(world, rng) for _ in range(branch_steps)])
+
+    start = time.perf_counter()
+    for trace in traces:
+        world = new_world()
+        for step in prefix + trace:
+            world.execute_step(step)
+    replay_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    world = new_world()
+    for step in prefix:
+        world.execute_step(step)
+    checkpoint_start = time.perf_counter()
+    checkpoint = world.checkpoint()
+    checkpoint_time = time.perf_counter() - checkpoint_start
+    fork_time = 0
+    for trace in traces:
+        fork_start = time.perf_counter()
+        fork = checkpoint.fork(NullSink())
+        fork_time += time.perf_counter() - fork_start
+        for step in trace:
+            fork.execute_step(step)
+    return replay_time, time.perf_counter() - start, checkpoint_time, fork_time / branches
+
+
+def compare_branches(prefix_steps_values, branches, branch_steps, **settings):
+    "Compares replaying a prefix for each branch with forking each from a checkpoint"
+    print("{:>12} {:>10} {:>10} {:>10} {:>9} {:>15} {:>9}".format(
+        'prefix steps', 'branches', 'replay s', 'fork s', 'speedup', 'checkpoint ms',
+        'fork ms'))
+    for prefix_steps in prefix_steps_values:
+        replay_time, fork_total, checkpoint_time, fork_time = time_branches(
+            prefix_steps, branches, branch_steps, **settings)
+        print("{:>12} {:>10} {:>10.2f} {:>10.2f} {:>8.1f}x {:>15.2f} {:>9.2f}".format(
+            prefix_steps, branches, replay_time, fork_total, replay_time / fork_total,
+            checkpoint_time * 1000, fork_time * 1000))
+
+
+def time_check(check, operations):
+    "Returns the seconds check took on operations, and what it found"
+    start = time.perf_counter()
+    violation = check(operations)
+    return time.perf_counter() - start, violation
+
+
+def check_histories(step_counts, clients, faults_per_step, **settings):
+    """
+    Runs clients under up to faults_per_step adverse events a step for each number of steps,
+    then times checking their history, as is and with one read in the middle made stale, by
+    searching and by the counter's fast path. Any other settings are passed on to the
+    WorldBroker.
+    """
+    print("{:>8} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+        'steps', 'ops', 'run s', 'search s', 'fast s', 'planted s', 'planted fast'))
+    for steps in step_counts:
+        rng = Random(0)
+        broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), clients=clients,
+                             catastrophy_level=faults_per_step, **settings)
+        start = time.perf_counter()
+        for _ in range(steps):
+            broker.execute_step(draw_step(broker, rng))
+        elapsed = time.perf_counter() - start
+        operations = broker.client_broker['history'].operations()
+        seconds, violation = time_check(linearizability.check_operations, operations)
+        assert violation is None, violation
+        fast_seconds, violation = time_check(linearizability.check_counter, operations)
+        assert violation is None, violation
+        # Increments completed before the middle of the history, so a read after it can't
+        # have returned 0.
+        stale = next(index for index in range(len(operations) // 2, len(operations))
+                     if operations[index][1] == linearizability.READ and operations[index][2])
+        client_id, kind, _, invoked, completed = operations[stale]
+        planted = list(operations)
+        planted[stale] = (client_id, kind, 0, invoked, completed)
+        planted_seconds, violation = time_check(linearizability.check_operations, planted)
+        planted_fast_seconds, fast_violation = time_check(linearizability.check_counter,
+                                                          planted)
+        print("{:>8} {:>10} {:>10.2f} {:>10.3f} {:>10.3f} {:>12.3f} {:>12.3f}{}".format(
+            steps, len(operations), elapsed, seconds, fast_seconds, planted_seconds,
+            planted_fast_seconds, '' if violation and fast_violation else ' (missed)'))
+
+
+def time_import(module, repeat=3):
+    "Returns the fewest seconds a new interpreter took to import module, out of repeat"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def seeded_faults(runs, steps, **settings):
+    """
+    Runs runs seeds of steps steps, drawing each step from a PRNG as a sweep does. Returns
+    the steps and faults run, the wall seconds taken, and how many of them went on drawing.
+    """
+    counts = collections.Counter()
+    for seed in range(runs):
+        rng = Random(seed)
+        broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), **settings)
+        for _ in range(steps):
+            start = time.perf_counter()
+            randomness = draw_step(broker, rng)
+            drawn = time.perf_counter()
+            broker.execute_step(randomness)
+            counts['steps'] += 1
+            counts['faults'] += len(randomness['adverse_events'])
+            counts['drawing'] += drawn - start
+            counts['wall'] += time.perf_counter() - start
+        broker.teardown()
+    return counts
+
+
+def hypothesis_faults(runs, steps, **settings):
+    """
+    Runs runs examples of steps steps of the Hypothesis state machine. Returns the steps and
+    faults run, the wall seconds taken, and how many of them went on anything but execute_step.
+    """
+    # pylint: disable=import-outside-toplevel
+    from hypothesis import settings as hypothesis_settings, HealthCheck
+    from hypothesis.stateful import run_state_machine_as_test
+    from world_machine import WorldMachine
+    counts = collections.Counter()
+
+    class CountingMachine(WorldMachine):
+        "Counts the steps and faults it executes, and the time it takes"
+        def execute_step(self, randomness):
+            start = time.perf_counter()
+            WorldMachine.execute_step(self, randomness)
+            counts['steps'] += 1
+            counts['faults'] += len(randomness['adverse_events'])
+            counts['executing'] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    run_state_machine_as_test(
+        lambda: CountingMachine(log=NullSink(), tracer=Tracer(OFF), **settings),
+        settings=hypothesis_settings(max_examples=runs, stateful_step_count=steps,
+                                     deadline=None, database=None,
+                                     suppress_health_check=[HealthCheck.too_slow,
+                                                            HealthCheck.data_too_large]))
+    counts['wall'] = time.perf_counter() - start
+    counts['drawing'] = counts['wall'] - counts['executing']
+    return counts
+
+
+def compare_fuzzing(runs, steps, catastrophy_level):
+    """
+    Compares importing the engine alone with importing the Hypothesis state machine, then
+    drawing steps from a PRNG with drawing them from Hypothesis strategies
+    """
+    print("{:>30} {:>10}".format('startup', 'ms'))
+    for module in ('world_broker', 'world_machine'):
+        print("{:>30} {:>10.0f}".format('import ' + module, time_import(module) * 1000))
+    rng = Random(0)
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF))
+    start = time.perf_counter()
+    for _ in range(10000):
+        draw_adverse_event(broker, rng)
+    print("{:>30} {:>10.0f}".format('faults drawn from a PRNG per s',
+                                    10000 / (time.perf_counter() - start)))
+    print()
+    print("{:>12} {:>8} {:>8} {:>10} {:>10} {:>10}".format(
+        'drawn by', 'steps', 'faults', 'steps/s', 'faults/s', 'drawing %'))
+    for name, run in (('prng', seeded_faults), ('hypothesis', hypothesis_faults)):
+        counts = run(runs, steps, catastrophy_level=catastrophy_level)
+        print("{:>12} {:>8} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            name, counts['steps'], counts['faults'], counts['steps'] / counts['wall'],
+            counts['faults'] / counts['wall'], 100 * counts['drawing'] / counts['wall']))
@@ -0,0 +1,109 @@
+"""
+Micro benchmarks of the engine: the tick-by-tick and idle-skipping event loops, debug
+tracing on the node's receive path, and the event queue (--micro).
+"""
+
+import time
+import tracemalloc
+from heapq import heappop
+from random import Random
+from world_broker import WorldBroker
+from message import AppendEntries, RequestVote
+from events import DeliverMessage
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+
+
+def run_cluster(ms_per_step, steps, skip_idle_time, seed=0):
+    """
+    Runs a fault-free cluster for the given number of steps, drawing message delays from a
+    seeded PRNG. Returns the event log and the wall-clock seconds spent in execute_step.
+    """
+    rng = Random(seed)
+    broker = WorldBroker(ms_per_step=ms_per_step, skip_idle_time=skip_idle_time)
+    elapsed = 0.0
+    for _ in range(steps):
+        delays = [rng.randint(1, broker.message_send_delay) for _ in range(rng.randint(0, 20))]
+        start = time.perf_counter()
+        broker.execute_step({'delays': delays, 'adverse_events': []})
+        elapsed += time.perf_counter() - start
+    return broker.test_logging, broker.current_time, elapsed
+
+
+def log_signature(log):
+    "Returns a comparable form of an event log, with messages replaced by their fields"
+    return [sorted((key, value.to_map() if key == 'data' else value)
+                   for key, value in entry.items())
+            for entry in log]
+
+
+def time_receive(tracer, calls):
+    """
+    Delivers heartbeats from the current leader to a follower, calling Node.receive
+    directly. Returns the wall-clock ns per call.
+
+    Each call queues the follower's response, so the queue is emptied after each, or the
+    time would mostly go on pushing onto an ever longer queue.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=tracer)
+    broker.execute_step({'delays': [], 'adverse_events': []})
+    leader = next(node for node in broker.power_broker['nodes'].values() if node.is_leader())
+    follower = next(node for node in broker.power_broker['nodes'].values()
+                    if not node.is_leader())
+    message = AppendEntries(leader.term, leader.node_id, 0, 0, [], 0)
+    action_queue = broker.action_queue
+    action_queue.clear()
+    start = time.perf_counter()
+    for _ in range(calls):
+        follower.receive(leader.node_id, message)
+        action_queue.clear()
+    return (time.perf_counter() - start) * 1e9 / calls
+
+
+def time_event_queue(events):
+    """
+    Queues the given number of message deliveries on a broker, then pops them all.
+    Returns the bytes allocated per queued event, and queue pushes and pops per second.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF))
+    broker.action_queue = []
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for index in range(events):
+        broker.schedule(DeliverMessage((index * 7919) % 1000, 1, 0, RequestVote(1, 0, 0, -1)))
+    bytes_per_event = (tracemalloc.get_traced_memory()[0] - before) / events
+    tracemalloc.stop()
+
+    broker.action_queue = []
+    deliveries = [DeliverMessage((index * 7919) % 1000, 1, 0, None) for index in range(events)]
+    start = time.perf_counter()
+    for delivery in deliveries:
+        broker.schedule(delivery)
+    while broker.action_queue:
+        heappop(broker.action_queue)
+    return bytes_per_event, events / (time.perf_counter() - start)
+
+
+def micro(ms_per_step_values, steps, receive_calls):
+    "Compares tick-by-tick and idle-skipping event loops for each step size"
+    print("{:>12} {:>16} {:>16} {:>8} {:>10}".format(
+        'ms_per_step', 'tick sim-ms/s', 'skip sim-ms/s', 'speedup', 'logs match'))
+    for ms_per_step in ms_per_step_values:
+        tick_log, tick_ms, tick_elapsed = run_cluster(ms_per_step, steps, False)
+        skip_log, skip_ms, skip_elapsed = run_cluster(ms_per_step, steps, True)
+        assert tick_ms == skip_ms
+        print("{:>12} {:>16.0f} {:>16.0f} {:>7.1f}x {:>10}".format(
+            ms_per_step, tick_ms / tick_elapsed, skip_ms / skip_elapsed,
+            tick_elapsed / skip_elapsed, str(log_signature(tick_log) == log_signature(skip_log))))
+
+    print("")
+    traced = time_receive(Tracer(), receive_calls)
+    untraced = time_receive(Tracer(OFF), receive_calls)
+    print("{:>12} {:>16} {:>16} {:>8}".format('', 'traced ns/call', 'untraced ns/call', 'speedup'))
+    print("{:>12} {:>16.0f} {:>16.0f} {:>7.1f}x".format(
+        'receive', traced, untraced, traced / untraced))
+
+    print("")
+    bytes_per_event, pushes_per_second = time_event_queue(100000)
+    print("{:>12} {:>16} {:>16}".format('', 'bytes/event', 'push+pop/s'))
+    print("{:>12} {:>16.0f} {:>16.0f}".format('event queue', bytes_per_event, pushes_per_second))
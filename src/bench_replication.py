@@ -0,0 +1,68 @@
+"""
+Benchmarks of log replication: AppendEntries batch sizes and windows (--replication), and a
+follower catching up on a long history (--catch-up).
+"""
+
+from world_broker import WorldBroker
+from events import PowerDown
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+from bench_runner import no_faults, run_scenario
+
+
+def replication_sweep(batch_sizes, windows, steps, **settings):
+    """
+    Runs the replication workload for each batch size and in-flight window. Any other
+    settings are passed on to the WorldBroker.
+    """
+    print("{:>20} {:>16} {:>12} {:>12} {:>12} {:>12} {:>9}".format(
+        'batch x window', 'committed/sim-s', 'p50 ms', 'p99 ms', 'writes/sync', 'messages',
+        'wall s'))
+    for batch_size in batch_sizes:
+        for window in windows:
+            metrics = run_scenario(5, steps, no_faults, max_entries_per_append=batch_size,
+                                   max_appends_in_flight=window, **settings)
+            print("{:>20} {:>16.1f} {:>12} {:>12} {:>12.2f} {:>12} {:>9.3f}".format(
+                "{} x {}".format(batch_size, window), metrics['committed_per_sim_sec'],
+                metrics['commit_p50_ms'], metrics['commit_p99_ms'],
+                metrics['writes_per_sync'], metrics['messages_sent'], metrics['wall_seconds']))
+
+
+def time_catch_up(history, snapshot_interval, **settings):
+    """
+    Powers down a follower while the leader commits history entries, then times how long it
+    takes the follower to commit every one of them once it's back. Any other settings are
+    passed on to the WorldBroker. Returns the simulated ms and messages sent to catch up.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), ms_per_step=10, proposal_interval=1,
+                         snapshot_interval=snapshot_interval, **settings)
+    no_faults_step = {'delays': [], 'adverse_events': []}
+    while broker.client_broker['leader'] is None:
+        broker.execute_step(no_faults_step)
+    follower = next(node_id for node_id in broker.node_ids
+                    if node_id != broker.client_broker['leader'])
+    broker.execute_step({'delays': [], 'adverse_events': [
+        PowerDown(start_time=broker.current_time, event_length=history,
+                  affected_node=follower)]})
+    while follower in broker.power_broker['down_nodes']:
+        broker.execute_step(no_faults_step)
+    target = broker.client_broker['committed_index']
+    start_time, start_messages = broker.current_time, broker.messages_sent
+    while broker.power_broker['nodes'][follower].commit_index < target:
+        broker.execute_step(no_faults_step)
+    return broker.current_time - start_time, broker.messages_sent - start_messages
+
+
+def catch_up(histories, snapshot_intervals, **settings):
+    """
+    Times a follower catching up on each length of history, for each snapshot interval.
+    An interval of 0 means never snapshotting, so the follower is sent every entry.
+    """
+    print("{:>12} {:>16} {:>14} {:>12}".format(
+        'history', 'snapshot every', 'catch-up ms', 'messages'))
+    for history in histories:
+        for snapshot_interval in snapshot_intervals:
+            elapsed, messages = time_catch_up(history, snapshot_interval or float('inf'),
+                                              **settings)
+            print("{:>12} {:>16} {:>14} {:>12}".format(
+                history, snapshot_interval or 'never', elapsed, messages))
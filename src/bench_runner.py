@@ -0,0 +1,139 @@
+"""
+What the benchmarks share: running a seeded scenario on a world with tracing off and
+collecting its metrics, the fault generators scenarios draw from, and the tables of commit
+and client results several benchmarks print.
+"""
+
+import time
+import tracemalloc
+from random import Random
+from world_broker import WorldBroker
+from events import PowerDown, SendDuplicate
+from log_sinks import NullSink
+from tracing import Tracer, OFF
+
+
+# pylint: disable=unused-argument
+def no_faults(broker, rng):
+    "Injects nothing"
+    return []
+
+
+def power_storm(broker, rng):
+    "Powers nodes down for short windows, several times a step, forcing repeated elections"
+    return [PowerDown(start_time=rng.randint(broker.current_time,
+                                             broker.current_time + broker.time_window_length),
+                      event_length=rng.randint(50, 300),
+                      affected_node=rng.choice(broker.node_ids))
+            for _ in range(3)]
+
+
+# pylint: disable=unused-argument
+def duplicate_flood(broker, rng):
+    "Has every node send every message three times, for the whole step"
+    return [SendDuplicate(start_time=broker.current_time,
+                          event_length=broker.time_window_length,
+                          affected_node=node_id)
+            for node_id in broker.node_ids for _ in range(2)]
+
+
+def faults_of_kind(draw, faults_per_step):
+    "Returns a fault generator drawing up to faults_per_step events with draw, each step"
+    return lambda broker, rng: [draw(broker, rng)
+                                for _ in range(rng.randint(0, faults_per_step))]
+
+
+def percentile(histogram, fraction):
+    """
+    Returns the value at the given fraction of the values counted in a histogram, a map of
+    value -> count, or 0 if it is empty
+    """
+    total = sum(histogram.values())
+    rank = min(total - 1, int(total * fraction))
+    for value in sorted(histogram):
+        rank -= histogram[value]
+        if rank < 0:
+            return value
+    return 0
+
+
+# pylint: disable=too-many-locals
+def run_scenario(cluster_size, steps, faults, seed=0, measure_memory=False, **settings):
+    """
+    Runs a scenario with tracing off, drawing delays and faults from a PRNG seeded with seed.
+    Any other settings are passed on to the WorldBroker. Only time spent in execute_step is
+    counted. Returns a map of metrics.
+    """
+    rng = Random(seed)
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), cluster_size=cluster_size,
+                         **settings)
+    if measure_memory:
+        tracemalloc.start()
+    elapsed = 0.0
+    for _ in range(steps):
+        delays = [rng.randint(1, broker.message_send_delay) for _ in range(rng.randint(1, 20))]
+        randomness = {'delays': delays, 'adverse_events': faults(broker, rng)}
+        start = time.perf_counter()
+        broker.execute_step(randomness)
+        elapsed += time.perf_counter() - start
+    metrics = {'wall_seconds': elapsed,
+               'simulated_ms': broker.current_time,
+               'events_dispatched': broker.events_dispatched,
+               'messages_sent': broker.messages_sent,
+               'terms_with_leaders': len(broker.leaders_history),
+               'leader_changes': broker.leader_changes,
+               'leaderless_ms': broker.leaderless_time(),
+               'sim_ms_per_sec': broker.current_time / elapsed,
+               'events_per_sec': broker.events_dispatched / elapsed,
+               'messages_per_sec': broker.messages_sent / elapsed}
+    if settings.get('proposal_interval'):
+        latencies = broker.client_broker['commit_latencies']
+        storages = broker.file_broker.values()
+        metrics.update({
+            'committed_per_sim_sec':
+                broker.client_broker['committed_index'] * 1000.0 / broker.current_time,
+            'commit_p50_ms': percentile(latencies, 0.5),
+            'commit_p99_ms': percentile(latencies, 0.99),
+            'writes_per_sync': sum(storage.writes for storage in storages) /
+                               max(1, sum(storage.syncs for storage in storages))})
+    if settings.get('clients'):
+        client_broker = broker.client_broker
+        metrics.update({
+            'ops_per_sim_sec': client_broker['ops_completed'] * 1000.0 / broker.current_time,
+            'op_p50_ms': percentile(client_broker['op_latencies'], 0.5),
+            'op_p99_ms': percentile(client_broker['op_latencies'], 0.99),
+            'ops_per_entry':
+                client_broker['ops_completed'] / max(1, client_broker['committed_index']),
+            'messages_per_op': broker.messages_sent / max(1, client_broker['ops_completed']),
+            'writes_per_op': sum(storage.writes for storage in broker.file_broker.values()) /
+                             max(1, client_broker['ops_completed'])})
+    if measure_memory:
+        metrics['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+    return metrics
+
+
+def print_commit_header():
+    "Prints the header of a table of replication results"
+    print("{:>20} {:>16} {:>12} {:>12} {:>12}".format(
+        '', 'committed/sim-s', 'p50 ms', 'p99 ms', 'writes/sync'))
+
+
+def print_commit_row(label, metrics):
+    "Prints one row of a table of replication results"
+    print("{:>20} {:>16.1f} {:>12} {:>12} {:>12.2f}".format(
+        label, metrics['committed_per_sim_sec'], metrics['commit_p50_ms'],
+        metrics['commit_p99_ms'], metrics['writes_per_sync']))
+
+
+def print_ops_header():
+    "Prints the header of a table of client workload results"
+    print("{:>20} {:>12} {:>12} {:>12} {:>12}".format(
+        '', 'ops/sim-s', 'p50 ms', 'p99 ms', 'ops/entry'))
+
+
+def print_ops_row(label, metrics):
+    "Prints one row of a table of client workload results"
+    print("{:>20} {:>12.1f} {:>12} {:>12} {:>12.2f}".format(
+        label, metrics['ops_per_sim_sec'], metrics['op_p50_ms'], metrics['op_p99_ms'],
+        metrics['ops_per_entry']))
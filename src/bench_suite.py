@@ -0,0 +1,97 @@
+"""
+The suite of fixed, seeded scenarios benchmark.py runs by default, and the comparison of its
+results against a saved run.
+"""
+
+from bench_runner import no_faults, power_storm, duplicate_flood, run_scenario
+from bench_runner import print_commit_header, print_commit_row, print_ops_header, print_ops_row
+
+
+# (name, cluster size, steps, fault generator, other WorldBroker settings)
+SCENARIOS = [('steady_state', 5, 1000, no_faults, {}),
+             ('election_storm', 5, 1000, power_storm, {}),
+             ('duplicate_flood', 5, 500, duplicate_flood, {}),
+             ('replication', 5, 100, no_faults, {'proposal_interval': 2}),
+             ('durable_replication', 5, 100, no_faults,
+              {'proposal_interval': 2, 'fsync_latency': 4}),
+             ('soak', 5, 100, power_storm, {'proposal_interval': 2}),
+             ('client_workload', 5, 100, no_faults, {'clients': 20}),
+             ('large_cluster_101', 101, 50, no_faults, {}),
+             ('large_cluster_501', 501, 10, no_faults, {})]
+
+# Metrics where a higher value is better. For every other metric, lower is better.
+HIGHER_IS_BETTER = ('sim_ms_per_sec', 'events_per_sec', 'messages_per_sec')
+# Metrics that depend only on the seed, and so change only when behaviour changes.
+DETERMINISTIC = ('simulated_ms', 'events_dispatched', 'messages_sent', 'terms_with_leaders',
+                 'committed_per_sim_sec', 'commit_p50_ms', 'commit_p99_ms', 'writes_per_sync',
+                 'ops_per_sim_sec', 'op_p50_ms', 'op_p99_ms', 'ops_per_entry', 'leader_changes',
+                 'leaderless_ms')
+
+
+def run_suite(names, repeat, measure_memory):
+    """
+    Runs the named scenarios, keeping the fastest of repeat runs of each. Peak memory is
+    measured in a separate run, since tracing allocations slows the simulator down.
+    """
+    results = {}
+    for name, cluster_size, steps, faults, settings in SCENARIOS:
+        if name not in names:
+            continue
+        runs = [run_scenario(cluster_size, steps, faults, **settings) for _ in range(repeat)]
+        results[name] = min(runs, key=lambda metrics: metrics['wall_seconds'])
+        if measure_memory:
+            results[name]['peak_memory_kb'] = run_scenario(
+                cluster_size, steps, faults, measure_memory=True, **settings)['peak_memory_kb']
+    return results
+
+
+def print_results(results):
+    "Prints a table of suite results"
+    print("{:>18} {:>9} {:>12} {:>12} {:>12} {:>12} {:>10}".format(
+        'scenario', 'wall s', 'sim-ms/s', 'events/s', 'messages/s', 'peak KiB', 'leaders'))
+    for name, metrics in results.items():
+        print("{:>18} {:>9.3f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12} {:>10}".format(
+            name, metrics['wall_seconds'], metrics['sim_ms_per_sec'],
+            metrics['events_per_sec'], metrics['messages_per_sec'],
+            "{:.0f}".format(metrics['peak_memory_kb']) if 'peak_memory_kb' in metrics else '-',
+            metrics['terms_with_leaders']))
+    replicated = [name for name in results if 'committed_per_sim_sec' in results[name]]
+    if replicated:
+        print("")
+        print_commit_header()
+        for name in replicated:
+            print_commit_row(name, results[name])
+    with_clients = [name for name in results if 'ops_per_sim_sec' in results[name]]
+    if with_clients:
+        print("")
+        print_ops_header()
+        for name in with_clients:
+            print_ops_row(name, results[name])
+
+
+def compare(baseline, results, threshold):
+    """
+    Prints how each metric changed against a saved baseline, flagging changes worse than
+    threshold (a fraction) as regressions. Returns the number of regressions.
+    """
+    regressions = 0
+    print("{:>18} {:>18} {:>14} {:>14} {:>9}".format(
+        'scenario', 'metric', 'baseline', 'current', 'change'))
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, value in sorted(metrics.items()):
+            if metric not in baseline[name]:
+                continue
+            old = baseline[name][metric]
+            change = (value - old) / old if old else 0.0
+            if metric in DETERMINISTIC:
+                note = 'behaviour changed' if value != old else ''
+            elif metric in HIGHER_IS_BETTER:
+                note = 'REGRESSION' if change < -threshold else ''
+            else:
+                note = 'REGRESSION' if change > threshold else ''
+            regressions += note == 'REGRESSION'
+            print("{:>18} {:>18} {:>14.2f} {:>14.2f} {:>+8.1f}% {}".format(
+                name, metric, old, value, change * 100, note))
+    return regressions
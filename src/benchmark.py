@@ -0,0 +1,296 @@
+#!/usr/local/bin/python3
+"""
+Benchmarks the simulator.
+
+By default, runs a suite of fixed, seeded scenarios and reports wall time, simulated ms,
+events dispatched and messages sent per wall-clock second, and peak memory. Results can be
+saved to a file, and compared against a saved run to catch regressions.
+
+With --micro, instead compares the tick-by-tick and idle-skipping event loops, the cost of
+debug tracing on the node's receive path, and the memory and throughput of the event queue.
+
+With --replication, instead runs a client proposing entries against every combination of
+the given AppendEntries batch sizes and in-flight windows, reporting committed entries per
+simulated second, commit latency, and how many disk writes each sync covered.
+
+With --workload, instead runs closed-loop clients sending increments, fault-free and then
+under each kind of adverse event, reporting completed ops per simulated second and p50/p99
+latency from request to reply.
+
+With --reads, instead runs clients that only read, comparing reads through the log with
+ReadIndex and lease reads, fault-free and with clock skew. Reports read latency, and the
+messages sent and disk writes made per read.
+
+With --elections, instead runs clients under each kind of adverse event with PreVote and
+CheckQuorum each on and off, reporting how often leadership changed, how long the cluster
+went without a leader that could commit, and completed ops per simulated second.
+
+With --failover, instead moves leadership away from a leader serving clients, either by
+powering it down or by a TransferLeadership, and reports how long clients saw no replies
+and how long the cluster had no leader.
+
+With --membership, instead adds a node to a three node cluster while one of its followers
+is down, either as a learner that is promoted once it has caught up or straight away as a
+voter, and reports the commit latency of entries proposed meanwhile.
+
+With --groups, instead runs each number of Raft groups on the same five hosts, fault-free,
+and reports the messages the hosts exchanged, with the heartbeats each host sent another in
+a ms coalesced into one, against the messages the groups sent, and the CPU time it took.
+
+With --checkpoints, instead explores branches from a common prefix of fault steps, either
+replaying the prefix on a new world for each branch or forking each from a checkpoint taken
+after it, and reports the wall time of each and the cost of a checkpoint and a fork.
+
+With --runtime, instead runs a cluster as separate processes over localhost TCP, kills its
+leader a number of times, and compares the real election times and heartbeat traffic with
+the simulator's for the same cluster.
+
+With --catch-up, instead times a follower catching up after being down while the leader
+committed a long history, with and without snapshots.
+
+With --fuzz, instead compares the startup time of the simulation engine with and without
+the Hypothesis state machine, and the steps and faults per second of seeded runs drawing
+from a plain PRNG against Hypothesis drawing from strategies.
+
+With --linearizability, instead runs clients under adverse events for each number of steps,
+and times checking the history they saw is linearizable, by searching and by the counter's
+fast path, against the time the run took, and finding a violation planted in it.
+
+With --codec, instead times encoding and decoding heartbeats, responses and AppendEntries of
+each batch size with the binary codec, against pickle, then counts the encoded bytes sent
+over each link by clients running against a fault-free cluster.
+
+This module only parses the options. The benchmarks of each area are in the bench_*.py
+modules, which run their worlds through bench_runner.
+"""
+
+from optparse import OptionParser
+import json
+import platform
+import sys
+from bench_suite import SCENARIOS, run_suite, print_results, compare
+from bench_micro import micro
+from bench_replication import replication_sweep, catch_up
+from bench_clients import workload, compare_reads, compare_elections, failover
+from bench_cluster import add_node, scale_groups, compare_runtime
+from bench_codec import codec_throughput, link_traffic
+from bench_exploration import compare_branches, check_histories, compare_fuzzing
+
+
+if __name__ == '__main__':
+    parser = OptionParser()
+    parser.add_option("--scenarios", dest="scenarios",
+                      help="Comma separated scenarios to run, from: " +
+                      ", ".join(scenario[0] for scenario in SCENARIOS),
+                      action="store", type="string",
+                      default=",".join(scenario[0] for scenario in SCENARIOS))
+    parser.add_option("--repeat", dest="repeat",
+                      help="Run each scenario this many times, keeping the fastest",
+                      action="store", type="int", default=3)
+    parser.add_option("--no-memory", dest="memory",
+                      help="Don't measure peak memory",
+                      action="store_false", default=True)
+    parser.add_option("--save", dest="save",
+                      help="Save the results to this file",
+                      action="store", type="string", default=None)
+    parser.add_option("--compare", dest="compare",
+                      help="Compare the results against ones saved to this file",
+                      action="store", type="string", default=None)
+    parser.add_option("--threshold", dest="threshold",
+                      help="The fractional slowdown reported as a regression",
+                      action="store", type="float", default=0.1)
+    parser.add_option("--micro", dest="micro",
+                      help="Run the event loop, tracing and event queue micro benchmarks",
+                      action="store_true", default=False)
+    parser.add_option("--fuzz", dest="fuzz",
+                      help="Compare drawing steps from a seeded PRNG with drawing them from "
+                           "Hypothesis strategies",
+                      action="store_true", default=False)
+    parser.add_option("-s", "--ms-per-step", dest="ms_per_step",
+                      help="Comma separated list of ms to emulate per step (--micro)",
+                      action="store", type="string", default="700,7000,70000")
+    parser.add_option("-n", "--steps", dest="steps",
+                      help="The number of steps to run for each configuration "
+                           "(--micro, --replication, --workload, --reads, --groups, --codec, "
+                           "--fuzz)",
+                      action="store", type="int", default=20)
+    parser.add_option("-r", "--receive-calls", dest="receive_calls",
+                      help="The number of heartbeats to deliver when timing Node.receive "
+                           "(--micro)",
+                      action="store", type="int", default=200000)
+    parser.add_option("--replication", dest="replication",
+                      help="Sweep AppendEntries batch sizes and in-flight windows",
+                      action="store_true", default=False)
+    parser.add_option("--batch-sizes", dest="batch_sizes",
+                      help="Comma separated entries per AppendEntries (--replication, --codec)",
+                      action="store", type="string", default="1,8,64")
+    parser.add_option("--windows", dest="windows",
+                      help="Comma separated AppendEntries in flight per follower (--replication)",
+                      action="store", type="string", default="1,4,16")
+    parser.add_option("-p", "--proposal-interval", dest="proposal_interval",
+                      help="ms between client proposals (--replication)",
+                      action="store", type="int", default=1)
+    parser.add_option("--fsync-latency", dest="fsync_latency",
+                      help="ms each sync of a node's disk takes "
+                           "(--replication, --workload, --reads, --catch-up)",
+                      action="store", type="int", default=0)
+    parser.add_option("--disk", dest="disk",
+                      help="Where nodes write their state: memory, or segment files in "
+                           "--storage-dir (--replication, --workload, --reads, --catch-up)",
+                      action="store", type="choice", choices=['memory', 'segments'],
+                      default='memory')
+    parser.add_option("--storage-dir", dest="storage_dir",
+                      help="The directory segment files go in, by default a new temporary one",
+                      action="store", type="string", default=None)
+    parser.add_option("--workload", dest="workload",
+                      help="Run clients sending increments under each kind of fault",
+                      action="store_true", default=False)
+    parser.add_option("--clients", dest="clients",
+                      help="The number of clients, each waiting for one reply at a time "
+                           "(--workload, --reads, --elections, --failover, --codec)",
+                      action="store", type="int", default=20)
+    parser.add_option("--faults-per-step", dest="faults_per_step",
+                      help="The most faults of a kind to inject each step (--workload, --reads, "
+                           "--elections, --fuzz)",
+                      action="store", type="int", default=3)
+    parser.add_option("--reads", dest="reads",
+                      help="Compare reads through the log, by ReadIndex and on leases",
+                      action="store_true", default=False)
+    parser.add_option("--elections", dest="elections",
+                      help="Compare leader changes and leaderless time with PreVote and "
+                           "CheckQuorum on and off, under each kind of fault",
+                      action="store_true", default=False)
+    parser.add_option("--failover", dest="failover",
+                      help="Compare a leader powering down with it transferring leadership",
+                      action="store_true", default=False)
+    parser.add_option("--trials", dest="trials",
+                      help="The number of seeds to run each way of failing over (--failover), "
+                           "or of leaders to kill (--runtime), or of runs (--fuzz)",
+                      action="store", type="int", default=20)
+    parser.add_option("--membership", dest="membership",
+                      help="Compare adding a node as a learner with adding it as a voter",
+                      action="store_true", default=False)
+    parser.add_option("--groups", dest="groups",
+                      help="Comma separated numbers of Raft groups to run on the same hosts",
+                      action="store", type="string", default=None)
+    parser.add_option("--host-tick-ms", dest="host_tick_ms",
+                      help="The ms between the ticks group timers trip on (--groups)",
+                      action="store", type="int", default=10)
+    parser.add_option("--checkpoints", dest="checkpoints",
+                      help="Compare replaying a common prefix with forking from a checkpoint",
+                      action="store_true", default=False)
+    parser.add_option("--prefix-steps", dest="prefix_steps",
+                      help="Comma separated numbers of steps the branches share "
+                           "(--checkpoints)",
+                      action="store", type="string", default="5,20")
+    parser.add_option("--branches", dest="branches",
+                      help="The number of branches to explore from each prefix (--checkpoints)",
+                      action="store", type="int", default=10)
+    parser.add_option("--branch-steps", dest="branch_steps",
+                      help="The number of steps each branch runs (--checkpoints)",
+                      action="store", type="int", default=5)
+    parser.add_option("--runtime", dest="runtime",
+                      help="Compare elections and heartbeats between processes with the "
+                           "simulator's",
+                      action="store_true", default=False)
+    parser.add_option("--quiet-seconds", dest="quiet_seconds",
+                      help="Seconds of heartbeats to measure traffic over (--runtime)",
+                      action="store", type="int", default=3)
+    parser.add_option("--linearizability", dest="linearizability",
+                      help="Comma separated numbers of steps to run clients for, timing "
+                           "checking their history is linearizable",
+                      action="store", type="string", default=None)
+    parser.add_option("--codec", dest="codec",
+                      help="Time the binary codec, and count the bytes sent over each link",
+                      action="store_true", default=False)
+    parser.add_option("--catch-up", dest="catch_up",
+                      help="Time a follower catching up after missing a long history",
+                      action="store_true", default=False)
+    parser.add_option("--histories", dest="histories",
+                      help="Comma separated ms the follower is down for, or the cluster runs "
+                           "before the node is added, with the leader committing an entry "
+                           "each ms (--catch-up, --membership)",
+                      action="store", type="string", default="1000,10000,30000")
+    parser.add_option("--snapshot-intervals", dest="snapshot_intervals",
+                      help="Comma separated entries between snapshots, 0 for never "
+                           "(--catch-up)",
+                      action="store", type="string", default="1000,0")
+    options, args = parser.parse_args(sys.argv)
+    if options.reads:
+        compare_reads(options.clients, options.steps, options.faults_per_step,
+                      fsync_latency=options.fsync_latency, disk=options.disk,
+                      storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.membership:
+        add_node([int(value) for value in options.histories.split(',')],
+                 fsync_latency=options.fsync_latency, disk=options.disk,
+                 storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.codec:
+        codec_throughput([int(value) for value in options.batch_sizes.split(',')])
+        print()
+        link_traffic(options.clients, options.steps, fsync_latency=options.fsync_latency)
+        sys.exit(0)
+    if options.runtime:
+        compare_runtime(5, options.trials, options.quiet_seconds)
+        sys.exit(0)
+    if options.checkpoints:
+        compare_branches([int(value) for value in options.prefix_steps.split(',')],
+                         options.branches, options.branch_steps, clients=options.clients,
+                         fsync_latency=options.fsync_latency)
+        sys.exit(0)
+    if options.groups:
+        scale_groups([int(value) for value in options.groups.split(',')], options.steps,
+                     host_tick_ms=options.host_tick_ms)
+        sys.exit(0)
+    if options.failover:
+        failover(options.clients, options.trials, fsync_latency=options.fsync_latency,
+                 disk=options.disk, storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.elections:
+        compare_elections(options.clients, options.steps, options.faults_per_step,
+                          fsync_latency=options.fsync_latency, disk=options.disk,
+                          storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.workload:
+        workload(options.clients, options.steps, options.faults_per_step,
+                 fsync_latency=options.fsync_latency, disk=options.disk,
+                 storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.catch_up:
+        catch_up([int(value) for value in options.histories.split(',')],
+                 [int(value) for value in options.snapshot_intervals.split(',')],
+                 fsync_latency=options.fsync_latency, disk=options.disk,
+                 storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.replication:
+        replication_sweep([int(value) for value in options.batch_sizes.split(',')],
+                          [int(value) for value in options.windows.split(',')],
+                          options.steps, proposal_interval=options.proposal_interval,
+                          fsync_latency=options.fsync_latency, disk=options.disk,
+                          storage_dir=options.storage_dir)
+        sys.exit(0)
+    if options.linearizability:
+        check_histories([int(value) for value in options.linearizability.split(',')],
+                        options.clients, options.faults_per_step, read_fraction=0.5)
+        sys.exit(0)
+    if options.fuzz:
+        compare_fuzzing(options.trials, options.steps, options.faults_per_step)
+        sys.exit(0)
+    if options.micro:
+        micro([int(value) for value in options.ms_per_step.split(',')], options.steps,
+              options.receive_calls)
+        sys.exit(0)
+
+    suite_results = run_suite(options.scenarios.split(','), options.repeat, options.memory)
+    print_results(suite_results)
+    if options.save:
+        with open(options.save, 'w', encoding='utf-8') as results_file:
+            json.dump({'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'results': suite_results}, results_file, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as baseline_file:
+            saved = json.load(baseline_file)
+        print("")
+        sys.exit(1 if compare(saved['results'], suite_results, options.threshold) else 0)
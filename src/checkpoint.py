@@ -0,0 +1,48 @@
+"""
+Checkpoints of the whole simulated world, which any number of runs can fork from.
+"""
+
+from copy import deepcopy
+from random import Random
+from log_sinks import NullSink
+
+
+class Checkpoint:
+    """
+    A copy of a world at one moment: its nodes, disks, brokers, event queue and the state of
+    every node's PRNG. Forks run on from it independently of each other and of the world it
+    was taken from.
+
+    A copy is a deepcopy of the whole world, except that what is never modified once made
+    is shared rather than copied: messages, queued events, configurations and the sealed
+    chunks of the client history. Logs and disks are copied on write: a copy shares their
+    entries and records with the world it was taken from until either changes them, so a
+    fork only copies the logs and disks it goes on to write to. The event queue is a list of
+    tuples of those shared events, and is copied as a list.
+    """
+
+    def __init__(self, world):
+        self.world = copy_world(world, NullSink())
+
+    def fork(self, log=None):
+        "Returns a world in the checkpointed state, logging into log (by default, a new list)"
+        return copy_world(self.world, log if log is not None else [])
+
+
+class ForkableRandom(Random):
+    """
+    A PRNG that copies its state in one call, rather than as the deepcopy of a tuple of 625
+    ints, which was most of the time a fork took
+    """
+
+    def __deepcopy__(self, memo):
+        "Returns a PRNG in the same state"
+        copy = ForkableRandom()
+        copy.setstate(self.getstate())
+        return copy
+
+
+def copy_world(world, log):
+    "Copies a world, except for its tracer, which is shared, and its log, which log replaces"
+    return deepcopy(world, {id(world.tracer): world.tracer, id(world.test_logging): log,
+                            id(world.action_queue): list(world.action_queue)})
@@ -0,0 +1,80 @@
+"""
+Simulated clients of the cluster.
+"""
+
+from events import ClientRequest, ClientTimeout
+from linearizability import INCREMENT, READ
+
+
+class Client:
+    """
+    A client that sends one request at a time, and sends the next as soon as it hears
+    back. Requests are increments, except for a read_fraction of them, which are reads
+    served the read_mode way. A request goes to the last node known to be elected leader.
+    It is sent again if that node rejects it for not being the leader, or if no reply comes
+    within the client timeout.
+    """
+
+    def __init__(self, client_id, conf, broker):
+        self.client_id = client_id
+        self.conf = conf
+        self.broker = broker
+        self.request_id = 0
+        self.sent_time = None  # when the current request was first sent
+        self.attempt = 0  # how many times the current request has been sent
+        self.waiting = False
+        self.read_mode = None  # how the current request reads, or None for an increment
+
+    def send_next(self):
+        "Starts a new request"
+        self.request_id += 1
+        read_fraction = self.conf['read_fraction']
+        # Every request that takes the running count of reads to a new whole number is one.
+        if int(self.request_id * read_fraction) != int((self.request_id - 1) * read_fraction):
+            self.read_mode = self.conf['read_mode']
+        else:
+            self.read_mode = None
+        self.sent_time = self.broker.current_time
+        self.attempt = 0
+        self.waiting = True
+        history = self.broker.client_broker['history']
+        if history is not None:
+            history.invoke(self.client_id, READ if self.read_mode else INCREMENT)
+        self.send()
+
+    def send(self):
+        "Sends the current request to the last known leader, if any, and starts its timeout"
+        self.attempt += 1
+        leader = self.broker.client_broker['leader']
+        now = self.broker.current_time
+        if leader is not None:
+            self.broker.schedule(ClientRequest(start_time=now + self.broker.client_delay(),
+                                               client_id=self.client_id,
+                                               request_id=self.request_id, node_id=leader,
+                                               read_mode=self.read_mode))
+        self.broker.schedule(ClientTimeout(start_time=now + self.conf['client_timeout'],
+                                           client_id=self.client_id,
+                                           request_id=self.request_id, attempt=self.attempt))
+
+    def rejected(self, request_id, node_id):
+        "Sends the request straight to the new leader, if a different one has been elected"
+        if self.waiting and request_id == self.request_id and \
+                self.broker.client_broker['leader'] != node_id:
+            self.send()
+
+    def timed_out(self, request_id, attempt):
+        "Sends the request again if this attempt went unanswered"
+        if self.waiting and request_id == self.request_id and attempt == self.attempt:
+            self.send()
+
+    def receive(self, request_id, result):
+        "Records the latency and result of the request it answers, then starts the next one"
+        if not self.waiting or request_id != self.request_id:
+            return
+        self.waiting = False
+        client_broker = self.broker.client_broker
+        if client_broker['history'] is not None:
+            client_broker['history'].complete(self.client_id, result)
+        client_broker['ops_completed'] += 1
+        client_broker['op_latencies'][self.broker.current_time - self.sent_time] += 1
+        self.send_next()
@@ -0,0 +1,282 @@
+"""
+A compact binary encoding of messages, for measuring bytes on the wire and for shipping
+messages between processes.
+
+A message is a fixed two byte header, the codec version and the message type, followed by
+each of its fields in __slots__ order. Integers are unsigned LEB128 varints, and flags one
+byte. Integers that may be None, like the term of a compacted entry, are encoded plus one,
+with 0 for None. Entries are a count, then for each entry its term and its command as a length
+prefixed payload, so a decoder can find every entry without decoding any command.
+Commands, snapshot data and configurations are encoded as tagged values.
+"""
+
+import struct
+from message import AppendEntries, AppendEntriesResponse, RequestVote, RequestVoteResponse
+from message import PreVote, PreVoteResponse, TimeoutNow, InstallSnapshot
+from message import InstallSnapshotResponse
+from membership import Configuration
+from multiraft import GroupMessage, CoalescedHeartbeats
+
+VERSION = 1
+HEADER = struct.Struct('>BB')  # version, message type
+
+# Field kinds
+UINT, OPTIONAL_UINT, FLAG, ENTRIES, VALUE, MESSAGE, HEARTBEATS = range(7)
+
+# The kind of every field that isn't an unsigned integer
+FIELD_KINDS = {'prev_log_term': OPTIONAL_UINT, 'success': FLAG, 'vote_granted': FLAG,
+               'leadership_transfer': FLAG, 'done': FLAG, 'installed': FLAG,
+               'entries': ENTRIES, 'data': VALUE, 'configuration': VALUE, 'message': MESSAGE,
+               'heartbeats': HEARTBEATS}
+
+# Message types, by their number on the wire. New types go at the end.
+MESSAGE_TYPES = (AppendEntries, AppendEntriesResponse, RequestVote, RequestVoteResponse,
+                 PreVote, PreVoteResponse, TimeoutNow, InstallSnapshot,
+                 InstallSnapshotResponse, GroupMessage, CoalescedHeartbeats)
+TYPE_CODES = {message_type: code for code, message_type in enumerate(MESSAGE_TYPES)}
+LAYOUTS = [tuple((name, FIELD_KINDS.get(name, UINT)) for name in message_type.__slots__)
+           for message_type in MESSAGE_TYPES]
+
+# Value tags
+NONE, FALSE, TRUE, INT, NEGATIVE_INT, BYTES, STR, TUPLE, CONFIGURATION = range(9)
+
+
+class DecodeError(ValueError):
+    "Raised for bytes that aren't a message this version of the codec encoded"
+    pass
+
+
+def write_uint(out, value):
+    "Appends an unsigned varint to a bytearray"
+    if value < 0x80:
+        if value < 0:
+            raise ValueError("Can't encode a negative varint: {}".format(value))
+        out.append(value)
+        return
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_uint(data, offset):
+    "Returns the unsigned varint at offset, and the offset after it"
+    byte = data[offset]
+    if byte < 0x80:
+        return byte, offset + 1
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        offset += 1
+        byte = data[offset]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset + 1
+        shift += 7
+
+
+def write_value(out, value):
+    "Appends a tagged value: None, a bool, int, bytes, str, tuple or Configuration"
+    # Commands are mostly tuples of small ints, so those are checked first.
+    value_type = type(value)
+    if value_type is int and 0 <= value < 0x80:
+        out.append(INT)
+        out.append(value)
+    elif value_type is tuple:
+        out.append(TUPLE)
+        write_uint(out, len(value))
+        for item in value:
+            write_value(out, item)
+    elif value is None:
+        out.append(NONE)
+    elif value is True or value is False:
+        out.append(TRUE if value else FALSE)
+    elif isinstance(value, int):
+        out.append(INT if value >= 0 else NEGATIVE_INT)
+        write_uint(out, abs(value))
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        out.append(BYTES)
+        write_uint(out, len(value))
+        out += value
+    elif isinstance(value, str):
+        encoded = value.encode()
+        out.append(STR)
+        write_uint(out, len(encoded))
+        out += encoded
+    elif isinstance(value, (tuple, list)):
+        out.append(TUPLE)
+        write_uint(out, len(value))
+        for item in value:
+            write_value(out, item)
+    elif isinstance(value, Configuration):
+        out.append(CONFIGURATION)
+        write_value(out, tuple(sorted(value.voters)))
+        write_value(out, tuple(sorted(value.learners)))
+        write_value(out, tuple(sorted(value.old_voters)) if value.is_joint() else None)
+    else:
+        raise TypeError("Can't encode {!r}".format(value))
+
+
+# pylint: disable=too-many-return-statements
+def read_value(data, offset):
+    "Returns the tagged value at offset, and the offset after it"
+    tag = data[offset]
+    offset += 1
+    if tag == NONE:
+        return None, offset
+    if tag == FALSE or tag == TRUE:
+        return tag == TRUE, offset
+    if tag == INT or tag == NEGATIVE_INT:
+        value, offset = read_uint(data, offset)
+        return (value if tag == INT else -value), offset
+    if tag == BYTES or tag == STR:
+        length, offset = read_uint(data, offset)
+        value = bytes(data[offset:offset + length])
+        return (value if tag == BYTES else value.decode()), offset + length
+    if tag == TUPLE:
+        length, offset = read_uint(data, offset)
+        items = []
+        for _ in range(length):
+            item, offset = read_value(data, offset)
+            items.append(item)
+        return tuple(items), offset
+    if tag == CONFIGURATION:
+        voters, offset = read_value(data, offset)
+        learners, offset = read_value(data, offset)
+        old_voters, offset = read_value(data, offset)
+        return Configuration(voters, learners, old_voters), offset
+    raise DecodeError("Unknown value tag {}".format(tag))
+
+
+class Entries:
+    """
+    The entries of a decoded AppendEntries, as a sequence of (term, command). Only the
+    offsets of the entries are found on decoding; each command is decoded when it is read,
+    straight from the message's bytes. Slices share those bytes.
+    """
+    __slots__ = ('data', 'terms', 'offsets')
+
+    def __init__(self, data, terms, offsets):
+        self.data = data
+        self.terms = terms  # the term of each entry
+        self.offsets = offsets  # where each entry's command starts in data
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Entries(self.data, self.terms[index], self.offsets[index])
+        return self.terms[index], read_value(self.data, self.offsets[index])[0]
+
+    def __iter__(self):
+        data = self.data
+        for term, offset in zip(self.terms, self.offsets):
+            yield term, read_value(data, offset)[0]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def write_entries(out, entries):
+    "Appends a count, then each entry's term and its length prefixed command"
+    write_uint(out, len(entries))
+    command_bytes = bytearray()
+    for term, command in entries:
+        write_uint(out, term)
+        del command_bytes[:]
+        write_value(command_bytes, command)
+        write_uint(out, len(command_bytes))
+        out += command_bytes
+
+
+def read_entries(data, offset):
+    "Finds the entries at offset, without decoding their commands"
+    count, offset = read_uint(data, offset)
+    terms = []
+    offsets = []
+    for _ in range(count):
+        term, offset = read_uint(data, offset)
+        length, offset = read_uint(data, offset)
+        terms.append(term)
+        offsets.append(offset)
+        offset += length
+    return Entries(data, terms, offsets), offset
+
+
+def write_message(out, message):
+    "Appends a message's header and fields"
+    code = TYPE_CODES[message.__class__]
+    out += HEADER.pack(VERSION, code)
+    for name, kind in LAYOUTS[code]:
+        value = getattr(message, name)
+        if kind == UINT:
+            write_uint(out, value)
+        elif kind == OPTIONAL_UINT:
+            write_uint(out, 0 if value is None else value + 1)
+        elif kind == FLAG:
+            out.append(1 if value else 0)
+        elif kind == ENTRIES:
+            write_entries(out, value)
+        elif kind == VALUE:
+            write_value(out, value)
+        elif kind == MESSAGE:
+            write_message(out, value)
+        else:
+            write_uint(out, len(value))
+            for group, heartbeat in value:
+                write_uint(out, group)
+                write_message(out, heartbeat)
+
+
+def read_message(data, offset):
+    "Returns the message at offset, and the offset after it"
+    version, code = HEADER.unpack_from(data, offset)
+    if version != VERSION:
+        raise DecodeError("Unsupported codec version {}".format(version))
+    if code >= len(MESSAGE_TYPES):
+        raise DecodeError("Unknown message type {}".format(code))
+    offset += HEADER.size
+    values = []
+    for _, kind in LAYOUTS[code]:
+        if kind == UINT:
+            value, offset = read_uint(data, offset)
+        elif kind == OPTIONAL_UINT:
+            value, offset = read_uint(data, offset)
+            value = None if value == 0 else value - 1
+        elif kind == FLAG:
+            value = data[offset] != 0
+            offset += 1
+        elif kind == ENTRIES:
+            value, offset = read_entries(data, offset)
+        elif kind == VALUE:
+            value, offset = read_value(data, offset)
+        elif kind == MESSAGE:
+            value, offset = read_message(data, offset)
+        else:
+            count, offset = read_uint(data, offset)
+            value = []
+            for _ in range(count):
+                group, offset = read_uint(data, offset)
+                heartbeat, offset = read_message(data, offset)
+                value.append((group, heartbeat))
+        values.append(value)
+    return MESSAGE_TYPES[code](*values), offset
+
+
+def encode(message):
+    "Returns a message's bytes"
+    out = bytearray()
+    write_message(out, message)
+    return bytes(out)
+
+
+def decode(data):
+    """
+    Returns the message that data, bytes or a memoryview, holds. Its entries are read from
+    data when needed, so data must not be modified afterwards.
+    """
+    message, offset = read_message(data, 0)
+    if offset != len(data):
+        raise DecodeError("{} bytes left over after a message".format(len(data) - offset))
+    return message
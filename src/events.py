@@ -1,29 +1,67 @@
 """
 The Events module includes classes for each event that the system can process.
+
+Events keep their fields in __slots__ rather than a dict. Each class lists the fields it
+adds in __slots__, and takes every field as a keyword argument.
 """
-from copy import copy
 from node import DownNode
 
 
 class Event(object):
     """
     The Base Event Class. Includes shared behavior.
-    """
 
-    def __init__(self, event_map):
-        self.event_map = copy(event_map)
-        self.event_map['event_type'] = self.__class__.__name__
+    Events are ordered by start time, then by sequence number. The broker assigns sequence
+    numbers as it queues events, so events starting at the same time run in queued order.
+    """
+    __slots__ = ('start_time', 'sequence')
+
+    # Maps each event class to the names of its fields, collected from its __slots__.
+    _field_names = {}
+
+    def __init__(self, **fields):
+        self.sequence = 0
+        for name in self.field_names():
+            setattr(self, name, fields.pop(name))
+        assert not fields, "Unexpected fields for {}: {}".format(
+            self.__class__.__name__, sorted(fields))
+
+    @classmethod
+    def field_names(cls):
+        "Returns the names of every field of this event class"
+        if cls not in Event._field_names:
+            names = []
+            for klass in reversed(cls.__mro__):
+                names.extend(name for name in klass.__dict__.get('__slots__', ())
+                             if name != 'sequence')
+            Event._field_names[cls] = tuple(names)
+        return Event._field_names[cls]
+
+    @property
+    def event_map(self):
+        "Builds a dict of the event's fields, for logging"
+        event_map = {name: getattr(self, name) for name in self.field_names()}
+        event_map['event_type'] = self.__class__.__name__
+        return event_map
+
+    def __deepcopy__(self, memo):
+        "Events aren't modified once queued, so copies of the world share them"
+        return self
+
+    def sort_key(self):
+        "The key events are ordered by"
+        return (self.start_time, self.sequence)
 
     def __lt__(self, other):
-        return self.event_map['start_time'] < other.event_map['start_time']
+        return self.sort_key() < other.sort_key()
 
-    def __eq__(self, other):
-        # WARNING: this completely breaks object equality.
-        return self.event_map['start_time'] == other.event_map['start_time']
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, ", ".join(
+            "{}={!r}".format(name, getattr(self, name)) for name in self.field_names()))
 
     def get_start_time(self):
         "Gets the start time of an event"
-        return self.event_map['start_time']
+        return self.start_time
 
     # pylint: disable=no-self-use
     def backout(self):
@@ -34,14 +72,12 @@ class Event(object):
 
     def window_terminus(self):
         """
-        Returns a new event_map with the start at the end of this one, and no event length.
-        Used for the reversing event at the end of a window.
+        Returns the fields of this event with the start at the end of this one, and no event
+        length. Used for the reversing event at the end of a window.
         """
-        ret = copy(self.event_map)
-        event_end = ret['event_length'] + ret['start_time']
-        del ret['event_length']
-        ret['start_time'] = event_end
-        return ret
+        fields = {name: getattr(self, name) for name in self.field_names()}
+        fields['start_time'] = self.start_time + fields.pop('event_length')
+        return fields
 
 # --------------------------Network Management------------------------------------
 
@@ -50,6 +86,8 @@ class NetworkEvent(Event):
     """
     Base class for all network events
     """
+    __slots__ = ()
+
     def handle(self, nodes, network_broker):
         """
         Handle will update the network broker to process the event
@@ -59,88 +97,91 @@ class NetworkEvent(Event):
 
 class SendDrop(NetworkEvent):
     "Drops all delivery sent from a specified node"
+    __slots__ = ('affected_nodes', 'event_length')
+
     def backout(self):
-        return [StopSendDrop(self.window_terminus())]
+        return [StopSendDrop(**self.window_terminus())]
 
 
 class StopSendDrop(NetworkEvent):
     "Backs out the DeliveryDrop event"
-    pass
+    __slots__ = ('affected_nodes',)
 
 
 class SendDelay(NetworkEvent):
     "Delays all messages sent from the specified node"
+    __slots__ = ('affected_nodes', 'delay', 'event_length')
 
     def backout(self):
-        return [StopSendDelay(self.window_terminus())]
-       
+        return [StopSendDelay(**self.window_terminus())]
+
 
 class StopSendDelay(NetworkEvent):
     "Backs out the SendDelay event"
-    pass
+    __slots__ = ('affected_nodes', 'delay')
 
 
 class ReceiveDrop(NetworkEvent):
     "Drops all messages the specified node would otherwise receive"
+    __slots__ = ('affected_nodes', 'event_length')
+
     def backout(self):
-        return [StopReceiveDrop(self.window_terminus())]
+        return [StopReceiveDrop(**self.window_terminus())]
 
     def handle(self, nodes, network_broker):
-        for to_node in self.event_map['affected_nodes']:
-            for from_node in nodes:
-                network_broker['connections'].discard((from_node, to_node))
+        for to_node in self.affected_nodes:
+            network_broker.set_receiving(to_node, False)
 
 
 class StopReceiveDrop(NetworkEvent):
     "Backs out the ReceiveDrop event"
+    __slots__ = ('affected_nodes',)
+
     def handle(self, nodes, network_broker):
-        for to_node in self.event_map['affected_nodes']:
-            for from_node in nodes:
-                network_broker['connections'].add((from_node, to_node))
+        for to_node in self.affected_nodes:
+            network_broker.set_receiving(to_node, True)
 
 
 class TransmitDrop(NetworkEvent):
     """
     TransmitDrop represents all packets sent between two nodes being dropped.
     """
+    __slots__ = ('affected_node_pair', 'event_length')
 
     def backout(self):
-        return [StopTransmitDrop(self.window_terminus())]
+        return [StopTransmitDrop(**self.window_terminus())]
 
     def handle(self, nodes, network_broker):
-        pair = self.event_map['affected_node_pair']
-        network_broker['connections'].discard(pair)
+        network_broker.set_link(self.affected_node_pair[0], self.affected_node_pair[1], False)
 
 
 class StopTransmitDrop(NetworkEvent):
     "Backs out the TransitDrop event"
+    __slots__ = ('affected_node_pair',)
+
     def handle(self, nodes, network_broker):
-        pair = self.event_map['affected_node_pair']
-        network_broker['connections'].add(pair)
+        network_broker.set_link(self.affected_node_pair[0], self.affected_node_pair[1], True)
 
 
 class SendDuplicate(NetworkEvent):
     """
     DeliveryDuplicates Represents all messaages that a node attempts to deliver being duplicated.
     """
+    __slots__ = ('affected_node', 'event_length')
+
     def backout(self):
-        return [StopSendDuplicate(self.window_terminus())]
+        return [StopSendDuplicate(**self.window_terminus())]
 
     def handle(self, nodes, network_broker):
-        from_node = self.event_map['affected_node']
-        for to_node in nodes:
-            if from_node != to_node:
-                network_broker['duplicates'][(from_node, to_node)] += 1
+        network_broker.add_duplicates(self.affected_node, 1)
 
 
 class StopSendDuplicate(NetworkEvent):
     "Backs out the DeliveryDuplicate event"
+    __slots__ = ('affected_node',)
+
     def handle(self, nodes, network_broker):
-        from_node = self.event_map['affected_node']
-        for to_node in nodes:
-            if from_node != to_node:
-                network_broker['duplicates'][(from_node, to_node)] = max(
-                    0, network_broker['duplicates'][(from_node, to_node)] - 1)
+        network_broker.add_duplicates(self.affected_node, -1)
 
 
 class DeliverMessage(NetworkEvent):
@@ -149,30 +190,36 @@ class DeliverMessage(NetworkEvent):
     This checks if there is a network disruption that prevents the message from being delivered,
     and the case that power is down on the node is taken care of due to DownNodes in the nodes arg.
     """
+    __slots__ = ('affected_node', 'sender', 'data')
+
+    # pylint: disable=super-init-not-called
+    def __init__(self, start_time, affected_node, sender, data):
+        # Spelled out, rather than using Event.__init__, since there is one per message sent.
+        self.start_time = start_time
+        self.sequence = 0
+        self.affected_node = affected_node
+        self.sender = sender
+        self.data = data
 
     def handle(self, nodes, network_broker):
-        from_node = self.event_map['sender']
-        to_node = self.event_map['affected_node']
-        if (from_node, to_node) in network_broker['connections']:
-            nodes[to_node].receive(from_node, self.event_map['data'])
+        if network_broker.connected(self.sender, self.affected_node):
+            nodes[self.affected_node].receive(self.sender, self.data)
 
 
 class HealNetwork(NetworkEvent):
     "Backs out all Network events"
+    __slots__ = ()
+
     def handle(self, nodes, network_broker):
-        node_ids = nodes.keys()
-        network_broker['connections'] = set(
-            [(f, t) for f in node_ids for t in node_ids if t != f])
-        network_broker['delays'] = {
-            (f, t): 0 for f in node_ids for t in node_ids if t != f}
-        network_broker['duplicates'] = {
-            (f, t): 0 for f in node_ids for t in node_ids if t != f}
+        network_broker.heal()
 
 
 # --------------------------Power Management------------------------------------
 
 class PowerEvent(Event):
     "Base class for Power events"
+    __slots__ = ()
+
     def handle(self, nodes, power_broker):
         "This must be implemented by subclasses"
         pass
@@ -182,11 +229,13 @@ class PowerDown(PowerEvent):
     """
     PowerDown Represents a node shutting down.
     """
+    __slots__ = ('affected_node', 'event_length')
+
     def backout(self):
-        return [StopPowerDown(self.window_terminus())]
+        return [StopPowerDown(**self.window_terminus())]
 
     def handle(self, nodes, power_broker):
-        node_id = self.event_map['affected_node']
+        node_id = self.affected_node
         if node_id not in power_broker['down_nodes']:
             power_broker['down_nodes'][node_id] = power_broker['nodes'][node_id]
             power_broker['nodes'][node_id] = DownNode()
@@ -196,9 +245,10 @@ class StopPowerDown(PowerEvent):
     """
     StopPowerDown Represents a node coming back up.
     """
+    __slots__ = ('affected_node',)
 
     def handle(self, nodes, power_broker):
-        node_id = self.event_map['affected_node']
+        node_id = self.affected_node
         if node_id in power_broker['down_nodes']:
             power_broker['nodes'][node_id] = power_broker['down_nodes'][node_id]
             del power_broker['down_nodes'][node_id]
@@ -206,6 +256,8 @@ class StopPowerDown(PowerEvent):
 
 class HealPower(PowerEvent):
     "Backs out all power events"
+    __slots__ = ()
+
     def handle(self, nodes, power_broker):
         for node_id, node in power_broker['down_nodes']:
             power_broker['nodes'][node_id] = node
@@ -216,6 +268,8 @@ class HealPower(PowerEvent):
 
 class TimerEvent(Event):
     "Base class for Timer Events"
+    __slots__ = ()
+
     def handle(self, nodes, time_broker):
         "sub classes must implement this method"
         pass
@@ -225,13 +279,152 @@ class ClockSkew(TimerEvent):
     """
     ClockSkew Represents a one time skew of a clock on an individual node.
     """
+    __slots__ = ('affected_node', 'skew_amount', 'event_length')
+
     def handle(self, nodes, time_broker):
-        time_broker['node_time_offsets'][self.event_map['affected_node']]\
-            += self.event_map['skew_amount']
+        node_id = self.affected_node
+        offsets = time_broker['node_time_offsets']
+        offset = offsets[node_id] + self.skew_amount
+        spread = time_broker['max_clock_spread']
+        if spread is not None and len(offsets) > 1:
+            # The clocks stay within spread ms of each other, as nodes relying on leases assume.
+            others = [offsets[other] for other in offsets if other != node_id]
+            offset = min(max(offset, max(others) - spread), min(others) + spread)
+        offsets[node_id] = offset
+        # The pending timer now trips at a different global time. The node doesn't notice.
+        time_broker['node_timers'].reschedule(node_id)
 
 
 class HealTimer(TimerEvent):
     "Backs out all timer events"
+    __slots__ = ()
+
     def handle(self, nodes, time_broker):
-        for node_id in time_broker['node_timers']:
-            time_broker['node_timers'][node_id] = 0
+        time_broker['node_timers'].clear_all()
+
+#------------------------ File Management---------------------------------------
+
+
+class FileEvent(Event):
+    "Base class for disk events"
+    __slots__ = ()
+
+    def handle(self, nodes, file_broker):
+        "sub classes must implement this method"
+        pass
+
+
+class SyncComplete(FileEvent):
+    """
+    SyncComplete represents a node's fsync finishing, making the writes it covers durable
+    and releasing the messages that waited on them. Syncs lost in a crash are ignored.
+    """
+    __slots__ = ('affected_node', 'sync_id')
+
+    def handle(self, nodes, file_broker):
+        sends = file_broker[self.affected_node].complete_sync(self.sync_id)
+        nodes[self.affected_node].synced(sends)
+
+#------------------------ Client Requests---------------------------------------
+
+
+class ClientEvent(Event):
+    "Base class for requests made by clients of the cluster"
+    __slots__ = ()
+
+    def handle(self, nodes, client_broker):
+        "sub classes must implement this method"
+        pass
+
+
+class ProposeEntry(ClientEvent):
+    """
+    ProposeEntry represents a client asking the last known leader to append a command.
+    The proposal is dropped if that node is down or no longer the leader.
+    """
+    __slots__ = ('command',)
+
+    def handle(self, nodes, client_broker):
+        leader = client_broker['leader']
+        index = nodes[leader].propose(self.command) if leader is not None else None
+        if index is None:
+            client_broker['proposals_dropped'] += 1
+        else:
+            client_broker['proposal_times'][index] = (nodes[leader].term, self.start_time)
+
+
+class TransferLeadership(ClientEvent):
+    """
+    TransferLeadership represents an operator asking the last known leader to hand
+    leadership to target_node, or to its most up to date follower if that is None, as before
+    planned maintenance.
+    """
+    __slots__ = ('target_node',)
+
+    def handle(self, nodes, client_broker):
+        leader = client_broker['leader']
+        if leader is not None:
+            nodes[leader].transfer_leadership(self.target_node)
+
+
+class AddNode(ClientEvent):
+    """
+    AddNode represents an operator asking the last known leader to add node_id to the
+    cluster. With learner set, it joins as a learner, and becomes a voter once it has caught
+    up. Otherwise it's a voter straight away. The request is dropped if another membership
+    change is in progress.
+    """
+    __slots__ = ('node_id', 'learner')
+
+    def handle(self, nodes, client_broker):
+        leader = client_broker['leader']
+        if leader is not None:
+            nodes[leader].add_node(self.node_id, self.learner)
+
+
+class RemoveNode(ClientEvent):
+    """
+    RemoveNode represents an operator asking the last known leader to remove node_id from
+    the cluster. The request is dropped if another membership change is in progress.
+    """
+    __slots__ = ('node_id',)
+
+    def handle(self, nodes, client_broker):
+        leader = client_broker['leader']
+        if leader is not None:
+            nodes[leader].remove_node(self.node_id)
+
+
+class ClientRequest(ClientEvent):
+    """
+    ClientRequest represents a client's increment, or its read if read_mode is set,
+    arriving at the node it thinks is the leader. A node that isn't the leader rejects it,
+    and the client tries again.
+    """
+    __slots__ = ('client_id', 'request_id', 'node_id', 'read_mode')
+
+    def handle(self, nodes, client_broker):
+        if not nodes[self.node_id].submit(self.client_id, self.request_id, self.read_mode):
+            client_broker['clients'][self.client_id].rejected(self.request_id, self.node_id)
+
+
+class ClientResponse(ClientEvent):
+    """
+    ClientResponse represents the leader's reply reaching a client, once the client's
+    request has been committed and applied.
+    """
+    __slots__ = ('client_id', 'request_id', 'result')
+
+    def handle(self, nodes, client_broker):
+        client_broker['clients'][self.client_id].receive(self.request_id, self.result)
+
+
+class ClientTimeout(ClientEvent):
+    """
+    ClientTimeout represents a client giving up on an attempt at a request, and sending it
+    again if it still hasn't heard back.
+    """
+    __slots__ = ('client_id', 'request_id', 'attempt')
+
+    def handle(self, nodes, client_broker):
+        client_broker['clients'][self.client_id].timed_out(self.request_id, self.attempt)
@@ -0,0 +1,124 @@
+"""
+Seeded generation of simulation steps, drawing the same kinds of randomness as
+WorldMachine.steps from a plain PRNG instead of Hypothesis strategies.
+"""
+
+# pylint: disable=unused-wildcard-import
+# pylint: disable=wildcard-import
+from events import *
+
+
+def draw_basic_event(broker, rng, event_type, additional_map):
+    "Builds an event starting within the next step, like WorldMachine.gen_basic_event"
+    fields = {'start_time': rng.randint(broker.current_time,
+                                        broker.current_time + broker.time_window_length),
+              'event_length': rng.randint(1, broker.event_window_length)}
+    fields.update(additional_map)
+    return event_type(**fields)
+
+
+def draw_node_set(broker, rng):
+    "Draws a possibly empty set of node ids"
+    return set(node_id for node_id in broker.node_ids if rng.random() < 0.5)
+
+
+def draw_node_pair(broker, rng):
+    "Draws an ordered pair of distinct node ids"
+    return tuple(rng.sample(list(broker.node_ids), 2))
+
+
+def draw_delay(broker, rng):
+    "Draws the delay field carried by network events"
+    return rng.randint(1, broker.event_window_length)
+
+
+def draw_send_delay(broker, rng):
+    "Draws a SendDelay event"
+    return draw_basic_event(broker, rng, SendDelay,
+                            {'affected_nodes': draw_node_set(broker, rng),
+                             'delay': draw_delay(broker, rng)})
+
+
+def draw_send_drop(broker, rng):
+    "Draws a SendDrop event"
+    return draw_basic_event(broker, rng, SendDrop, {'affected_nodes': draw_node_set(broker, rng)})
+
+
+def draw_receive_drop(broker, rng):
+    "Draws a ReceiveDrop event"
+    return draw_basic_event(broker, rng, ReceiveDrop,
+                            {'affected_nodes': draw_node_set(broker, rng)})
+
+
+def draw_transmit_drop(broker, rng):
+    "Draws a TransmitDrop event"
+    return draw_basic_event(broker, rng, TransmitDrop,
+                            {'affected_node_pair': draw_node_pair(broker, rng)})
+
+
+def draw_send_duplicate(broker, rng):
+    "Draws a SendDuplicate event"
+    return draw_basic_event(broker, rng, SendDuplicate,
+                            {'affected_node': rng.choice(list(broker.node_ids))})
+
+
+def draw_power_down(broker, rng):
+    "Draws a PowerDown event"
+    return draw_basic_event(broker, rng, PowerDown,
+                            {'affected_node': rng.choice(list(broker.node_ids))})
+
+
+def draw_clock_skew(broker, rng):
+    "Draws a ClockSkew event"
+    return draw_basic_event(broker, rng, ClockSkew,
+                            {'affected_node': rng.choice(list(broker.node_ids)),
+                             'skew_amount': rng.randint(-100, 100)})
+
+
+def draw_membership_change(broker, rng):
+    "Draws an AddNode or RemoveNode event for any node"
+    start_time = rng.randint(broker.current_time, broker.current_time + broker.time_window_length)
+    node_id = rng.choice(list(broker.node_ids))
+    if rng.random() < 0.5:
+        return AddNode(start_time=start_time, node_id=node_id, learner=rng.random() < 0.5)
+    return RemoveNode(start_time=start_time, node_id=node_id)
+
+
+NETWORK_EVENTS = (draw_send_delay, draw_send_drop, draw_receive_drop, draw_transmit_drop,
+                  draw_send_duplicate)
+
+# Every kind of adverse event, by event name
+ADVERSE_EVENTS = {'SendDelay': draw_send_delay,
+                  'SendDrop': draw_send_drop,
+                  'ReceiveDrop': draw_receive_drop,
+                  'TransmitDrop': draw_transmit_drop,
+                  'SendDuplicate': draw_send_duplicate,
+                  'PowerDown': draw_power_down,
+                  'ClockSkew': draw_clock_skew}
+
+
+def draw_network_event(broker, rng):
+    "Draws one of the network events"
+    return NETWORK_EVENTS[rng.randrange(len(NETWORK_EVENTS))](broker, rng)
+
+
+def draw_adverse_event(broker, rng):
+    "Draws a network, power or clock event"
+    kind = rng.randrange(3)
+    if kind == 0:
+        return draw_network_event(broker, rng)
+    elif kind == 1:
+        return draw_power_down(broker, rng)
+    return draw_clock_skew(broker, rng)
+
+
+def draw_step(broker, rng, max_delays=20):
+    "Draws the randomness for one execute_step call"
+    delays = [rng.randint(1, broker.message_send_delay)
+              for _ in range(rng.randint(0, max_delays))]
+    adverse_events = [draw_adverse_event(broker, rng)
+                      for _ in range(rng.randint(0, broker.catastrophy_level))]
+    if broker.spare_nodes:
+        adverse_events.extend(draw_membership_change(broker, rng)
+                              for _ in range(rng.randint(0, 2)))
+    return {'delays': delays, 'adverse_events': adverse_events}
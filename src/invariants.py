@@ -0,0 +1,103 @@
+"""
+Raft safety invariants, checked incrementally as nodes change state.
+"""
+
+import collections
+from bisect import bisect_right
+
+
+class Invariant:
+    """
+    Base class for invariants. Nodes notify the broker of each state transition, and the
+    broker forwards it to the matching method, so checks only run when relevant state changes.
+    """
+
+    def change_type(self, node):
+        "Called after a node changes type"
+        pass
+
+    def update_term(self, node):
+        "Called after a node moves to a new term"
+        pass
+
+    def commit(self, node):
+        "Called after a node advances its commit index"
+        pass
+
+
+class OneLeaderPerTerm(Invariant):
+    """
+    At most one node is ever elected leader in a given term.
+    """
+
+    def __init__(self):
+        self.leaders_history = collections.defaultdict(set)
+
+    def record_leader(self, node):
+        "Adds the node to the leaders of its current term, if it is a leader"
+        if node.is_leader():
+            leaders = self.leaders_history[node.term]
+            leaders.add(node.node_id)
+            assert len(leaders) <= 1, \
+                "Term {} has multiple leaders: {}".format(node.term, sorted(leaders))
+
+    def change_type(self, node):
+        self.record_leader(node)
+
+    def update_term(self, node):
+        self.record_leader(node)
+
+
+class CommittedEntriesMatch(Invariant):
+    """
+    Once an entry is committed at an index, every node that commits that index has the same
+    entry there. Entries are compared by term, which with the Log Matching property implies
+    the same command.
+
+    Committed terms are kept as runs, like a node's log, so memory grows with the number of
+    terms rather than entries. Entries a node has compacted into a snapshot can't be
+    checked, and an index first committed that way is left unchecked for every node.
+    """
+
+    def __init__(self):
+        self.run_starts = []  # the first index of each run of committed entries
+        self.run_terms = []  # the term of each run, or None where it isn't known
+        self.committed_length = 0
+        self.checked_up_to = {}  # node id -> the commit index already checked
+
+    def committed_term(self, index):
+        "Returns the term committed at index, which must be at most committed_length"
+        return self.run_terms[bisect_right(self.run_starts, index) - 1]
+
+    def record(self, term):
+        "Records the term committed at the index after committed_length"
+        self.committed_length += 1
+        if not self.run_terms or self.run_terms[-1] != term:
+            self.run_starts.append(self.committed_length)
+            self.run_terms.append(term)
+
+    def commit(self, node):
+        start = self.checked_up_to.get(node.node_id, 0)
+        for index in range(start + 1, node.commit_index + 1):
+            term = node.term_at(index)
+            if index > self.committed_length:
+                self.record(term)
+            elif term is not None:
+                committed = self.committed_term(index)
+                assert committed is None or committed == term, \
+                    "Index {} was committed with terms {} and {}".format(index, committed, term)
+        self.checked_up_to[node.node_id] = max(start, node.commit_index)
+
+
+class InvariantChecker:
+    """
+    Dispatches node state transitions to every registered invariant.
+    """
+
+    def __init__(self, invariants):
+        self.invariants = invariants
+
+    def notify(self, node, transition):
+        "Runs each invariant's check for the given transition"
+        for invariant in self.invariants:
+            getattr(invariant, transition)(node)
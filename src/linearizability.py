@@ -0,0 +1,266 @@
+"""
+Records what clients see of the cluster, and checks it's linearizable: that each operation
+can be placed at one point between its invocation and its completion such that the counter,
+applying them one at a time in that order, returns what the clients were told.
+"""
+
+INCREMENT = 'increment'
+READ = 'read'
+
+
+class History:
+    """
+    What clients asked for and were told. Completed operations are kept as (client id, kind,
+    result, invoked, completed) tuples, where invoked and completed are positions in the
+    order things happened, which ms can't tell apart. Every CHUNK_SIZE of them are sealed
+    into a tuple that copies of the history share, so checkpointing a world copies only the
+    operations since the last chunk.
+    """
+    CHUNK_SIZE = 1024
+
+    def __init__(self):
+        self.chunks = []  # tuples of CHUNK_SIZE completed operations, never modified
+        self.recent = []  # the completed operations since the last chunk
+        self.waiting = {}  # client id -> (kind, invoked) of the operation it waits on
+        self.clock = 0
+
+    def __deepcopy__(self, memo):
+        copy = History()
+        copy.chunks = list(self.chunks)
+        copy.recent = list(self.recent)
+        copy.waiting = dict(self.waiting)
+        copy.clock = self.clock
+        return copy
+
+    def invoke(self, client_id, kind):
+        "Records a client invoking an operation"
+        self.clock += 1
+        self.waiting[client_id] = (kind, self.clock)
+
+    def complete(self, client_id, result):
+        "Records the operation a client waits on completing with result"
+        self.clock += 1
+        kind, invoked = self.waiting.pop(client_id)
+        self.recent.append((client_id, kind, result, invoked, self.clock))
+        if len(self.recent) == self.CHUNK_SIZE:
+            self.chunks.append(tuple(self.recent))
+            self.recent = []
+
+    def operations(self):
+        "Returns every operation, with result and completed None for those still waiting"
+        operations = [operation for chunk in self.chunks for operation in chunk]
+        operations.extend(self.recent)
+        operations.extend((client_id, kind, None, invoked, None)
+                          for client_id, (kind, invoked) in self.waiting.items())
+        return operations
+
+
+# pylint: disable=too-few-public-methods
+class CounterModel:
+    "The Counter as clients see it. Increments return the new count, and reads the count."
+    initial = 0
+
+    @staticmethod
+    def step(state, kind, result):
+        """
+        Returns the count after an operation, or None if it couldn't have returned result. An
+        operation that never completed could have returned anything.
+        """
+        if kind == INCREMENT:
+            state += 1
+        if result is not None and result != state:
+            return None
+        return state
+
+
+def segments(operations):
+    """
+    Returns operations, as (client id, kind, result, invoked, completed) with result and
+    completed None for those still waiting, as (kind, result, invoked, completed) tuples in
+    segments that no operation spans: every operation of a segment is invoked after each of
+    the segment before completed. Operations still waiting complete after everything else.
+    Reads still waiting are left out, since they change nothing and returned nothing.
+    """
+    operations = [(kind, result, invoked, completed if completed is not None else float('inf'))
+                  for _, kind, result, invoked, completed in operations
+                  if completed is not None or kind != READ]
+    operations.sort(key=lambda operation: operation[2])
+    result = []
+    last_completed = 0
+    for operation in operations:
+        if operation[2] > last_completed:
+            result.append([])
+        result[-1].append(operation)
+        last_completed = max(last_completed, operation[3])
+    return result
+
+
+# pylint: disable=too-many-locals,too-many-statements
+def check_segment(operations, state, model):
+    """
+    Searches for a linearization of operations, sorted by invocation, starting from state.
+    Returns the state after them, or None if there isn't one, with the number of operations
+    of the longest linearizable prefix found.
+
+    This is Wing and Gong's search, with Lowe's memoization: operations and their
+    completions are kept in a list in the order they happened, and at each step any
+    operation invoked before the first completion left in the list may be linearized next.
+    A dead end backtracks. Configurations, the set of operations linearized and the state,
+    are only explored once. Sets are kept as the first operation not linearized and a bitset
+    of those after it, so they stay the size of the operations in flight.
+    """
+    count = len(operations)
+    # Entry 2i is operation i's invocation and 2i + 1 its completion, linked in time order.
+    times = []
+    for operation in operations:
+        times.extend(operation[2:])
+    head = 2 * count
+    following = [None] * (head + 1)
+    preceding = [None] * (head + 1)
+    previous = head
+    for entry in sorted(range(head), key=times.__getitem__):
+        following[previous] = entry
+        preceding[entry] = previous
+        previous = entry
+
+    step = model.step
+    first = 0  # every operation before it is linearized
+    linearized = 0  # a bit for each operation from first on that is
+    explored = set()
+    stack = []
+    furthest = 0
+    entry = following[head]
+    while following[head] is not None:
+        if entry & 1:
+            # An operation completed without being linearized, so undo the last step.
+            if not stack:
+                return None, furthest
+            entry, state, first, linearized = stack.pop()
+            completion = entry | 1
+            if following[completion] is not None:
+                preceding[following[completion]] = completion
+            following[preceding[completion]] = completion
+            preceding[following[entry]] = entry
+            following[preceding[entry]] = entry
+            entry = following[entry]
+            continue
+        index = entry >> 1
+        new_state = step(state, operations[index][0], operations[index][1])
+        if new_state is not None:
+            new_first = first
+            new_linearized = linearized | 1 << (index - first)
+            while new_linearized & 1:
+                new_linearized >>= 1
+                new_first += 1
+            configuration = (new_first, new_linearized, new_state)
+            if configuration not in explored:
+                explored.add(configuration)
+                stack.append((entry, state, first, linearized))
+                state, first, linearized = new_state, new_first, new_linearized
+                furthest = max(furthest, first)
+                # Take the operation, and its completion, out of the list.
+                following[preceding[entry]] = following[entry]
+                preceding[following[entry]] = preceding[entry]
+                completion = entry | 1
+                following[preceding[completion]] = following[completion]
+                if following[completion] is not None:
+                    preceding[following[completion]] = preceding[completion]
+                entry = following[head]
+                continue
+        entry = following[entry]
+    return state, count
+
+
+def check_operations(operations, model=CounterModel):
+    """
+    Checks operations, as (client id, kind, result, invoked, completed) with result and
+    completed None for those still waiting, are linearizable, segment by segment. Returns
+    None if they are, or else describes the first operation they couldn't be linearized past.
+
+    Each segment starts from the state the one before ended in, under the linearization
+    found for it. That is only exact for models whose state after a set of operations
+    doesn't depend on their order, as the counter's doesn't.
+    """
+    state = model.initial
+    for segment in segments(operations):
+        state, linearized = check_segment(segment, state, model)
+        if state is None:
+            kind, result, invoked, completed = segment[linearized]
+            return "Client history isn't linearizable past the {} invoked at position {} " \
+                   "and completed at {}, which returned {}".format(kind, invoked, completed,
+                                                                   result)
+    return None
+
+
+def check_counter(operations):
+    """
+    Checks operations on the counter are linearizable, as check_operations does with
+    CounterModel, but without searching. Returns None if they are, or else describes why not.
+
+    An increment returning n must be the nth to take effect, so the order of the increments
+    is known, and a read returning n must take effect between the nth increment and the
+    next. So rather than searching for an order, each increment in turn is placed as early as
+    it can be: after it was invoked, after the increment before it, and after every read
+    returning the count before it was invoked. It must still come before it completed, and
+    before every read returning its count completed. Placing an increment later only
+    tightens the bounds on those after it, so the operations are linearizable if and only
+    if every increment can be placed.
+
+    Increments still waiting may or may not have taken effect. Counts no increment returned
+    are taken by those, earliest invoked first, since they can take effect any time after.
+    """
+    returned = {}  # count -> (invoked, completed) of the increment that returned it
+    waiting = []  # when each increment still waiting was invoked
+    latest_invoked = {}  # count -> the latest invocation of a read returning it
+    earliest_completed = {}  # count -> the earliest completion of a read returning it
+    highest = 0
+    for _, kind, result, invoked, completed in operations:
+        if completed is None:
+            if kind == INCREMENT:
+                waiting.append(invoked)
+            continue
+        if kind == INCREMENT:
+            if result < 1:
+                return "Client history isn't linearizable: an increment returned {}".format(
+                    result)
+            if result in returned:
+                return "Client history isn't linearizable: two increments returned {}".format(
+                    result)
+            returned[result] = (invoked, completed)
+        else:
+            latest_invoked[result] = max(latest_invoked.get(result, 0), invoked)
+            earliest_completed[result] = min(earliest_completed.get(result, completed),
+                                             completed)
+        highest = max(highest, result)
+    waiting.sort(reverse=True)
+
+    # Where the last increment took effect: a position, and how many increments were placed
+    # at it, one after another, before anything else happened
+    point = (0, 0)
+    for count in range(1, highest + 1):
+        if count in returned:
+            invoked, completed = returned[count]
+        elif waiting:
+            invoked, completed = waiting.pop(), float('inf')
+        else:
+            return "Client history isn't linearizable: the count reached {} without an " \
+                   "increment to take it there".format(count)
+        earliest = max(point, (invoked, 0), (latest_invoked.get(count - 1, 0), 0))
+        point = (earliest[0], earliest[1] + 1)
+        deadline = min(completed, earliest_completed.get(count, completed))
+        if point[0] >= deadline:
+            return "Client history isn't linearizable: the count can only reach {0} after " \
+                   "position {1}, but was seen at {0} by position {2}".format(
+                       count, point[0], deadline)
+    return None
+
+
+def check_history(history, model=CounterModel, fast=False):
+    """
+    Checks the operations of a history are linearizable, as check_operations does. With
+    fast, counter histories are checked by check_counter instead of searching.
+    """
+    if fast:
+        assert model is CounterModel, "Only counter histories have a fast check"
+        return check_counter(history.operations())
+    return check_operations(history.operations(), model)
@@ -0,0 +1,105 @@
+"""
+Sinks for the event log written by WorldBroker.log.
+
+Every sink supports append, iteration over the entries it still holds, and close.
+A plain list works as an unbounded sink.
+"""
+
+import collections
+import gzip
+import json
+
+
+class NullSink:
+    "Discards every entry"
+
+    def append(self, entry):
+        "Drops the entry"
+        pass
+
+    def __iter__(self):
+        return iter(())
+
+    def close(self):
+        "Nothing to close"
+        pass
+
+
+class RingBufferSink:
+    """
+    Keeps only the last size entries, so memory stays flat over long runs while the
+    events leading up to a failure are still available.
+    """
+
+    def __init__(self, size=1000):
+        self.entries = collections.deque(maxlen=size)
+
+    def append(self, entry):
+        "Adds the entry, dropping the oldest one once full"
+        self.entries.append(entry)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def close(self):
+        "Nothing to close"
+        pass
+
+
+def to_json(value):
+    "Converts the values found in log entries that json can't encode natively"
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, (bytes, bytearray)):
+        # Snapshot chunks are logged by size, rather than byte by byte.
+        return {'bytes': len(value)}
+    fields = {'message_type': value.__class__.__name__}
+    fields.update(value.to_map())
+    return fields
+
+
+class JsonlSink:
+    """
+    Streams entries to a gzip compressed file of JSON lines. Entries are encoded as they
+    arrive, and written out buffer_size at a time.
+    """
+
+    def __init__(self, path, buffer_size=1000):
+        self.path = path
+        self.file = gzip.open(path, 'wt')
+        self.buffer = []
+        self.buffer_size = buffer_size
+
+    def append(self, entry):
+        "Encodes the entry, and writes out the buffer once it is full"
+        self.buffer.append(json.dumps(entry, default=to_json))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        "Writes out any buffered entries"
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer = []
+
+    def __iter__(self):
+        # Entries live on disk, not in memory.
+        return iter(())
+
+    def close(self):
+        "Flushes and closes the file"
+        self.flush()
+        self.file.close()
+
+
+def make_sink(kind, size=1000, path='simulation_log.jsonl.gz'):
+    "Builds a sink from its command line name: list, ring, jsonl or null"
+    if kind == 'list':
+        return []
+    elif kind == 'ring':
+        return RingBufferSink(size)
+    elif kind == 'jsonl':
+        return JsonlSink(path)
+    elif kind == 'null':
+        return NullSink()
+    raise ValueError("Unknown log sink: {}".format(kind))
@@ -0,0 +1,66 @@
+"""
+Cluster membership. A configuration is appended to the log like any other command, and each
+node uses the latest one in its log, whether or not it's committed.
+"""
+
+
+class Configuration:
+    """
+    The voters, whose majority elects leaders and commits entries, and the learners, which
+    are replicated to but don't count towards either.
+
+    During a joint consensus change, old_voters is the voter set being replaced, and it
+    takes a majority of both sets.
+    """
+    __slots__ = ('voters', 'learners', 'old_voters')
+
+    def __init__(self, voters, learners=(), old_voters=None):
+        self.voters = frozenset(voters)
+        self.learners = frozenset(learners)
+        self.old_voters = frozenset(old_voters) if old_voters is not None else None
+
+    def __deepcopy__(self, memo):
+        "Configurations are never modified, so copies of the world share them"
+        return self
+
+    def to_map(self):
+        "Returns a dict of the configuration's node sets, for logging"
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "Configuration(voters={}, learners={}, old_voters={})".format(
+            sorted(self.voters), sorted(self.learners),
+            sorted(self.old_voters) if self.is_joint() else None)
+
+    def is_joint(self):
+        "Checks whether this is the joint configuration of a change of voters"
+        return self.old_voters is not None
+
+    def voter_sets(self):
+        "Returns each set of voters that must agree"
+        return (self.voters, self.old_voters) if self.is_joint() else (self.voters,)
+
+    def all_voters(self):
+        "Returns every node whose vote counts"
+        return self.voters | self.old_voters if self.is_joint() else self.voters
+
+    def is_voter(self, node_id):
+        "Checks whether a node's vote counts"
+        return any(node_id in voters for voters in self.voter_sets())
+
+    def members(self):
+        "Returns every node that is replicated to"
+        return self.all_voters() | self.learners
+
+    def has_quorum(self, nodes):
+        "Checks whether the nodes include a majority of every voter set"
+        return all(len(voters & nodes) > len(voters) // 2 for voters in self.voter_sets())
+
+    def quorum_value(self, values):
+        """
+        Returns the highest value that a majority of every voter set has reached, given a
+        map of node id -> value. Voters missing from the map count as 0.
+        """
+        return min(sorted((values.get(node_id, 0) for node_id in voters),
+                          reverse=True)[len(voters) // 2]
+                   for voters in self.voter_sets())
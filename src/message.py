@@ -1,44 +1,166 @@
 """
 Classes for each type of message sent between nodes.
+
+Messages keep their fields in __slots__, and are never modified once sent.
 """
 
+
+# pylint: disable=too-few-public-methods
+class Message:
+    "Base class for messages"
+    __slots__ = ()
+
+    def __deepcopy__(self, memo):
+        "Messages aren't modified once sent, so copies of the world share them"
+        return self
+
+    def to_map(self):
+        "Returns a dict of the message's fields"
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, ", ".join(
+            "{}={!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+
 # pylint: disable=too-few-public-methods
-class AppendEntries:
+class AppendEntries(Message):
     """
-    Appends an entry to the distributed log
+    Appends an entry to the distributed log. read_round is the leader's latest round of
+    confirming its leadership for reads, which the follower echoes back.
     """
+    __slots__ = ('term', 'leader_id', 'prev_log_index', 'prev_log_term', 'entries',
+                 'leader_commit', 'read_round')
+
     # pylint: disable=too-many-arguments
-    def __init__(self, term, leader_id, prev_log_index, prev_log_term, entries, leader_commit):
+    def __init__(self, term, leader_id, prev_log_index, prev_log_term, entries, leader_commit,
+                 read_round=0):
         self.term = term
         self.leader_id = leader_id
         self.prev_log_index = prev_log_index
         self.prev_log_term = prev_log_term
         self.entries = entries
         self.leader_commit = leader_commit
+        self.read_round = read_round
 
     def to_str(self):
         "Returns a string representation of the message"
         return "AppendEntry: {}".format(self.term)
 
 # pylint: disable=too-few-public-methods
-class AppendEntriesResponse:
-    "The reponse to a request to append"
-    def __init__(self, term, success):
+class AppendEntriesResponse(Message):
+    """
+    The reponse to a request to append. On success, index is the last entry the follower
+    now matches. On failure, it is the prev_log_index the follower couldn't match, and
+    conflict_term and conflict_index hint where the logs might match: conflict_term is the
+    follower's term at index and conflict_index is its first entry of that term, or if the
+    follower's log is too short, conflict_term is 0 and conflict_index follows its last entry.
+    read_round is the one the AppendEntries carried.
+    """
+    __slots__ = ('term', 'success', 'index', 'conflict_term', 'conflict_index', 'read_round')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, term, success, index, conflict_term=0, conflict_index=0, read_round=0):
         self.term = term
         self.success = success
+        self.index = index
+        self.conflict_term = conflict_term
+        self.conflict_index = conflict_index
+        self.read_round = read_round
 
 # pylint: disable=too-few-public-methods
-class RequestVote:
-    "Request a vote from another node"
-    def __init__(self, term, candidate_id, last_log_index, last_log_term):
+class RequestVote(Message):
+    """
+    Request a vote from another node. leadership_transfer is set when the leader asked the
+    candidate to take over, so nodes still hearing from that leader vote anyway.
+    """
+    __slots__ = ('term', 'candidate_id', 'last_log_index', 'last_log_term',
+                 'leadership_transfer')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, term, candidate_id, last_log_index, last_log_term,
+                 leadership_transfer=False):
         self.term = term
         self.candidate_id = candidate_id
         self.last_log_index = last_log_index
         self.last_log_term = last_log_term
+        self.leadership_transfer = leadership_transfer
 
 # pylint: disable=too-few-public-methods
-class RequestVoteResponse:
+class RequestVoteResponse(Message):
     "Response to a requested Vote"
+    __slots__ = ('term', 'vote_granted')
+
     def __init__(self, term, vote_granted):
         self.term = term
         self.vote_granted = vote_granted
+
+# pylint: disable=too-few-public-methods
+class PreVote(Message):
+    """
+    Asks whether a node would vote for the candidate in term, without either of them
+    moving to that term
+    """
+    __slots__ = ('term', 'candidate_id', 'last_log_index', 'last_log_term')
+
+    def __init__(self, term, candidate_id, last_log_index, last_log_term):
+        self.term = term
+        self.candidate_id = candidate_id
+        self.last_log_index = last_log_index
+        self.last_log_term = last_log_term
+
+# pylint: disable=too-few-public-methods
+class PreVoteResponse(Message):
+    """
+    Response to a PreVote. term is the one asked about if the vote would be granted, and
+    the responder's own term otherwise.
+    """
+    __slots__ = ('term', 'vote_granted')
+
+    def __init__(self, term, vote_granted):
+        self.term = term
+        self.vote_granted = vote_granted
+
+# pylint: disable=too-few-public-methods
+class TimeoutNow(Message):
+    "Sent by a leader handing over leadership, to have the target start an election at once"
+    __slots__ = ('term',)
+
+    def __init__(self, term):
+        self.term = term
+
+# pylint: disable=too-few-public-methods
+class InstallSnapshot(Message):
+    """
+    Sends a chunk of a snapshot to a follower that needs entries the leader has compacted.
+    The chunk is data, starting at offset bytes into the snapshot. done marks the last one.
+    configuration is the membership as of last_included_index.
+    """
+    __slots__ = ('term', 'leader_id', 'last_included_index', 'last_included_term', 'offset',
+                 'data', 'done', 'configuration')
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, term, leader_id, last_included_index, last_included_term, offset, data,
+                 done, configuration):
+        self.term = term
+        self.leader_id = leader_id
+        self.last_included_index = last_included_index
+        self.last_included_term = last_included_term
+        self.offset = offset
+        self.data = data
+        self.done = done
+        self.configuration = configuration
+
+# pylint: disable=too-few-public-methods
+class InstallSnapshotResponse(Message):
+    """
+    The response to a snapshot chunk. received is how many bytes of the snapshot the follower
+    has, in order, and installed is set once the whole snapshot has been installed.
+    """
+    __slots__ = ('term', 'last_included_index', 'received', 'installed')
+
+    def __init__(self, term, last_included_index, received, installed):
+        self.term = term
+        self.last_included_index = last_included_index
+        self.received = received
+        self.installed = installed
@@ -0,0 +1,195 @@
+"""
+Many Raft groups sharing the simulated hosts, as in a sharded deployment. Each host runs one
+node of every group. The world broker sees the host as a single node, so network, power and
+clock faults apply to the whole host, and the host hands each message to the group it's
+tagged with.
+"""
+
+from heapq import heappush, heappop, heapify
+from message import Message, AppendEntries, AppendEntriesResponse
+from invariants import InvariantChecker, OneLeaderPerTerm, CommittedEntriesMatch
+from storage import NodeStorage, SimulatedDisk
+
+
+# pylint: disable=too-few-public-methods
+class GroupMessage(Message):
+    "A message between the nodes of one group"
+    __slots__ = ('group', 'message')
+
+    def __init__(self, group, message):
+        self.group = group
+        self.message = message
+
+# pylint: disable=too-few-public-methods
+class CoalescedHeartbeats(Message):
+    """
+    Every heartbeat, and heartbeat response, one host sent another in a ms, as
+    (group, message) pairs
+    """
+    __slots__ = ('heartbeats',)
+
+    def __init__(self, heartbeats):
+        self.heartbeats = heartbeats
+
+
+def is_heartbeat(message):
+    "Checks whether a message is an empty AppendEntries, or a response to AppendEntries"
+    return isinstance(message, AppendEntriesResponse) or \
+        (isinstance(message, AppendEntries) and not message.entries)
+
+
+class GroupBroker:
+    """
+    The broker the nodes of one group talk to. Tags their messages with the group, and
+    queues heartbeats with the world broker to be coalesced. Each node has its own ideal
+    disk, and the group checks its own invariants.
+    """
+
+    def __init__(self, world, group):
+        self.world = world
+        self.group = group
+        self.tracer = world.tracer
+        self.file_broker = {k: NodeStorage(SimulatedDisk()) for k in world.node_ids}
+        one_leader_per_term = OneLeaderPerTerm()
+        self.leaders_history = one_leader_per_term.leaders_history
+        self.invariants = InvariantChecker([one_leader_per_term, CommittedEntriesMatch()])
+        self.leader = None  # the last node known to be elected
+
+    def log(self, entry):
+        "Logs an entry, noting the group"
+        entry['group'] = self.group
+        self.world.log(entry)
+
+    def state_changed(self, node, transition):
+        "Called by a node after a state transition, so that invariants are checked"
+        self.invariants.notify(node, transition)
+        if transition == 'change_type' and node.is_leader():
+            self.leader = node.node_id
+            self.world.leader_changes += 1
+
+    def set_timeout(self, node_id, timeout):
+        "Arms the timer of this group's node on a host"
+        self.world.hosts[node_id].set_timeout(self.group, timeout)
+
+    def local_time(self, node_id):
+        "Returns the time on a host's clock"
+        return self.world.local_time(node_id)
+
+    def persist(self, node_id, record, log_length):
+        "Writes a record to a node's disk, which syncs as it writes"
+        self.file_broker[node_id].write_synced(record, log_length)
+
+    def send_after_sync(self, origin, data, destinations):
+        "Sends a message. Every write is already durable."
+        self.broadcast(origin, data, destinations)
+
+    def send_to(self, origin, destination, data):
+        "Sends a message to one node"
+        self.broadcast(origin, data, (destination,))
+
+    def broadcast(self, origin, data, destinations=None):
+        """
+        Sends a message to the group's node on each destination host, or on every host.
+        Heartbeats wait until the end of the ms, to share one message per pair of hosts.
+        """
+        if destinations is None:
+            destinations = self.world.node_ids
+        if is_heartbeat(data):
+            outbox = self.world.heartbeat_outbox
+            for destination in destinations:
+                if destination != origin:
+                    outbox.setdefault((origin, destination), []).append((self.group, data))
+                    self.world.group_messages_sent += 1
+        else:
+            self.world.group_messages_sent += sum(1 for destination in destinations
+                                                  if destination != origin)
+            self.world.broadcast(origin, GroupMessage(self.group, data), destinations)
+
+
+class Host:
+    """
+    A host running one node of each group. The world broker treats it as a node: it passes
+    on messages to the group they're tagged with, and trips each node's timer off the one
+    timer the world keeps for the host.
+
+    Group timers trip on the host's ticks, every tick_ms of its clock, so that the groups it
+    leads send their heartbeats together.
+    """
+
+    def __init__(self, host_id, world, tick_ms):
+        self.host_id = host_id
+        self.world = world
+        self.tick_ms = tick_ms
+        self.nodes = []  # group -> the group's node on this host
+        self.deadlines = {}  # group -> (local deadline, sequence number of the live entry)
+        self.heap = []  # (local deadline, sequence number, group)
+        self.sequence = 0
+
+    def setup(self):
+        "Boots every node"
+        for node in self.nodes:
+            node.setup()
+
+    def set_timeout(self, group, timeout):
+        "Arms a group's timer to trip on the first tick from timeout ms on"
+        deadline = self.world.local_time(self.host_id) + timeout
+        deadline += -deadline % self.tick_ms
+        self.sequence += 1
+        self.deadlines[group] = (deadline, self.sequence)
+        heappush(self.heap, (deadline, self.sequence, group))
+        if len(self.heap) > 4 * len(self.deadlines) + 64:
+            self.heap = [entry for entry in self.heap
+                         if self.deadlines.get(entry[2]) == entry[:2]]
+            heapify(self.heap)
+        self.arm()
+
+    def arm(self):
+        "Arms the host's timer for the earliest group timer, unless it trips sooner already"
+        heap = self.heap
+        while heap and self.deadlines.get(heap[0][2]) != heap[0][:2]:
+            heappop(heap)
+        if heap:
+            # The world trips the host's timer once its clock passes the deadline.
+            deadline = heap[0][0] - 1
+            armed = self.world.time_broker['node_timers'][self.host_id]
+            if armed is None or deadline < armed:
+                self.world.set_timeout(self.host_id,
+                                       deadline - self.world.local_time(self.host_id))
+
+    def timer_trip(self):
+        "Trips every group timer that has expired, in group order, then re-arms the host's"
+        now = self.world.local_time(self.host_id)
+        heap = self.heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            deadline, sequence, group = heappop(heap)
+            if self.deadlines.get(group) == (deadline, sequence):
+                del self.deadlines[group]
+                expired.append(group)
+        for group in sorted(expired):
+            self.nodes[group].timer_trip()
+        self.arm()
+
+    def receive(self, sender, message):
+        "Passes a message on to its group's node, or each coalesced heartbeat to its own"
+        if isinstance(message, CoalescedHeartbeats):
+            for group, heartbeat in message.heartbeats:
+                self.nodes[group].receive(sender, heartbeat)
+        else:
+            self.nodes[message.group].receive(sender, message.message)
+
+    def propose(self, command):
+        "Hosts take no proposals, since they lead no one group"
+        pass
+
+    def submit(self, client_id, request_id, read_mode=None):
+        "Hosts reject client requests, since they lead no one group"
+        return False
+
+    def flush_requests(self):
+        "Hosts hold no client requests"
+        pass
+
+    def synced(self, sends):
+        "Nodes sync their own disks"
+        pass
@@ -0,0 +1,73 @@
+"""
+Link state for the network broker.
+"""
+
+
+class NetworkBroker:
+    """
+    Tracks which links drop, delay or duplicate messages. Only the state that differs from a
+    healthy network is stored, so memory grows with the number of active faults rather than
+    with the square of the cluster size.
+
+    A link is cut when its receiving node drops everything it would receive, unless a later
+    link level event restored it. Link overrides are only kept where they differ from the
+    receiving node's state, and any change to a node's receive state clears the overrides of
+    its incoming links.
+    """
+
+    def __init__(self):
+        self.heal()
+
+    # pylint: disable=attribute-defined-outside-init
+    def heal(self):
+        "Restores every link to a healthy state"
+        self.receive_dropped = set()  # nodes that drop all incoming messages
+        self.link_overrides = {}  # (from, to) -> connected, where it differs from the above
+        self.overrides_into = {}  # to -> set of from, indexing link_overrides
+        self.link_delays = {}  # (from, to) -> extra delay in ms, where non-zero
+        self.send_duplicates = {}  # from -> duplicates added to each message, where non-zero
+
+    def connected(self, from_node, to_node):
+        "Checks whether a message sent on the link now would be delivered"
+        override = self.link_overrides.get((from_node, to_node))
+        if override is not None:
+            return override
+        return to_node not in self.receive_dropped
+
+    def link_delay(self, from_node, to_node):
+        "Returns the extra delay on the link"
+        return self.link_delays.get((from_node, to_node), 0)
+
+    def duplicates(self, from_node):
+        "Returns the number of extra copies of each message sent from the node"
+        return self.send_duplicates.get(from_node, 0)
+
+    def set_link(self, from_node, to_node, connected):
+        "Cuts or restores a single link"
+        if connected == (to_node not in self.receive_dropped):
+            self.link_overrides.pop((from_node, to_node), None)
+            senders = self.overrides_into.get(to_node)
+            if senders is not None:
+                senders.discard(from_node)
+                if not senders:
+                    del self.overrides_into[to_node]
+        else:
+            self.link_overrides[(from_node, to_node)] = connected
+            self.overrides_into.setdefault(to_node, set()).add(from_node)
+
+    def set_receiving(self, to_node, connected):
+        "Cuts or restores every link into a node"
+        if connected:
+            self.receive_dropped.discard(to_node)
+        else:
+            self.receive_dropped.add(to_node)
+        for from_node in self.overrides_into.pop(to_node, ()):
+            del self.link_overrides[(from_node, to_node)]
+
+    def add_duplicates(self, from_node, amount):
+        "Changes the number of duplicates of each message sent from the node, down to 0"
+        count = max(0, self.send_duplicates.get(from_node, 0) + amount)
+        if count:
+            self.send_duplicates[from_node] = count
+        else:
+            self.send_duplicates.pop(from_node, None)
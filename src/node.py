@@ -2,8 +2,54 @@
 The actual implementation of raft.
 """
 
-import math
 from message import AppendEntries, AppendEntriesResponse, RequestVote, RequestVoteResponse
+from message import InstallSnapshot, InstallSnapshotResponse, PreVote, PreVoteResponse
+from message import TimeoutNow
+from raft_log import RaftLog
+from state_machine import Counter
+from membership import Configuration
+from storage import replay
+
+# The settings nodes run with, unless given others. conf['nodes'], the initial voters, is
+# always given.
+DEFAULT_CONF = {'election_timeout_window': (150, 300),
+                'heartbeat_timeout': 50,
+                # Replication flow control: entries per AppendEntries, and AppendEntries
+                # sent to a follower ahead of its acknowledgements
+                'max_entries_per_append': 64,
+                'max_appends_in_flight': 4,
+                # Nodes snapshot their state machine and compact their log every
+                # snapshot_interval applied entries, and send snapshots in chunks of
+                # snapshot_chunk_size bytes
+                'snapshot_interval': 1000,
+                'snapshot_chunk_size': 1024,
+                # Client requests the leader proposes as one entry, at most
+                'max_requests_per_entry': 64,
+                # ms a client waits for a reply before sending a request again
+                'client_timeout': 100,
+                # The fraction of client requests that are reads, and how they are served:
+                # through the log, by ReadIndex, or on the leader's lease
+                'read_fraction': 0.0,
+                'read_mode': 'read_index',
+                # Whether leaders hold leases, during which no other leader can be elected
+                'leader_leases': False,
+                # The most ms any two nodes' clocks may move apart by over a lease. Nodes
+                # don't notice their clocks jump, so leaders stop reading on their lease this
+                # much before the followers' could run out, and confirm reads by ReadIndex
+                # after. Lease reads are only linearizable while clocks keep within it.
+                'max_clock_drift': 50,
+                # Whether nodes check a majority would vote for them before starting an
+                # election, and whether leaders step down when they lose touch with a majority
+                'pre_vote': False,
+                'check_quorum': False}
+
+
+def node_conf(cluster_size, **settings):
+    "Returns DEFAULT_CONF with the given settings, and the first cluster_size nodes as voters"
+    assert set(settings) <= set(DEFAULT_CONF), "Unknown settings"
+    conf = dict(DEFAULT_CONF, **settings)
+    conf['nodes'] = set(range(cluster_size))
+    return conf
 
 
 class DownNode:
@@ -20,6 +66,34 @@ class DownNode:
         "Downed Nodes have no timers"
         pass
 
+    def propose(self, command):
+        "Downed nodes accept no proposals"
+        pass
+
+    def submit(self, client_id, request_id, read_mode=None):
+        "Downed nodes reject client requests"
+        return False
+
+    def flush_requests(self):
+        "Downed nodes have no requests"
+        pass
+
+    def transfer_leadership(self, target=None):
+        "Downed nodes lead nothing"
+        pass
+
+    def add_node(self, node_id, learner=True):
+        "Downed nodes lead nothing"
+        pass
+
+    def remove_node(self, node_id):
+        "Downed nodes lead nothing"
+        pass
+
+    def synced(self, sends):
+        "Downed nodes send nothing"
+        pass
+
 # pylint: disable=too-many-instance-attributes
 class Node:
     """
@@ -30,19 +104,93 @@ class Node:
         self.conf = conf
         self.rng = rng
         self.broker = broker
+        self.tracer = broker.tracer
+        self.storage = broker.file_broker[node_id]
 
         self.term = 0
-        self.log = []  # list[tuple(term, entry)]
+        self.log = RaftLog()
         self.commit_index = 0
         self.last_applied = 0
+        self.state_machine = Counter()
+        # (index, configuration) for each configuration in the log, after the one in force
+        # at the start of the log, which is first. conf['nodes'] are the initial voters.
+        self.configurations = [(0, Configuration(conf['nodes']))]
+        # Client requests received this ms, as (client id, request id, whether it's a read),
+        # that the leader proposes together as one entry
+        self.pending_requests = []
+        # Until this local time, a leader is known to hold a majority, and followers ignore
+        # RequestVote, if conf['leader_leases'] is set. Set on setup.
+        self.lease_until = None
+        self.snapshot_data = None  # the state machine as of self.log.snapshot_index
+        # The snapshot being received: [index, term, bytes received in order, chunks received
+        # out of order by offset, total size or None]
+        self.incoming_snapshot = None
         self.voted_for = None
         self.node_type = 'Follower'
         self.votes_received = set()
+        self.pre_voting = False  # whether this node is asking for PreVotes
+        self.pre_votes_received = set()
         self.election_timeout = self.calculate_election_timeout()
 
+        # Leader state, reset on each election. The maps go from peer node ids to log indexes.
+        self.next_index = {}  # the next entry to send
+        self.match_index = {}  # the last entry known to be replicated
+        self.heartbeat_match = {}  # match_index as of the last heartbeat
+        self.resent_from = {}  # match_index when entries were last resent after a rejection
+        self.probing = set()  # peers whose match_index isn't known yet
+        # peer -> [snapshot index, bytes sent, bytes acknowledged], for peers that need
+        # entries this node has compacted
+        self.snapshot_progress = {}
+        # Reads are served once a majority has answered an AppendEntries sent after they
+        # arrived. Each AppendEntries carries the latest read_round, and acked_round holds
+        # the latest each peer has echoed back.
+        self.read_round = 0
+        self.confirmed_round = 0
+        self.acked_round = {}
+        self.round_times = {}  # read_round -> local time it started, until it's confirmed
+        self.round_needed = False  # whether reads are waiting on a round not yet started
+        # [read_round, read index, client id, request id] for each read being served
+        self.pending_reads = []
+        self.term_start_index = 0  # the index of the leader's first entry of its term
+        # Peers heard from since quorum_deadline was last pushed back, for CheckQuorum
+        self.recent_contact = set()
+        self.quorum_deadline = None
+        # The peer leadership is being handed to, which refuses new proposals until it steps
+        # down or transfer_deadline passes, and whether the peer was sent TimeoutNow yet
+        self.transfer_target = None
+        self.transfer_deadline = None
+        self.timeout_now_sent = False
+
+    def persist_state(self):
+        "Writes the term and vote to disk. Replies that depend on them wait for the sync."
+        self.broker.persist(self.node_id, ('state', self.term, self.voted_for),
+                            self.log.last_index())
+
+    def recover(self, records):
+        """
+        Rebuilds the term, vote, log and state machine from the records this node synced
+        before crashing
+        """
+        state = replay(records)
+        self.term, self.voted_for, self.log = state['term'], state['voted_for'], state['log']
+        if state['snapshot'] is not None:
+            index, _, self.snapshot_data, configuration = state['snapshot']
+            self.state_machine.restore(self.snapshot_data)
+            self.commit_index = self.last_applied = index
+            self.configurations = [(index, configuration)]
+        for index in range(self.log.snapshot_index + 1, self.log.last_index() + 1):
+            self.configuration_appended(index, self.log.command_at(index))
+
+    def synced(self, sends):
+        "Sends the messages that were waiting for a sync, which may have made entries durable"
+        for message, destinations in sends:
+            self.broker.broadcast(self.node_id, message, destinations)
+        if self.is_leader():
+            self.advance_commit_index()
+
 
     def test_log(self, event):
-        "This logs events for debugging purposes"
+        "This logs events for debugging purposes. Callers check self.tracer first."
         assert 'event_type' in event
         event['originating_node'] = self.node_id
         event['current_term'] = self.term
@@ -54,6 +202,17 @@ class Node:
         return self.rng.randint(self.conf['election_timeout_window'][0],
                                 self.conf['election_timeout_window'][1])
 
+    def term_at(self, index):
+        """
+        Returns the term of the entry at index, 0 for the empty prefix, or None if the entry
+        was compacted
+        """
+        return self.log.term_at(index)
+
+    def last_log_term(self):
+        "Returns the term of the last entry in the log"
+        return self.log.last_term()
+
     def is_candidate(self):
         "TODO"
         return self.node_type == 'Candidate'
@@ -69,14 +228,20 @@ class Node:
     def setup(self):
         "Emulates a node booting up"
         self.broker.set_timeout(self.node_id, self.election_timeout)
+        # A node that just restarted may have acknowledged a leader's lease before it went down.
+        self.lease_until = self.local_time() + self.conf['election_timeout_window'][0]
+
+    def local_time(self):
+        "Returns the time on this node's clock"
+        return self.broker.local_time(self.node_id)
 
     def change_type(self, new_type):
         """
         Convert this node to a different type, and make any other needed state changes.
         """
-        self.test_log({'event_type':'change_type', 'to':new_type})
-        #-TODO always log instead of logging when different?
-        if self.node_type != new_type:
+        if self.tracer.state_debug:
+            self.test_log({'event_type':'change_type', 'to':new_type})
+        if self.tracer.state_info and self.node_type != new_type:
             self.test_log({'to_type': new_type,
                            'event_type': 'change_type'})
         assert new_type == 'Follower' or new_type == 'Candidate' or new_type == 'Leader'
@@ -84,11 +249,105 @@ class Node:
             assert self.node_type != 'Follower'
 
         self.node_type = new_type
+        self.broker.state_changed(self, 'change_type')
+        self.pending_requests = []
+        self.pending_reads = []
+        self.pre_voting = False
+        self.transfer_target = None
         if new_type == 'Follower' or new_type == 'Candidate':
             self.broker.set_timeout(self.node_id, self.election_timeout)
         elif new_type == 'Leader':
+            self.next_index, self.match_index = {}, {}
+            self.heartbeat_match, self.resent_from, self.acked_round = {}, {}, {}
+            self.probing = set()
+            self.snapshot_progress = {}
+            self.read_round = self.confirmed_round = 0
+            for peer in self.configuration().members():
+                if peer != self.node_id:
+                    self.add_peer(peer)
+            self.round_times = {}
+            self.round_needed = False
+            self.lease_until = self.local_time()
+            self.recent_contact = set()
+            self.quorum_deadline = self.local_time() + self.conf['election_timeout_window'][0]
             self.broker.set_timeout(
                 self.node_id, self.conf['heartbeat_timeout'])
+            # Committing an entry of its own term tells the leader which entries are
+            # committed, so it can serve reads.
+            self.term_start_index = self.log.last_index() + 1
+            self.propose(None)
+
+    def configuration(self):
+        "Returns the latest configuration in the log"
+        return self.configurations[-1][1]
+
+    def configuration_at(self, index):
+        "Returns the configuration in force at index, which must not be before the log"
+        for config_index, configuration in reversed(self.configurations):
+            if config_index <= index:
+                return configuration
+        assert False, "No configuration at {}".format(index)
+
+    def configuration_appended(self, index, command):
+        "Called after appending a command at index, which takes effect if it's a configuration"
+        if isinstance(command, Configuration):
+            self.configurations.append((index, command))
+            self.configuration_changed()
+
+    def configurations_truncated(self, index):
+        "Called after truncating the log from index, dropping the configurations it held"
+        if self.configurations[-1][0] >= index:
+            while len(self.configurations) > 1 and self.configurations[-1][0] >= index:
+                self.configurations.pop()
+            self.configuration_changed()
+
+    def configuration_changed(self):
+        """
+        Starts replicating to nodes a new configuration adds, and stops replicating to nodes
+        that are in no configuration since the latest committed one. Nodes being removed
+        keep being sent entries until their removal commits, so they learn of it.
+        """
+        if not self.is_leader():
+            return
+        members = set()
+        for config_index, configuration in reversed(self.configurations):
+            members |= configuration.members()
+            if config_index <= self.commit_index:
+                break
+        for peer in list(self.next_index):
+            if peer not in members:
+                self.remove_peer(peer)
+        for peer in members:
+            if peer != self.node_id and peer not in self.next_index:
+                self.add_peer(peer)
+
+    def add_peer(self, peer):
+        "Starts replicating to a peer, finding where its log matches first"
+        self.next_index[peer] = self.log.last_index() + 1
+        self.match_index[peer] = 0
+        self.heartbeat_match[peer] = None
+        self.resent_from[peer] = None
+        self.probing.add(peer)
+        self.acked_round[peer] = 0
+
+    def remove_peer(self, peer):
+        "Stops replicating to a peer"
+        for progress in (self.next_index, self.match_index, self.heartbeat_match,
+                         self.resent_from, self.acked_round, self.snapshot_progress):
+            progress.pop(peer, None)
+        self.probing.discard(peer)
+        self.recent_contact.discard(peer)
+        if self.transfer_target == peer:
+            self.transfer_target = None
+
+    def quorum_value(self, values, own_value):
+        """
+        Returns the highest value a majority of every voter set has reached, given a map of
+        peer -> value and this node's own value, which counts only if it's a voter
+        """
+        values = dict(values)
+        values[self.node_id] = own_value
+        return self.configuration().quorum_value(values)
 
     def update_term(self, term, new_candidate):
         """
@@ -98,73 +357,692 @@ class Node:
         We avoid resetting the node to 'Follower' if we're updating the term
         because the node is starting a new election.
         """
-        self.test_log({'event_type':'update_term', 'new_term':term, 'new_candidate':new_candidate})
+        if self.tracer.term_debug:
+            self.test_log({'event_type':'update_term', 'new_term':term,
+                           'new_candidate':new_candidate})
         if term > self.term:
             if not new_candidate:
                 self.change_type('Follower')
             self.term = term
             self.votes_received = set()
             self.voted_for = None
+            self.persist_state()
             self.election_timeout = self.calculate_election_timeout()
-            self.test_log({'event_type': 'update_term'})
+            if self.tracer.term_info:
+                self.test_log({'event_type': 'update_term'})
+            self.broker.state_changed(self, 'update_term')
 
     def receive(self, sender, message):
         "TODO"
+        if isinstance(message, RequestVote) and not message.leadership_transfer and \
+                (self.conf['leader_leases'] or self.conf['check_quorum']) and \
+                self.local_time() < self.lease_until:
+            # A leader may be serving reads on its lease, or may still hold a quorum, so no
+            # other can be elected yet. A leader handing over has given its lease up.
+            return
+        if isinstance(message, PreVote):
+            self.receive_pre_vote(sender, message)
+            return
+        if isinstance(message, PreVoteResponse):
+            self.receive_pre_vote_response(sender, message)
+            return
         self.update_term(message.term, False)
         assert isinstance(message, (AppendEntries, RequestVote, AppendEntriesResponse,\
-                          RequestVoteResponse))
+                          RequestVoteResponse, InstallSnapshot, InstallSnapshotResponse,
+                          TimeoutNow))
+        if self.is_leader() and message.term == self.term:
+            self.recent_contact.add(sender)
         if isinstance(message, AppendEntries):
-            if self.is_follower():
-                self.broker.set_timeout(self.node_id, self.election_timeout)
-            elif self.is_candidate() or self.is_leader():
-                self.change_type('Follower')
-            else:
-                # This case will fire when we add cluster config changes.
-                assert False
+            self.receive_append_entries(sender, message)
+        elif isinstance(message, InstallSnapshot):
+            self.receive_install_snapshot(sender, message)
+        elif isinstance(message, TimeoutNow):
+            # The leader is handing over, so campaign without waiting out a timeout.
+            if message.term == self.term and not self.is_leader() and \
+                    self.configuration().is_voter(self.node_id):
+                self.start_election(leadership_transfer=True)
+        elif isinstance(message, InstallSnapshotResponse):
+            if self.is_leader() and message.term == self.term and sender in self.next_index:
+                self.receive_install_snapshot_response(sender, message)
         elif isinstance(message, RequestVote):
-            if message.term < self.term or self.voted_for is not None:
-                self.broker.send_to(self.node_id, sender,
-                                    RequestVoteResponse(self.term, False))
+            if message.term < self.term or self.voted_for not in (None, sender) \
+                    or not self.candidate_log_up_to_date(message):
+                self.broker.send_after_sync(self.node_id, RequestVoteResponse(self.term, False),
+                                            (sender,))
             else:
-                self.broker.send_to(self.node_id, sender,
-                                    RequestVoteResponse(self.term, True))
-                self.voted_for = sender
-                self.test_log({'event_type': 'cast_vote', 'voted_for': sender})
+                if self.voted_for is None:
+                    self.voted_for = sender
+                    self.persist_state()
+                self.broker.send_after_sync(self.node_id, RequestVoteResponse(self.term, True),
+                                            (sender,))
+                if self.tracer.vote_info:
+                    self.test_log({'event_type': 'cast_vote', 'voted_for': sender})
         elif isinstance(message, AppendEntriesResponse):
-            pass
+            # Peers that were removed from the cluster are no longer tracked.
+            if self.is_leader() and message.term == self.term and sender in self.next_index:
+                self.receive_append_entries_response(sender, message)
         elif isinstance(message, RequestVoteResponse):
-            if message.vote_granted and self.is_candidate():
+            # Votes from earlier terms don't count towards this election.
+            if message.vote_granted and self.is_candidate() and message.term == self.term:
                 self.votes_received.add(sender)
-                if len(self.votes_received) > math.floor(len(self.conf['nodes']) / 2):
+                if self.configuration().has_quorum(self.votes_received):
                     self.change_type('Leader')
 
-    def timer_trip(self):
-        "TODO"
-        #-TODO: this if statement was added to fix a "compile error". This was not
-        # thought through and may be wrong.
-        last_logged_term = -1
-        last_logged_entry = None
-        if self.log:
-            last_logged_term = self.log[-1][0]
-            last_logged_entry = self.log[-1][1]
+    def receive_pre_vote(self, sender, message):
+        """
+        Grants a PreVote if this node would vote for the candidate in the term it asks
+        about. Nodes that have heard from a leader recently don't, so a node that was cut off
+        can't disrupt a working leader when it rejoins.
+        """
+        granted = message.term > self.term and not self.is_leader() and \
+            self.local_time() >= self.lease_until and self.candidate_log_up_to_date(message)
+        self.broker.send_to(self.node_id, sender,
+                            PreVoteResponse(message.term if granted else self.term, granted))
 
-        if not self.is_leader():
-            self.change_type('Candidate')
-            self.update_term(self.term + 1, True)
-            self.votes_received.add(self.node_id)
-            self.voted_for = self.node_id
-            self.test_log({"event_type": "cast_vote", "voted_for": self.node_id})
-            for node in self.conf['nodes']:
-                if self.node_id != node:
-                    self.broker.send_to(self.node_id, node,
-                                        RequestVote(self.term, self.node_id,
-                                                    len(self.log), last_logged_term))
+    def receive_pre_vote_response(self, sender, message):
+        "Counts a PreVote, and starts an election once a majority would vote for this node"
+        if not message.vote_granted:
+            # A responder in a later term means this node has missed an election.
+            self.update_term(message.term, False)
+        elif self.pre_voting and message.term == self.term + 1:
+            self.pre_votes_received.add(sender)
+            if self.configuration().has_quorum(self.pre_votes_received):
+                self.start_election()
+
+    def candidate_log_up_to_date(self, message):
+        "Checks that a candidate's log is at least as up to date as this node's"
+        return (message.last_log_term, message.last_log_index) >= \
+            (self.last_log_term(), self.log.last_index())
+
+    def receive_append_entries(self, sender, message):
+        """
+        Handles AppendEntries from a leader, appending any new entries if the log matches
+        the leader's at prev_log_index.
+        """
+        if message.term < self.term:
+            self.broker.send_after_sync(
+                self.node_id, AppendEntriesResponse(self.term, False, message.prev_log_index),
+                (sender,))
+            return
+        self.follow_leader()
+
+        prev_log_index = message.prev_log_index
+        entries = message.entries
+        if prev_log_index < self.log.snapshot_index:
+            # Entries up to the snapshot were committed, so they match the leader's.
+            skipped = min(len(entries), self.log.snapshot_index - prev_log_index)
+            entries = entries[skipped:]
+            prev_log_index += skipped
+        elif prev_log_index > self.log.last_index():
+            # Hint that the leader should continue from the end of this log.
+            self.broker.send_after_sync(
+                self.node_id,
+                AppendEntriesResponse(self.term, False, prev_log_index, 0,
+                                      self.log.last_index() + 1, message.read_round),
+                (sender,))
+            return
+        elif self.log.term_at(prev_log_index) != message.prev_log_term:
+            # Hint that the leader should skip every entry of the conflicting term.
+            conflict_term = self.log.term_at(prev_log_index)
+            self.broker.send_after_sync(
+                self.node_id,
+                AppendEntriesResponse(self.term, False, prev_log_index, conflict_term,
+                                      self.log.first_index_of_term(conflict_term),
+                                      message.read_round),
+                (sender,))
+            return
+
+        index = prev_log_index
+        appended = []
+        for term, command in entries:
+            index += 1
+            if index <= self.log.last_index():
+                if self.log.term_at(index) == term:
+                    continue
+                # A conflicting entry, and everything after it, was never committed.
+                self.log.truncate(index)
+                self.configurations_truncated(index)
+                self.broker.persist(self.node_id, ('truncate', index), self.log.last_index())
+            self.log.append(term, command)
+            self.configuration_appended(index, command)
+            appended.append((term, command))
+        if appended:
+            self.broker.persist(self.node_id, ('append', index - len(appended) + 1, appended),
+                                self.log.last_index())
+
+        if message.leader_commit > self.commit_index and index > self.commit_index:
+            self.commit_index = min(message.leader_commit, index)
+            self.broker.state_changed(self, 'commit')
+            self.apply_committed()
+        # The entries must be durable before the leader counts them.
+        self.broker.send_after_sync(
+            self.node_id,
+            AppendEntriesResponse(self.term, True, index, read_round=message.read_round),
+            (sender,))
+
+    def follow_leader(self):
+        "Called on hearing from a current leader. Candidates and leaders step down."
+        self.pre_voting = False
+        self.lease_until = max(self.lease_until,
+                               self.local_time() + self.conf['election_timeout_window'][0])
+        if self.is_follower():
+            self.broker.set_timeout(self.node_id, self.election_timeout)
+        elif self.is_candidate() or self.is_leader():
+            self.change_type('Follower')
         else:
-            for node in self.conf['nodes']:
-                if self.node_id != node:
-                    self.broker.send_to(self.node_id, node,
-                                        AppendEntries(self.term, self.node_id,
-                                                      len(self.log), last_logged_entry,
-                                                      [], self.commit_index))
+            # This case will fire when we add cluster config changes.
+            assert False
+
+    def receive_install_snapshot(self, sender, message):
+        """
+        Handles a chunk of a snapshot from a leader. Chunks may arrive out of order, and
+        the snapshot is installed once every one has.
+        """
+        index = message.last_included_index
+        if message.term < self.term:
+            self.broker.send_after_sync(
+                self.node_id, InstallSnapshotResponse(self.term, index, 0, False), (sender,))
+            return
+        self.follow_leader()
+        if index <= self.commit_index:
+            # This node already has every entry in the snapshot.
+            self.broker.send_after_sync(
+                self.node_id, InstallSnapshotResponse(self.term, index, 0, True), (sender,))
+            return
+
+        incoming = self.incoming_snapshot
+        if incoming is None or incoming[0] != index:
+            incoming = self.incoming_snapshot = [index, message.last_included_term,
+                                                 bytearray(), {}, None]
+        _, term, received, chunks, _ = incoming
+        if message.done:
+            incoming[4] = message.offset + len(message.data)
+        if message.offset >= len(received):
+            chunks[message.offset] = message.data
+        while len(received) in chunks:
+            received += chunks.pop(len(received))
+        installed = len(received) == incoming[4]
+        if installed:
+            self.install_snapshot(index, term, bytes(received), message.configuration)
+        self.broker.send_after_sync(
+            self.node_id, InstallSnapshotResponse(self.term, index, len(received), installed),
+            (sender,))
+
+    def install_snapshot(self, index, term, data, configuration):
+        "Replaces the state machine, and the log up to index, with a snapshot from the leader"
+        self.incoming_snapshot = None
+        self.log.install_snapshot(index, term)
+        self.configurations = [(index, configuration)] + \
+            [config for config in self.configurations
+             if index < config[0] <= self.log.last_index()]
+        self.snapshot_data = data
+        self.state_machine.restore(data)
+        self.broker.persist(self.node_id, ('snapshot', index, term, data, configuration),
+                            self.log.last_index())
+        self.commit_index = self.last_applied = index
+        self.broker.state_changed(self, 'commit')
+
+    def receive_install_snapshot_response(self, sender, message):
+        "Updates a follower's progress through a snapshot, and sends it what's next"
+        progress = self.snapshot_progress.get(sender)
+        if message.installed:
+            if message.last_included_index > self.match_index[sender]:
+                self.match_index[sender] = message.last_included_index
+            self.next_index[sender] = max(self.next_index[sender],
+                                          message.last_included_index + 1)
+            self.probing.discard(sender)
+            self.heartbeat_match[sender] = None
+            if progress is not None and progress[0] <= message.last_included_index:
+                del self.snapshot_progress[sender]
+        elif progress is not None and progress[0] == message.last_included_index:
+            progress[2] = max(progress[2], message.received)
+        else:
+            return
+        self.replicate(sender)
+
+    def receive_append_entries_response(self, sender, message):
+        "Updates a follower's progress, and sends it whatever it's missing"
+        if message.read_round > self.acked_round[sender]:
+            self.acked_round[sender] = message.read_round
+            self.confirm_reads()
+        if message.success:
+            if message.index > self.match_index[sender]:
+                self.match_index[sender] = message.index
+                self.advance_commit_index()
+                if not self.is_leader() or sender not in self.next_index:
+                    # The commit removed this node, or the peer.
+                    return
+                if sender in self.configuration().learners:
+                    self.advance_membership()
+            self.next_index[sender] = max(self.next_index[sender], message.index + 1)
+            if sender in self.probing:
+                self.probing.discard(sender)
+                self.heartbeat_match[sender] = None
+            if sender == self.transfer_target:
+                self.send_timeout_now()
+        elif message.index > self.match_index[sender]:
+            if sender in self.probing:
+                # The follower's log doesn't match at message.index, so back up past it,
+                # skipping as much as the follower's hint allows.
+                self.next_index[sender] = max(self.match_index[sender] + 1,
+                                              min(self.next_index[sender], message.index,
+                                                  self.conflict_next_index(message)))
+            elif self.resent_from[sender] != self.match_index[sender]:
+                # An earlier request was lost or overtaken, so resend from the last match.
+                # Rejections of the requests already in flight after it are ignored.
+                self.resent_from[sender] = self.match_index[sender]
+                self.next_index[sender] = self.match_index[sender] + 1
+            else:
+                return
+        else:
+            return
+        self.replicate(sender)
+
+    def conflict_next_index(self, message):
+        "Returns the next index to send a follower after it rejected AppendEntries"
+        if message.conflict_term:
+            last_index = self.log.last_index_of_term(message.conflict_term)
+            if last_index is not None:
+                # The logs may match up to the end of this node's entries for the term.
+                return last_index + 1
+        return message.conflict_index
+
+    def advance_commit_index(self):
+        "Commits the latest entry from this term that a majority of nodes have"
+        majority_index = self.quorum_value(self.match_index, self.storage.durable_length())
+        if majority_index > self.commit_index and self.term_at(majority_index) == self.term:
+            previous = self.commit_index
+            self.commit_index = majority_index
+            self.broker.state_changed(self, 'commit')
+            self.apply_committed()
+            if any(previous < config_index <= self.commit_index
+                   for config_index, _ in self.configurations):
+                self.configuration_changed()
+            self.advance_membership()
+
+    def membership_settled(self):
+        """
+        Checks whether this node is a leader that may start a configuration change: the
+        latest configuration is committed, and isn't joint, and so is an entry of its term
+        """
+        config_index, configuration = self.configurations[-1]
+        return self.is_leader() and config_index <= self.commit_index and \
+            not configuration.is_joint() and self.commit_index >= self.term_start_index
+
+    def advance_membership(self):
+        """
+        Moves a configuration change on once its latest configuration commits. Leaves a joint
+        configuration for the new voters, steps down if this node is no longer a voter, and
+        otherwise promotes every learner that has caught up.
+        """
+        config_index, configuration = self.configurations[-1]
+        if not self.is_leader() or config_index > self.commit_index or \
+                self.commit_index < self.term_start_index:
+            return
+        if configuration.is_joint():
+            self.propose(Configuration(configuration.voters, configuration.learners))
+        elif self.node_id not in configuration.voters:
+            self.change_type('Follower')
+        else:
+            caught_up = set(learner for learner in configuration.learners
+                            if self.match_index[learner] >= self.commit_index)
+            if caught_up:
+                self.propose(Configuration(configuration.voters | caught_up,
+                                           configuration.learners - caught_up,
+                                           configuration.voters))
+
+    def add_node(self, node_id, learner=True):
+        """
+        Adds a node as a learner, which is promoted to a voter once it has caught up, or
+        straight to the voters, by way of a joint configuration, if learner isn't set.
+        Returns whether the change was proposed.
+        """
+        if not self.membership_settled() or node_id in self.configuration().members():
+            return False
+        configuration = self.configuration()
+        if learner:
+            new = Configuration(configuration.voters, configuration.learners | {node_id})
+        else:
+            new = Configuration(configuration.voters | {node_id}, configuration.learners,
+                                configuration.voters)
+        return self.propose(new) is not None
+
+    def remove_node(self, node_id):
+        """
+        Removes a learner, or a voter by way of a joint configuration. Returns whether the
+        change was proposed.
+        """
+        configuration = self.configuration()
+        if not self.membership_settled() or node_id not in configuration.members() or \
+                configuration.voters == {node_id}:
+            return False
+        if node_id in configuration.learners:
+            new = Configuration(configuration.voters, configuration.learners - {node_id})
+        else:
+            new = Configuration(configuration.voters - {node_id}, configuration.learners,
+                                configuration.voters)
+        return self.propose(new) is not None
+
+    def apply_committed(self):
+        """
+        Applies newly committed entries to the state machine, answering clients if this
+        node is the leader. Then snapshots it and compacts the log once snapshot_interval
+        entries have been applied since the last time.
+        """
+        while self.last_applied < self.commit_index:
+            self.last_applied += 1
+            command = self.log.command_at(self.last_applied)
+            if isinstance(command, tuple):
+                # A batch of client requests. The leader answers each one.
+                for client_id, request_id, read in command:
+                    result = self.state_machine.apply_request(client_id, request_id, read)
+                    if self.is_leader():
+                        self.broker.respond(client_id, request_id, result)
+            elif not isinstance(command, Configuration):
+                self.state_machine.apply(command)
+        if self.pending_reads:
+            self.serve_reads()
+        if self.last_applied - self.log.snapshot_index >= self.conf['snapshot_interval']:
+            self.snapshot_data = self.state_machine.snapshot()
+            self.log.compact(self.last_applied)
+            configuration = self.configuration_at(self.last_applied)
+            self.configurations = [(self.last_applied, configuration)] + \
+                [config for config in self.configurations if config[0] > self.last_applied]
+            self.broker.persist(self.node_id, ('snapshot', self.log.snapshot_index,
+                                               self.log.snapshot_term, self.snapshot_data,
+                                               configuration),
+                                self.log.last_index())
+
+    def propose(self, command):
+        """
+        Appends a command to the log and starts replicating it, if this node is the leader.
+        Returns the index of the new entry, or None if this node isn't the leader.
+        """
+        if not self.is_leader() or self.transfer_target is not None:
+            return None
+        self.log.append(self.term, command)
+        index = self.log.last_index()
+        self.broker.persist(self.node_id, ('append', index, [(self.term, command)]), index)
+        self.configuration_appended(index, command)
+        for peer in self.next_index:
+            self.replicate(peer)
+        self.advance_commit_index()
+        return index
+
+    def submit(self, client_id, request_id, read_mode=None):
+        """
+        Accepts a client's increment, or its read of the counter, if this node is the
+        leader. Returns whether it was accepted.
+
+        Increments, and reads with read_mode 'log', are proposed batched with any other
+        requests received this ms. Reads with 'read_index' are served once a majority
+        confirms this node is still the leader, and reads with 'lease' straight away while
+        its lease holds. Either waits for entries committed before the read to be applied.
+        """
+        if not self.is_leader() or self.transfer_target is not None:
+            return False
+        if read_mode is None or read_mode == 'log':
+            self.pending_requests.append((client_id, request_id, read_mode is not None))
+            if len(self.pending_requests) >= self.conf['max_requests_per_entry']:
+                self.flush_requests()
+            else:
+                self.broker.batching(self.node_id)
+            return True
+        read_index = max(self.commit_index, self.term_start_index)
+        if read_mode == 'lease' and self.conf['leader_leases'] and \
+                self.local_time() < self.lease_until:
+            self.pending_reads.append([0, read_index, client_id, request_id])
+            self.serve_reads()
+        else:
+            self.pending_reads.append([self.read_round + 1, read_index, client_id, request_id])
+            self.round_needed = True
+            self.broker.batching(self.node_id)
+        return True
+
+    def flush_requests(self):
+        "Proposes every queued client request as one entry, and confirms queued reads"
+        if self.pending_requests:
+            requests, self.pending_requests = tuple(self.pending_requests), []
+            self.propose(requests)
+        if self.round_needed and self.is_leader():
+            self.start_read_round()
+            heartbeats = {}  # prev_log_index -> peers
+            for peer in self.next_index:
+                # Peers being probed or sent a snapshot confirm the round with their reply.
+                if peer not in self.probing and self.match_index[peer] >= self.log.snapshot_index:
+                    heartbeats.setdefault(self.match_index[peer], []).append(peer)
+            self.send_heartbeats(heartbeats)
+            self.confirm_reads()
+
+    def start_read_round(self):
+        "Starts a round of confirming leadership, carried by every AppendEntries from now"
+        self.read_round += 1
+        self.round_needed = False
+        now = self.local_time()
+        if self.conf['leader_leases'] and self.transfer_target is None:
+            self.round_times[self.read_round] = now
+            # Rounds too old to extend the lease aren't worth keeping.
+            lease_length = self.conf['election_timeout_window'][0] - self.conf['max_clock_drift']
+            for read_round in list(self.round_times):
+                if self.round_times[read_round] + lease_length > now:
+                    break
+                del self.round_times[read_round]
+
+    def confirm_reads(self):
+        "Serves reads once a majority has acknowledged a round started after they arrived"
+        confirmed = self.quorum_value(self.acked_round, self.read_round)
+        if confirmed > self.confirmed_round:
+            self.confirmed_round = confirmed
+            if confirmed in self.round_times:
+                # No other leader can be elected until the majority's leases run out, which
+                # is no sooner than this, however the clocks drifted within the bound.
+                self.lease_until = max(self.lease_until, self.round_times[confirmed] +
+                                       self.conf['election_timeout_window'][0] -
+                                       self.conf['max_clock_drift'])
+            for read_round in list(self.round_times):
+                if read_round > confirmed:
+                    break
+                del self.round_times[read_round]
+            if self.pending_reads:
+                self.serve_reads()
+
+    def serve_reads(self):
+        "Answers every pending read that is confirmed, and whose read index is applied"
+        waiting = []
+        for read in self.pending_reads:
+            if read[0] <= self.confirmed_round and read[1] <= self.last_applied:
+                self.broker.respond(read[2], read[3], self.state_machine.read())
+            else:
+                waiting.append(read)
+        self.pending_reads = waiting
+
+    def replicate(self, peer):
+        """
+        Sends a peer what it's missing. While probing for where its log matches, that is one
+        request at a time. Otherwise, batches are sent without waiting for replies, until
+        the entries in flight fill the window. Returns whether anything was sent.
+        """
+        if self.next_index[peer] <= self.log.snapshot_index:
+            return self.send_snapshot(peer)
+        batch_size = self.conf['max_entries_per_append']
+        if peer in self.probing:
+            self.send_append_entries(peer, self.next_index[peer] - 1, batch_size)
+            return True
+        window = self.conf['max_appends_in_flight'] * batch_size
+        sent = False
+        while self.next_index[peer] <= self.log.last_index() and \
+                self.next_index[peer] - 1 - self.match_index[peer] < window:
+            self.send_append_entries(peer, self.next_index[peer] - 1, batch_size)
+            sent = True
+        return sent
+
+    def send_append_entries(self, peer, prev_log_index, batch_size):
+        "Sends a peer up to batch_size entries following prev_log_index"
+        entries = self.log.entries(prev_log_index + 1, prev_log_index + 1 + batch_size)
+        self.broker.send_to(self.node_id, peer,
+                            AppendEntries(self.term, self.node_id, prev_log_index,
+                                          self.term_at(prev_log_index), entries,
+                                          self.commit_index, self.read_round))
+        self.next_index[peer] = prev_log_index + len(entries) + 1
+
+    def send_snapshot(self, peer):
+        """
+        Sends a peer chunks of the latest snapshot, without waiting for replies, until the
+        bytes in flight fill the window. Returns whether anything was sent.
+        """
+        progress = self.snapshot_progress.get(peer)
+        if progress is None or progress[0] != self.log.snapshot_index:
+            progress = self.snapshot_progress[peer] = [self.log.snapshot_index, 0, 0]
+        chunk_size = self.conf['snapshot_chunk_size']
+        window = self.conf['max_appends_in_flight'] * chunk_size
+        data = self.snapshot_data
+        sent = False
+        while progress[1] < len(data) and progress[1] - progress[2] < window:
+            chunk = data[progress[1]:progress[1] + chunk_size]
+            self.broker.send_to(self.node_id, peer,
+                                InstallSnapshot(self.term, self.node_id, self.log.snapshot_index,
+                                                self.log.snapshot_term, progress[1], chunk,
+                                                progress[1] + len(chunk) == len(data),
+                                                self.configuration_at(self.log.snapshot_index)))
+            progress[1] += len(chunk)
+            sent = True
+        return sent
+
+    def heartbeat(self):
+        """
+        Sends every peer either what it's missing or an empty AppendEntries. Entries that
+        haven't been acknowledged since the last heartbeat are sent again. Each heartbeat is
+        a new read round, which keeps the lease going.
+        """
+        self.start_read_round()
+        heartbeats = {}  # prev_log_index -> peers
+        for peer in self.next_index:
+            match_index = self.match_index[peer]
+            if self.next_index[peer] <= self.log.snapshot_index:
+                # Chunks that haven't been acknowledged yet are sent again if there's nothing
+                # new to send, which also keeps the peer from timing out.
+                if not self.send_snapshot(peer):
+                    progress = self.snapshot_progress[peer]
+                    progress[1] = progress[2]
+                    self.send_snapshot(peer)
+                continue
+            if peer not in self.probing:
+                if match_index == self.heartbeat_match[peer]:
+                    self.next_index[peer] = match_index + 1
+                self.heartbeat_match[peer] = match_index
+            if not self.replicate(peer):
+                heartbeats.setdefault(match_index, []).append(peer)
+        self.send_heartbeats(heartbeats)
+        self.confirm_reads()
+
+    def send_heartbeats(self, heartbeats):
+        """
+        Sends an empty AppendEntries to the peers in a map of prev_log_index -> peers. Peers
+        that have matched the same prefix share one message.
+        """
+        for prev_log_index, peers in heartbeats.items():
+            self.broker.broadcast(self.node_id,
+                                  AppendEntries(self.term, self.node_id, prev_log_index,
+                                                self.term_at(prev_log_index), [],
+                                                self.commit_index, self.read_round),
+                                  peers)
+
+    def transfer_leadership(self, target=None):
+        """
+        Hands leadership to target, or to the most up to date peer if None. Stops accepting
+        proposals, brings the target up to date, and then sends it TimeoutNow. Gives up if
+        the target hasn't taken over within the minimum election timeout.
+        """
+        if not self.is_leader() or not self.next_index:
+            return
+        voters = [peer for peer in sorted(self.next_index)
+                  if self.configuration().is_voter(peer)]
+        if not voters:
+            return
+        if target is None:
+            target = max(voters, key=lambda peer: self.match_index[peer])
+        if target not in voters:
+            return
+        self.flush_requests()
+        self.transfer_target = target
+        self.transfer_deadline = self.local_time() + self.conf['election_timeout_window'][0]
+        self.timeout_now_sent = False
+        # The target's election will be honoured by followers still hearing from this node,
+        # so its lease can't be relied on from now.
+        self.lease_until = self.local_time()
+        self.round_times = {}
+        if self.match_index[target] == self.log.last_index():
+            self.send_timeout_now()
+        elif target not in self.probing:
+            self.replicate(target)
+
+    def send_timeout_now(self):
+        "Sends TimeoutNow to the transfer target once it has every entry"
+        if not self.timeout_now_sent and \
+                self.match_index[self.transfer_target] == self.log.last_index():
+            self.timeout_now_sent = True
+            self.broker.send_to(self.node_id, self.transfer_target, TimeoutNow(self.term))
+
+    def timer_trip(self):
+        """
+        Starts an election, after a PreVote if conf['pre_vote'] is set. A leader sends
+        heartbeats instead, first stepping down if conf['check_quorum'] is set and it hasn't
+        heard from a majority within the minimum election timeout.
+        """
+        if self.is_leader():
+            if self.conf['check_quorum'] and self.local_time() >= self.quorum_deadline:
+                if not self.configuration().has_quorum(self.recent_contact | {self.node_id}):
+                    self.change_type('Follower')
+                    return
+                self.recent_contact = set()
+                self.quorum_deadline = \
+                    self.local_time() + self.conf['election_timeout_window'][0]
+            if self.transfer_target is not None and \
+                    self.local_time() >= self.transfer_deadline:
+                # The transfer failed, so carry on leading.
+                self.transfer_target = None
+            self.heartbeat()
             self.broker.set_timeout(
                 self.node_id, self.conf['heartbeat_timeout'])
+        elif not self.configuration().is_voter(self.node_id):
+            # Learners, and nodes that aren't members, never campaign.
+            self.broker.set_timeout(self.node_id, self.election_timeout)
+        elif self.conf['pre_vote']:
+            self.start_pre_vote()
+        else:
+            self.start_election()
+
+    def start_pre_vote(self):
+        "Asks every node whether it would vote for this one, without changing term"
+        if self.is_candidate():
+            # The election timed out, so go back to checking one could succeed.
+            self.change_type('Follower')
+        else:
+            self.broker.set_timeout(self.node_id, self.election_timeout)
+        self.pre_voting = True
+        self.pre_votes_received = {self.node_id}
+        if self.configuration().has_quorum(self.pre_votes_received):
+            self.start_election()
+            return
+        self.broker.broadcast(self.node_id,
+                              PreVote(self.term + 1, self.node_id, self.log.last_index(),
+                                      self.last_log_term()),
+                              self.configuration().all_voters())
+
+    def start_election(self, leadership_transfer=False):
+        "Moves to the next term, votes for this node, and asks every other node to"
+        self.change_type('Candidate')
+        self.update_term(self.term + 1, True)
+        self.votes_received.add(self.node_id)
+        self.voted_for = self.node_id
+        self.persist_state()
+        if self.tracer.vote_info:
+            self.test_log({"event_type": "cast_vote", "voted_for": self.node_id})
+        self.broker.send_after_sync(self.node_id,
+                                    RequestVote(self.term, self.node_id,
+                                                self.log.last_index(), self.last_log_term(),
+                                                leadership_transfer),
+                                    self.configuration().all_voters())
+        if self.configuration().has_quorum(self.votes_received):
+            # The only voter left
+            self.change_type('Leader')
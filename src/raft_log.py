@@ -0,0 +1,153 @@
+"""
+The replicated log kept by each node.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from copy import copy
+
+
+class RaftLog:
+    """
+    A Raft log, indexed from 1. Terms are kept in an array parallel to the list of commands,
+    so the log doesn't hold a tuple per entry.
+
+    Terms never decrease along the log, so it is a run of entries for each term. The term
+    and first index of each run are kept in their own arrays, and the first or last index of
+    a term is found by binary search over them.
+
+    Entries up to snapshot_index have been compacted into a snapshot, and only the term of
+    the last of them is kept.
+
+    Copies share their arrays and commands until one of them changes its entries, and only
+    then does it copy them.
+    """
+
+    def __init__(self):
+        self.snapshot_index = 0
+        self.snapshot_term = 0
+        # The term of the entry at index i is self.terms[i - self.snapshot_index - 1]
+        self.terms = array('q')
+        self.commands = []
+        self.run_terms = array('q')  # the terms in the log, in order
+        self.run_starts = array('q')  # the index of the first entry of each of those terms
+        self.shared = False  # whether a copy of the log holds the same arrays and commands
+
+    def __deepcopy__(self, memo):
+        "Copies the log, sharing its arrays and commands until either copy changes them"
+        self.shared = True
+        return copy(self)
+
+    def unshare(self):
+        "Copies the arrays and commands shared with other copies, before changing them"
+        self.terms = array('q', self.terms)
+        self.commands = list(self.commands)
+        self.run_terms = array('q', self.run_terms)
+        self.run_starts = array('q', self.run_starts)
+        self.shared = False
+
+    def __len__(self):
+        "The number of entries held, not counting compacted ones"
+        return len(self.terms)
+
+    def last_index(self):
+        "Returns the index of the last entry, including compacted ones"
+        return self.snapshot_index + len(self.terms)
+
+    def term_at(self, index):
+        """
+        Returns the term of the entry at index, 0 for the empty prefix, or None if the entry
+        was compacted
+        """
+        if index <= self.snapshot_index:
+            return self.snapshot_term if index == self.snapshot_index else None
+        return self.terms[index - self.snapshot_index - 1]
+
+    def last_term(self):
+        "Returns the term of the last entry, or 0 if the log is empty"
+        return self.terms[-1] if self.terms else self.snapshot_term
+
+    def append(self, term, command):
+        "Adds an entry to the end of the log"
+        if self.shared:
+            self.unshare()
+        if not self.terms or self.terms[-1] != term:
+            assert term >= self.last_term()
+            self.run_terms.append(term)
+            self.run_starts.append(self.last_index() + 1)
+        self.terms.append(term)
+        self.commands.append(command)
+
+    def entries(self, start, stop):
+        "Returns the entries from index start up to stop, as (term, command) tuples"
+        start -= self.snapshot_index + 1
+        stop -= self.snapshot_index + 1
+        return list(zip(self.terms[start:stop], self.commands[start:stop]))
+
+    def command_at(self, index):
+        "Returns the command of the entry at index, which must not be compacted"
+        return self.commands[index - self.snapshot_index - 1]
+
+    def truncate(self, index):
+        "Removes the entry at index and every entry after it"
+        assert index > self.snapshot_index
+        if self.shared:
+            self.unshare()
+        del self.terms[index - self.snapshot_index - 1:]
+        del self.commands[index - self.snapshot_index - 1:]
+        run = bisect_left(self.run_starts, index)
+        del self.run_terms[run:]
+        del self.run_starts[run:]
+
+    def compact(self, index):
+        "Discards every entry up to and including index, which must be in the log"
+        if index <= self.snapshot_index:
+            return
+        if self.shared:
+            self.unshare()
+        self.snapshot_term = self.term_at(index)
+        del self.terms[:index - self.snapshot_index]
+        del self.commands[:index - self.snapshot_index]
+        self.snapshot_index = index
+        if self.terms:
+            # Drop the runs that ended by index, and start the one the next entry is in
+            # after it.
+            run = bisect_right(self.run_starts, index + 1) - 1
+            del self.run_terms[:run]
+            del self.run_starts[:run]
+            self.run_starts[0] = index + 1
+        else:
+            del self.run_terms[:]
+            del self.run_starts[:]
+
+    def install_snapshot(self, index, term):
+        """
+        Moves the start of the log to a snapshot that ends at index, in term. Entries after
+        it are kept if the log has the snapshot's last entry, and discarded otherwise.
+        """
+        if index <= self.last_index() and self.term_at(index) == term:
+            self.compact(index)
+            return
+        self.terms = array('q')
+        self.commands = []
+        self.run_terms = array('q')
+        self.run_starts = array('q')
+        self.shared = False
+        self.snapshot_index = index
+        self.snapshot_term = term
+
+    def first_index_of_term(self, term):
+        "Returns the index of the first entry with the term, or None if there are none"
+        run = bisect_left(self.run_terms, term)
+        if run == len(self.run_terms) or self.run_terms[run] != term:
+            return None
+        return self.run_starts[run]
+
+    def last_index_of_term(self, term):
+        "Returns the index of the last entry with the term, or None if there are none"
+        run = bisect_left(self.run_terms, term)
+        if run == len(self.run_terms) or self.run_terms[run] != term:
+            return None
+        if run + 1 < len(self.run_starts):
+            return self.run_starts[run + 1] - 1
+        return self.last_index()
@@ -0,0 +1,365 @@
+#!/usr/local/bin/python3
+"""
+Runs nodes as separate processes on one machine, talking over localhost TCP and timed by the
+asyncio event loop, instead of in the simulated world. The Node class is the same; only the
+broker it talks to differs.
+
+Each process runs one node, writes its state to segment files, and prints a JSON line
+whenever the node changes type, and one with what it has sent every second. Cluster starts
+and kills such processes, and measure_cluster uses it to time real elections and measure
+heartbeat traffic.
+"""
+
+from optparse import OptionParser
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+from random import Random
+from node import Node, node_conf
+from storage import NodeStorage, make_disk
+from tracing import Tracer, OFF
+from codec import write_uint, read_uint, write_message, decode
+
+# A frame is its length, followed by the sender as a varint and the encoded message
+FRAME_HEADER = struct.Struct('>I')
+
+
+class Peer:
+    """
+    The connection to one peer, opened when first needed and reused after. Frames sent to the
+    peer while the event loop runs one callback are written together once it returns. Frames
+    sent while the peer can't be reached are dropped, as a network would drop them, and the
+    next send tries to connect again.
+
+    Peers never write back on the connection, so reading from it only returns once the peer
+    has closed it. The connection is forgotten then, rather than on the next write failing,
+    which would lose that write to a restarted peer.
+    """
+
+    def __init__(self, address, stats):
+        self.address = address
+        self.stats = stats
+        self.writer = None
+        self.connecting = False
+        self.frames = []
+        self.flush_scheduled = False
+
+    def send(self, frame):
+        "Queues a frame, to be written with any others sent before the loop gets back to it"
+        self.frames.append(frame)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        "Writes every queued frame at once, connecting first if need be"
+        self.flush_scheduled = False
+        if self.writer is not None and self.writer.transport.is_closing():
+            self.writer = None
+        if self.writer is None:
+            if not self.connecting:
+                self.connecting = True
+                asyncio.ensure_future(self.connect())
+            return
+        data = b''.join(self.frames)
+        self.frames = []
+        self.writer.write(data)
+        self.stats['writes'] += 1
+        self.stats['bytes'] += len(data)
+
+    async def connect(self):
+        "Opens the connection, then writes what was queued meanwhile, or drops it on failure"
+        try:
+            reader, self.writer = await asyncio.open_connection(*self.address)
+            asyncio.ensure_future(self.watch(reader, self.writer))
+        except OSError:
+            self.frames = []
+        self.connecting = False
+        if self.frames:
+            self.flush()
+
+    async def watch(self, reader, writer):
+        "Forgets the connection once the peer closes it"
+        try:
+            await reader.read()
+        except ConnectionError:
+            pass
+        writer.close()
+        if self.writer is writer:
+            self.writer = None
+
+
+class NodeRuntime:
+    """
+    The broker a node talks to when it runs as its own process. Messages go over TCP to the
+    other nodes' processes, timers are event loop timers, and every write is synced to the
+    node's segment files before the node carries on.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, node_id, addresses, conf, storage_dir, tracer=None):
+        self.node_id = node_id
+        self.addresses = addresses  # node_id -> (host, port)
+        self.tracer = tracer or Tracer(OFF)
+        self.loop = asyncio.get_event_loop()
+        # Messages the node sent, and the bytes and socket writes they took
+        self.stats = {'messages': 0, 'bytes': 0, 'writes': 0}
+        self.peers = {peer: Peer(address, self.stats) for peer, address in addresses.items()
+                      if peer != node_id}
+        self.file_broker = {node_id: NodeStorage(make_disk('segments', node_id, storage_dir))}
+        self.timer = None
+        self.node = Node(node_id, conf, Random(), self)
+        records = self.file_broker[node_id].records()
+        if records:
+            self.node.recover(records)
+
+    def report(self, entry):
+        "Prints an entry as a JSON line, with the wall clock time in ms and the node's id"
+        entry['time'] = time.time() * 1000
+        entry['node'] = self.node_id
+        print(json.dumps(entry, default=repr), flush=True)
+
+    def log(self, entry):
+        "Reports what the node traces"
+        self.report(entry)
+
+    def state_changed(self, node, transition):
+        "Reports each change of the node's type"
+        if transition == 'change_type':
+            self.report({'event': 'state', 'state': node.node_type, 'term': node.term})
+
+    def set_timeout(self, node_id, timeout):
+        "Arms the node's timer, replacing any pending one"
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(timeout / 1000, self.timer_trip)
+
+    def timer_trip(self):
+        "Trips the node's timer"
+        self.timer = None
+        self.node.timer_trip()
+
+    def local_time(self, node_id):
+        "Returns the event loop's clock, in ms"
+        return int(self.loop.time() * 1000)
+
+    def persist(self, node_id, record, log_length):
+        "Writes a record, and syncs it before returning"
+        self.file_broker[node_id].write_synced(record, log_length)
+
+    def send_after_sync(self, origin, data, destinations):
+        "Sends a message. Every write is already durable."
+        self.broadcast(origin, data, destinations)
+
+    def send_to(self, origin, destination, data):
+        "Sends a message to one node"
+        self.broadcast(origin, data, (destination,))
+
+    def broadcast(self, origin, data, destinations=None):
+        "Sends a message to every node in destinations, by default all of them, but origin"
+        if destinations is None:
+            destinations = self.addresses
+        frame = bytearray(FRAME_HEADER.size)
+        write_uint(frame, origin)
+        write_message(frame, data)
+        FRAME_HEADER.pack_into(frame, 0, len(frame) - FRAME_HEADER.size)
+        frame = bytes(frame)
+        for destination in destinations:
+            if destination != origin:
+                self.peers[destination].send(frame)
+                self.stats['messages'] += 1
+
+    def batching(self, node_id):
+        "Has the node propose the client requests it holds once the current callback returns"
+        self.loop.call_soon(self.node.flush_requests)
+
+    # pylint: disable=unused-argument
+    def respond(self, client_id, request_id, result):
+        "Processes have no clients to reply to"
+        pass
+
+    async def receive_frames(self, reader, writer):
+        "Hands each frame a peer sends to the node, until the peer disconnects"
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                payload = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                sender, offset = read_uint(payload, 0)
+                self.node.receive(sender, decode(memoryview(payload)[offset:]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    async def run(self):
+        "Listens for peers, boots the node, and reports its stats every second"
+        await asyncio.start_server(self.receive_frames, *self.addresses[self.node_id])
+        self.node.setup()
+        self.report({'event': 'ready'})
+        while True:
+            await asyncio.sleep(1)
+            self.report(dict(self.stats, event='stats'))
+
+
+def free_ports(count):
+    "Returns count localhost ports that are free now"
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(('127.0.0.1', 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+class Cluster:
+    """
+    Runs a node process for each node of a cluster, and follows what they report. Killed
+    nodes can be started again, and recover from their segment files.
+    """
+
+    def __init__(self, cluster_size, storage_dir, pre_vote=False, check_quorum=False):
+        self.addresses = ','.join('127.0.0.1:{}'.format(port)
+                                  for port in free_ports(cluster_size))
+        self.storage_dir = storage_dir
+        self.flags = (['--pre-vote'] if pre_vote else []) + \
+            (['--check-quorum'] if check_quorum else [])
+        self.processes = {}
+        self.events = asyncio.Queue()
+        self.stats = {}  # node_id -> the node's latest stats
+        self.leader = None  # the latest node to report being elected
+        self.leader_term = 0
+
+    async def start(self, node_id):
+        "Starts a node's process"
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--node-id', str(node_id),
+            '--addresses', self.addresses, '--storage-dir', self.storage_dir, *self.flags,
+            stdout=asyncio.subprocess.PIPE)
+        self.processes[node_id] = process
+        asyncio.ensure_future(self.follow(process))
+
+    async def follow(self, process):
+        "Reads what a process reports, until it exits"
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                return
+            entry = json.loads(line.decode())
+            if entry['event'] == 'stats':
+                self.stats[entry['node']] = entry
+                continue
+            if entry['event'] == 'state' and entry['state'] == 'Leader' and \
+                    entry['term'] >= self.leader_term:
+                self.leader, self.leader_term = entry['node'], entry['term']
+            await self.events.put(entry)
+
+    async def wait_for(self, matches, timeout=10):
+        "Returns the next reported entry that matches, skipping any others"
+        while True:
+            entry = await asyncio.wait_for(self.events.get(), timeout)
+            if matches(entry):
+                return entry
+
+    async def kill(self, node_id):
+        "Kills a node's process, as a power failure would"
+        process = self.processes.pop(node_id)
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+    async def stop(self):
+        "Kills every process"
+        for node_id in list(self.processes):
+            await self.kill(node_id)
+
+
+def traffic(before, after):
+    "Returns the messages, bytes and socket writes per second sent between two stats reports"
+    seconds = sum(after[node_id]['time'] - before[node_id]['time'] for node_id in before) / \
+        len(before) / 1000
+    return {key: sum(after[node_id][key] - before[node_id][key] for node_id in before) / seconds
+            for key in ('messages', 'bytes', 'writes')}
+
+
+# pylint: disable=too-many-locals
+async def measure_cluster(cluster_size, trials, quiet_seconds, pre_vote=False,
+                          check_quorum=False):
+    """
+    Starts a cluster of processes and returns the ms until the first leader was elected,
+    the heartbeat traffic once it was, and the ms until a new leader was elected after each
+    of trials leaders was killed.
+    """
+    storage_dir = tempfile.mkdtemp(prefix='raft-runtime-')
+    cluster = Cluster(cluster_size, storage_dir, pre_vote, check_quorum)
+    try:
+        for node_id in range(cluster_size):
+            await cluster.start(node_id)
+        booted = 0
+        while booted < cluster_size:
+            ready = await cluster.wait_for(lambda entry: entry['event'] == 'ready')
+            booted += 1
+        elected = await cluster.wait_for(lambda entry: entry.get('state') == 'Leader')
+        first_election = elected['time'] - ready['time']
+
+        # Heartbeats are all that is sent once a leader is settled.
+        await asyncio.sleep(1.5)
+        before = dict(cluster.stats)
+        await asyncio.sleep(quiet_seconds)
+        heartbeats = traffic(before, dict(cluster.stats))
+
+        failovers = []
+        for _ in range(trials):
+            old_leader, old_term = cluster.leader, cluster.leader_term
+            killed_at = time.time() * 1000
+            await cluster.kill(old_leader)
+            elected = await cluster.wait_for(
+                lambda entry, term=old_term: entry.get('state') == 'Leader' and
+                entry['term'] > term)
+            failovers.append(elected['time'] - killed_at)
+            await cluster.start(old_leader)
+            await cluster.wait_for(lambda entry: entry['event'] == 'ready')
+            await asyncio.sleep(0.5)
+        return {'first_election_ms': first_election, 'heartbeats': heartbeats,
+                'failover_ms': failovers}
+    finally:
+        await cluster.stop()
+
+
+def main():
+    "Runs one node"
+    parser = OptionParser()
+    parser.add_option("--node-id", dest="node_id",
+                      help="The id of the node to run",
+                      action="store", type="int", default=0)
+    parser.add_option("--addresses", dest="addresses",
+                      help="Comma separated host:port of every node, in node id order",
+                      action="store", type="string", default="127.0.0.1:9100")
+    parser.add_option("--storage-dir", dest="storage_dir",
+                      help="The directory the node's segment files go in",
+                      action="store", type="string", default=None)
+    parser.add_option("--pre-vote", dest="pre_vote",
+                      help="Check a majority would vote for the node before it starts an "
+                           "election",
+                      action="store_true", default=False)
+    parser.add_option("--check-quorum", dest="check_quorum",
+                      help="Step down as leader when out of touch with a majority",
+                      action="store_true", default=False)
+    options, _ = parser.parse_args(sys.argv)
+    addresses = {}
+    for node_id, address in enumerate(options.addresses.split(',')):
+        host, port = address.rsplit(':', 1)
+        addresses[node_id] = (host, int(port))
+    conf = node_conf(len(addresses), pre_vote=options.pre_vote,
+                     check_quorum=options.check_quorum)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runtime = NodeRuntime(options.node_id, addresses, conf, options.storage_dir)
+    loop.run_until_complete(runtime.run())
+
+
+if __name__ == '__main__':
+    main()
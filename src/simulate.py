@@ -3,12 +3,9 @@
 from optparse import OptionParser
 import sys
 import unittest
-from world_broker import WorldBroker
-from hypothesis import settings
-from hypothesis.stateful import find_breaking_runner
-from hypothesis.errors import NoSuchExample
-from hypothesis.control import BuildContext
-from hypothesis.internal.conjecture.data import StopTest
+from sweep import run_sweep, settings_combinations
+from log_sinks import make_sink, NullSink
+from tracing import Tracer, OFF, parse_tracer
 
 class Simulate(unittest.TestCase):
     "Runs the Simulation"
@@ -16,24 +13,67 @@ class Simulate(unittest.TestCase):
     CATASTROPHY = 0
     MS_PER_STEP = 700
     MAX_MS_PER_EVENT = 400
+    CLUSTER_SIZE = 5
+    SPARE_NODES = 0
+    GROUPS = 1
+    PROPOSAL_INTERVAL = None
+    CLIENTS = 0
+    READ_FRACTION = 0.0
+    READ_MODE = 'read_index'
+    MAX_CLOCK_DRIFT = 50
+    PRE_VOTE = False
+    CHECK_QUORUM = False
+    FSYNC_LATENCY = 0
+    CRASH = False
+    FAST_CHECK = False
     MAX_STEPS = 50
     MAX_ATTEMPTS = 200
+    LOG_SINK = 'list'
+    LOG_SIZE = 1000
+    LOG_FILE = 'simulation_log.jsonl.gz'
+    TRACER = Tracer()
 
     # pylint: disable=no-method-argument
     def test_raft(self):
         "Run the test"
+        # Hypothesis is only needed to search, so seeded runs (-j) start without it.
+        from hypothesis import settings
+        from hypothesis.stateful import find_breaking_runner
+        from hypothesis.errors import NoSuchExample
+        from hypothesis.control import BuildContext
+        from hypothesis.internal.conjecture.data import StopTest
+        from world_machine import WorldMachine
+
         def init_broker(outside_log=None):
-            "Appends a new log to the end of the list"
-            if not outside_log:
-                latest_log = [{'event_type': 'Simulation Initialization'}]
+            "Logs into outside_log, or nowhere while searching for a breaking example"
+            if outside_log is None:
+                latest_log = NullSink()
+                tracer = Tracer(OFF)
             else:
                 latest_log = outside_log
-            return WorldBroker(log=latest_log, catastrophy_level=Simulate.CATASTROPHY,
-                               ms_per_step=Simulate.MS_PER_STEP,
-                               max_ms_per_event=Simulate.MAX_MS_PER_EVENT)
+                tracer = Simulate.TRACER
+            return WorldMachine(log=latest_log, tracer=tracer,
+                                catastrophy_level=Simulate.CATASTROPHY,
+                                ms_per_step=Simulate.MS_PER_STEP,
+                                max_ms_per_event=Simulate.MAX_MS_PER_EVENT,
+                                cluster_size=Simulate.CLUSTER_SIZE,
+                                spare_nodes=Simulate.SPARE_NODES,
+                                groups=Simulate.GROUPS,
+                                proposal_interval=Simulate.PROPOSAL_INTERVAL,
+                                clients=Simulate.CLIENTS,
+                                read_fraction=Simulate.READ_FRACTION,
+                                read_mode=Simulate.READ_MODE,
+                                leader_leases=Simulate.READ_MODE == 'lease',
+                                max_clock_drift=Simulate.MAX_CLOCK_DRIFT,
+                                pre_vote=Simulate.PRE_VOTE,
+                                check_quorum=Simulate.CHECK_QUORUM,
+                                fsync_latency=Simulate.FSYNC_LATENCY,
+                                crash_on_power_down=Simulate.CRASH,
+                                fast_check=Simulate.FAST_CHECK)
         
         internal_settings = settings(stateful_step_count=Simulate.MAX_STEPS, max_iterations=Simulate.MAX_ATTEMPTS)
-        log = [{'event_type': 'Simulation Initialization'}]
+        log = make_sink(Simulate.LOG_SINK, Simulate.LOG_SIZE, Simulate.LOG_FILE)
+        log.append({'event_type': 'Simulation Initialization'})
         # print("Attempting with Settings:", Simulate.CATASTROPHY,Simulate.MS_PER_STEP,Simulate.MAX_MS_PER_EVENT)
         try:
             # print("About to find a breaker")
@@ -53,24 +93,160 @@ class Simulate(unittest.TestCase):
         finally:
             for event in log:
                 print(event)
+            if hasattr(log, 'close'):
+                log.close()
 #        raise Flaky(u'Run failed initially but succeeded on a second try')
 
+def int_list(option_value):
+    "Parses a comma separated list of integers"
+    return [int(value) for value in option_value.split(',')]
+
+def bool_list(option_value):
+    "Parses a comma separated list of 0s and 1s"
+    return [bool(value) for value in int_list(option_value)]
+
 if __name__ == '__main__':
     parser = OptionParser()
     parser.add_option("-c", "--catastrophy-level", dest="catastrophy",
-                      help="The number of errors to generate per step",
-                      action="store", type="int",default=0)
+                      help="The number of errors to generate per step (comma separated to sweep)",
+                      action="store", type="string", default="0")
     parser.add_option("-s", "--ms-per-step", dest="ms_per_step",
-                      help="The number of ms to emulate per step",
-                      action="store", type="int",default=700)
+                      help="The number of ms to emulate per step (comma separated to sweep)",
+                      action="store", type="string", default="700")
     parser.add_option("-e", "--max-ms-per-event", dest="max_ms_per_event",
-                      help="The maximum number of ms that an event can last",
-                      action="store", type="int",default=400)
+                      help="The maximum number of ms that an event can last "
+                           "(comma separated to sweep)",
+                      action="store", type="string", default="400")
+    parser.add_option("-k", "--cluster-size", dest="cluster_size",
+                      help="The number of nodes in the cluster (comma separated to sweep)",
+                      action="store", type="string", default="5")
+    parser.add_option("--spare-nodes", dest="spare_nodes",
+                      help="Run this many more nodes outside the cluster, and add and remove "
+                           "nodes as it runs",
+                      action="store", type="int", default=0)
+    parser.add_option("--groups", dest="groups",
+                      help="Run this many Raft groups on the same nodes, without clients",
+                      action="store", type="int", default=1)
+    parser.add_option("-p", "--proposal-interval", dest="proposal_interval",
+                      help="Have a client propose an entry every this many ms",
+                      action="store", type="int", default=None)
+    parser.add_option("--clients", dest="clients",
+                      help="Run this many clients, each sending an increment and waiting for "
+                           "the reply",
+                      action="store", type="int", default=0)
+    parser.add_option("--read-fraction", dest="read_fraction",
+                      help="The fraction of client requests that are reads",
+                      action="store", type="float", default=0.0)
+    parser.add_option("--read-mode", dest="read_mode",
+                      help="How reads are served: log, read_index, or lease (which gives "
+                           "leaders leases)",
+                      action="store", type="choice", choices=['log', 'read_index', 'lease'],
+                      default='read_index')
+    parser.add_option("--max-clock-drift", dest="max_clock_drift",
+                      help="The most ms two nodes' clocks move apart by over a lease. Leaders "
+                           "stop reading on their lease this much early, and clock skews are "
+                           "kept within it",
+                      action="store", type="int", default=50)
+    parser.add_option("--pre-vote", dest="pre_vote",
+                      help="1 to have nodes check a majority would vote for them before "
+                           "starting an election, 0 not to (comma separated to sweep)",
+                      action="store", type="string", default="0")
+    parser.add_option("--check-quorum", dest="check_quorum",
+                      help="1 to have leaders step down when they lose touch with a majority, "
+                           "0 not to (comma separated to sweep)",
+                      action="store", type="string", default="0")
+    parser.add_option("--fsync-latency", dest="fsync_latency",
+                      help="The number of ms each sync of a node's disk takes",
+                      action="store", type="int", default=0)
+    parser.add_option("--crash", dest="crash",
+                      help="Lose unsynced writes when a node powers down, and restart it from "
+                           "its disk",
+                      action="store_true", default=False)
+    parser.add_option("--fast-check", dest="fast_check",
+                      help="Check client histories are linearizable with the counter's fast "
+                           "path instead of searching",
+                      action="store_true", default=False)
+    parser.add_option("-j", "--jobs", dest="jobs",
+                      help="Run seeded simulations on this many processes instead of "
+                           "searching with hypothesis",
+                      action="store", type="int", default=0)
+    parser.add_option("--branches", dest="branches",
+                      help="Fork this many runs from each seed's first --prefix-steps steps, "
+                           "rather than running each seed once (with -j)",
+                      action="store", type="int", default=1)
+    parser.add_option("--prefix-steps", dest="prefix_steps",
+                      help="The number of steps each seed runs before its branches fork",
+                      action="store", type="int", default=10)
+    parser.add_option("-n", "--seeds", dest="seeds",
+                      help="The number of seeds to run for each combination of settings",
+                      action="store", type="int", default=100)
+    parser.add_option("--log-sink", dest="log_sink",
+                      help="Where the event log goes: list, ring, jsonl or null",
+                      action="store", type="choice", choices=['list', 'ring', 'jsonl', 'null'],
+                      default='list')
+    parser.add_option("--log-size", dest="log_size",
+                      help="The number of events the ring log sink keeps",
+                      action="store", type="int", default=1000)
+    parser.add_option("--log-file", dest="log_file",
+                      help="The file the jsonl log sink writes to",
+                      action="store", type="string", default='simulation_log.jsonl.gz')
+    parser.add_option("--trace-level", dest="trace_level",
+                      help="How much of the event log to record: off, info or debug",
+                      action="store", type="choice", choices=['off', 'info', 'debug'],
+                      default='debug')
+    parser.add_option("--trace", dest="trace",
+                      help="Comma separated categories to record: state, vote, term, timer, "
+                           "message and fault, or all",
+                      action="store", type="string", default='all')
+    parser.add_option("--keep-going", dest="keep_going",
+                      help="Don't stop at the first failing run",
+                      action="store_true", default=False)
     options, args = parser.parse_args(sys.argv)
-    Simulate.CATASTROPHY = options.catastrophy
-    Simulate.MS_PER_STEP = options.ms_per_step
-    Simulate.MAX_MS_PER_EVENT = options.max_ms_per_event
-    suite = unittest.TestSuite()
-    suite.addTest(Simulate(methodName='test_raft'))
-    unittest.TextTestRunner(verbosity=2).run(suite)
-
+    combinations = settings_combinations(int_list(options.catastrophy),
+                                         int_list(options.ms_per_step),
+                                         int_list(options.max_ms_per_event),
+                                         int_list(options.cluster_size),
+                                         bool_list(options.pre_vote),
+                                         bool_list(options.check_quorum))
+    for combination in combinations:
+        combination.update({'spare_nodes': options.spare_nodes,
+                            'groups': options.groups,
+                            'proposal_interval': options.proposal_interval,
+                            'clients': options.clients,
+                            'read_fraction': options.read_fraction,
+                            'read_mode': options.read_mode,
+                            'leader_leases': options.read_mode == 'lease',
+                            'max_clock_drift': options.max_clock_drift,
+                            'fsync_latency': options.fsync_latency,
+                            'crash_on_power_down': options.crash,
+                            'fast_check': options.fast_check})
+    Simulate.SPARE_NODES = options.spare_nodes
+    Simulate.GROUPS = options.groups
+    Simulate.PROPOSAL_INTERVAL = options.proposal_interval
+    Simulate.CLIENTS = options.clients
+    Simulate.READ_FRACTION = options.read_fraction
+    Simulate.READ_MODE = options.read_mode
+    Simulate.MAX_CLOCK_DRIFT = options.max_clock_drift
+    Simulate.FSYNC_LATENCY = options.fsync_latency
+    Simulate.CRASH = options.crash
+    Simulate.FAST_CHECK = options.fast_check
+    Simulate.LOG_SINK = options.log_sink
+    Simulate.LOG_SIZE = options.log_size
+    Simulate.LOG_FILE = options.log_file
+    Simulate.TRACER = parse_tracer(options.trace_level, options.trace)
+    if options.jobs:
+        failures = run_sweep(combinations, options.seeds, Simulate.MAX_STEPS, options.jobs,
+                             stop_on_failure=not options.keep_going,
+                             log_size=options.log_size, tracer=Simulate.TRACER,
+                             branches=options.branches, prefix_steps=options.prefix_steps)
+        sys.exit(1 if failures else 0)
+    for combination in combinations:
+        Simulate.CATASTROPHY = combination['catastrophy_level']
+        Simulate.MS_PER_STEP = combination['ms_per_step']
+        Simulate.MAX_MS_PER_EVENT = combination['max_ms_per_event']
+        Simulate.CLUSTER_SIZE = combination['cluster_size']
+        Simulate.PRE_VOTE = combination['pre_vote']
+        Simulate.CHECK_QUORUM = combination['check_quorum']
+        suite = unittest.TestSuite()
+        suite.addTest(Simulate(methodName='test_raft'))
+        unittest.TextTestRunner(verbosity=2).run(suite)
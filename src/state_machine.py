@@ -0,0 +1,50 @@
+"""
+The state machines that nodes apply committed commands to.
+"""
+
+import pickle
+
+
+class Counter:
+    """
+    Counts the commands applied to it, other than the empty commands (None) that leaders
+    commit at the start of their term.
+
+    Clients' increments and reads carry a client id and request id, and the last request
+    applied for each client is remembered with its result. A client retries a request until
+    it hears back, so the same request may be committed more than once, but it is only
+    applied once.
+    Its snapshot grows with the number of clients, but not with the number of commands.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self.sessions = {}  # client id -> (the last request id applied, its result)
+
+    def apply(self, command):
+        "Applies a committed command, returning the result"
+        if command is not None:
+            self.value += 1
+        return self.value
+
+    def apply_request(self, client_id, request_id, read=False):
+        "Applies a client's increment or read, unless it already was, returning the result"
+        session = self.sessions.get(client_id)
+        if session is not None and session[0] >= request_id:
+            return session[1]
+        if not read:
+            self.value += 1
+        self.sessions[client_id] = (request_id, self.value)
+        return self.value
+
+    def read(self):
+        "Returns the count, for a read that doesn't go through the log"
+        return self.value
+
+    def snapshot(self):
+        "Returns the state as bytes"
+        return pickle.dumps((self.value, self.sessions))
+
+    def restore(self, data):
+        "Replaces the state with one returned by snapshot"
+        self.value, self.sessions = pickle.loads(data)
@@ -0,0 +1,367 @@
+"""
+Durable storage for node state, kept in the file broker.
+
+Each node writes records to a disk: ('state', term, voted_for), ('append', index, entries),
+('truncate', index) or ('snapshot', index, term, data, configuration). Writes only become
+durable once synced, and NodeStorage groups every write made while a sync is in progress
+into the next sync. A node that crashes loses any unsynced writes, and recovers by replaying
+the records that were synced. Once enough records have been synced, they are rewritten as
+the few records it takes to describe the same state, so disks stay small after snapshots.
+"""
+
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+from raft_log import RaftLog
+
+
+def replay(records):
+    """
+    Returns the term, vote, latest snapshot (index, term, data, configuration) and log that
+    the records describe, in a map
+    """
+    state = {'term': 0, 'voted_for': None, 'snapshot': None, 'log': RaftLog()}
+    log = state['log']
+    for record in records:
+        if record[0] == 'state':
+            _, state['term'], state['voted_for'] = record
+        elif record[0] == 'append':
+            _, index, entries = record
+            for term, command in entries:
+                if index > log.snapshot_index:
+                    if index <= log.last_index():
+                        log.truncate(index)
+                    log.append(term, command)
+                index += 1
+        elif record[0] == 'truncate':
+            if record[1] > log.snapshot_index:
+                log.truncate(record[1])
+        elif record[0] == 'snapshot':
+            _, index, term, data, configuration = record
+            log.install_snapshot(index, term)
+            state['snapshot'] = (index, term, data, configuration)
+    return state
+
+
+def record_size(record):
+    "Counts an append as one record per entry"
+    return len(record[2]) if record[0] == 'append' else 1
+
+
+def compact_records(records):
+    "Returns the fewest records that describe the same state as the given ones"
+    state = replay(records)
+    log = state['log']
+    compacted = [('state', state['term'], state['voted_for'])]
+    if state['snapshot'] is not None:
+        compacted.append(('snapshot',) + state['snapshot'])
+    if len(log):
+        compacted.append(('append', log.snapshot_index + 1,
+                          log.entries(log.snapshot_index + 1, log.last_index() + 1)))
+    return compacted
+
+
+class SimulatedDisk:
+    "Keeps records in memory"
+
+    def __init__(self):
+        self.synced = []
+        self.unsynced = []
+        self.shared = False  # whether a copy of the disk holds the same lists of records
+
+    def __deepcopy__(self, memo):
+        "Copies the disk, sharing its lists of records until either copy changes them"
+        self.shared = True
+        copy = SimulatedDisk()
+        copy.synced = self.synced
+        copy.unsynced = self.unsynced
+        copy.shared = True
+        return copy
+
+    def write(self, record):
+        "Adds a record after every record written so far"
+        if self.shared:
+            self.unshare()
+        self.unsynced.append(record)
+
+    def unshare(self):
+        "Copies the lists of records shared with other copies, before changing them"
+        self.synced = list(self.synced)
+        self.unsynced = list(self.unsynced)
+        self.shared = False
+
+    def mark(self):
+        "Returns the position after the last record written"
+        return len(self.synced) + len(self.unsynced)
+
+    def sync(self, mark):
+        "Makes every record before mark durable"
+        count = mark - len(self.synced)
+        if self.shared:
+            self.unshare()
+        self.synced.extend(self.unsynced[:count])
+        self.unsynced = self.unsynced[count:]
+
+    def drop_unsynced(self):
+        "Loses every record written since the last sync, as a crash would"
+        self.unsynced = []
+
+    def records(self):
+        "Returns the synced records, in the order they were written"
+        return list(self.synced)
+
+    def rewrite(self, records):
+        "Replaces the synced records with ones describing the same state"
+        self.synced = list(records)
+
+    def close(self):
+        "Nothing to close"
+        pass
+
+
+# A record is its length, followed by the pickled record.
+RECORD_HEADER = struct.Struct('>I')
+
+
+class SegmentedDisk:
+    """
+    Appends records to a series of segment files in a directory, starting a new segment
+    once the current one reaches segment_bytes. Syncing calls fsync on the current segment,
+    and records are read back through memory maps. Records past the last sync may be on disk
+    too, but are only read back after a later sync covers them.
+    """
+
+    def __init__(self, directory, segment_bytes=1 << 20):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(name for name in os.listdir(directory)
+                               if name.endswith('.segment'))
+        if not self.segments:
+            self.segments.append("{:08d}.segment".format(0))
+        self.file = open(os.path.join(directory, self.segments[-1]), 'ab')
+        # The segment, and the offset in it, up to which records are durable
+        self.synced_segments = len(self.segments)
+        self.synced_offset = self.file.tell()
+
+    def next_segment_name(self):
+        "Names segments so that they sort in the order they were written"
+        return "{:08d}.segment".format(int(self.segments[-1].split('.')[0]) + 1)
+
+    def write(self, record):
+        "Adds a record after every record written so far"
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        if self.file.tell() and self.file.tell() + RECORD_HEADER.size + len(data) > \
+                self.segment_bytes:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            self.segments.append(self.next_segment_name())
+            self.file = open(os.path.join(self.directory, self.segments[-1]), 'ab')
+        self.file.write(RECORD_HEADER.pack(len(data)))
+        self.file.write(data)
+
+    def mark(self):
+        "Returns the position after the last record written"
+        return (len(self.segments), self.file.tell())
+
+    def sync(self, mark):
+        "Makes every record before mark durable"
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        # Segments before the current one were synced when they were closed.
+        self.synced_segments, self.synced_offset = mark
+
+    def drop_unsynced(self):
+        "Loses every record written since the last sync, as a crash would"
+        self.file.close()
+        for name in self.segments[self.synced_segments:]:
+            os.remove(os.path.join(self.directory, name))
+        del self.segments[self.synced_segments:]
+        path = os.path.join(self.directory, self.segments[-1])
+        os.truncate(path, self.synced_offset)
+        self.file = open(path, 'ab')
+
+    def records(self):
+        "Returns the synced records, in the order they were written"
+        records = []
+        for number, name in enumerate(self.segments[:self.synced_segments]):
+            end = self.synced_offset if number == self.synced_segments - 1 else None
+            with open(os.path.join(self.directory, name), 'rb') as segment:
+                if os.fstat(segment.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    end = len(data) if end is None else end
+                    offset = 0
+                    while offset < end:
+                        (length,) = RECORD_HEADER.unpack_from(data, offset)
+                        offset += RECORD_HEADER.size
+                        records.append(pickle.loads(data[offset:offset + length]))
+                        offset += length
+        return records
+
+    def rewrite(self, records):
+        """
+        Replaces the synced records with ones describing the same state. They are written
+        and synced to a new segment, followed by any unsynced records, before the old
+        segments are removed. Replaying old segments before the new one gives the same state.
+        """
+        self.file.flush()
+        unsynced = []
+        for number, name in enumerate(self.segments[self.synced_segments - 1:]):
+            with open(os.path.join(self.directory, name), 'rb') as segment:
+                if number == 0:
+                    segment.seek(self.synced_offset)
+                unsynced.append(segment.read())
+        self.file.close()
+        old_segments = self.segments
+        self.segments = [self.next_segment_name()]
+        self.file = open(os.path.join(self.directory, self.segments[0]), 'ab')
+        for record in records:
+            data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            self.file.write(RECORD_HEADER.pack(len(data)))
+            self.file.write(data)
+        self.sync(self.mark())
+        for name in old_segments:
+            os.remove(os.path.join(self.directory, name))
+        self.file.write(b''.join(unsynced))
+
+    def close(self):
+        "Closes the current segment"
+        self.file.close()
+
+
+def make_disk(kind, node_id, directory=None):
+    "Builds a node's disk from its command line name: memory or segments"
+    if kind == 'memory':
+        return SimulatedDisk()
+    elif kind == 'segments':
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix='raft-')
+        return SegmentedDisk(os.path.join(directory, 'node-{}'.format(node_id)))
+    raise ValueError("Unknown disk: {}".format(kind))
+
+
+class NodeStorage:
+    """
+    Group commit over a node's disk. At most one sync is in progress at a time. Writes made
+    while it runs, and the messages that must wait for them, go in the next sync, which
+    starts as soon as the current one completes.
+
+    Tracks how much of the node's log is durable, so a leader only counts entries it has
+    synced towards a majority.
+    """
+
+    def __init__(self, disk):
+        self.disk = disk
+        self.sync_id = 0  # identifies the sync in progress, or the last one
+        self.syncing = False
+        self.unsynced = False  # whether anything was written that no sync covers yet
+        self.syncing_mark = None  # the disk position the current sync makes durable
+        self.syncing_sends = []  # (message, destinations) sent once the current sync ends
+        self.unsynced_sends = []  # (message, destinations) sent once the next sync ends
+        # Log lengths: the last one synced, and the shortest and last of each later batch
+        self.synced_length = 0
+        self.syncing_floor = self.syncing_length = None
+        self.unsynced_floor = self.unsynced_length = None
+        # Records written and synced, and the number left by the last rewrite, counted by
+        # record_size
+        self.syncing_records = self.unsynced_records = 0
+        self.synced_records = self.compacted_records = 0
+        # Counters for benchmarking
+        self.writes = 0
+        self.syncs = 0
+
+    def write(self, record, log_length):
+        "Writes a record, after which the node's log has log_length entries"
+        self.disk.write(record)
+        self.writes += 1
+        self.unsynced_records += record_size(record)
+        self.unsynced = True
+        if self.unsynced_floor is None or log_length < self.unsynced_floor:
+            self.unsynced_floor = log_length
+        self.unsynced_length = log_length
+
+    def write_synced(self, record, log_length):
+        "Writes a record and syncs it straight away. Only valid while no sync is pending."
+        self.disk.write(record)
+        self.disk.sync(self.disk.mark())
+        self.writes += 1
+        self.syncs += 1
+        self.synced_length = log_length
+        self.synced_records += record_size(record)
+        self.maybe_compact()
+
+    def durable_length(self):
+        "Returns how many entries at the start of the log are known to be synced"
+        return min(length for length in (self.synced_length, self.syncing_floor,
+                                         self.unsynced_floor) if length is not None)
+
+    def pending(self):
+        "Checks whether any write isn't durable yet"
+        return self.unsynced or self.syncing
+
+    def send_after_sync(self, message, destinations):
+        "Holds a message until every write made so far is durable"
+        if self.unsynced:
+            self.unsynced_sends.append((message, destinations))
+        else:
+            self.syncing_sends.append((message, destinations))
+
+    def start_sync(self):
+        "Starts syncing every unsynced write, returning the id of the new sync"
+        self.sync_id += 1
+        self.syncs += 1
+        self.syncing = True
+        self.unsynced = False
+        self.syncing_mark = self.disk.mark()
+        self.syncing_sends, self.unsynced_sends = self.unsynced_sends, []
+        self.syncing_floor, self.syncing_length = self.unsynced_floor, self.unsynced_length
+        self.unsynced_floor = self.unsynced_length = None
+        self.syncing_records, self.unsynced_records = self.unsynced_records, 0
+        return self.sync_id
+
+    def complete_sync(self, sync_id):
+        """
+        Finishes the given sync, if it's still in progress. Returns the messages that were
+        waiting for it.
+        """
+        if not self.syncing or sync_id != self.sync_id:
+            return []
+        self.disk.sync(self.syncing_mark)
+        self.syncing = False
+        if self.syncing_length is not None:
+            self.synced_length = self.syncing_length
+        self.syncing_floor = self.syncing_length = None
+        self.synced_records += self.syncing_records
+        self.syncing_records = 0
+        self.maybe_compact()
+        sends, self.syncing_sends = self.syncing_sends, []
+        return sends
+
+    def maybe_compact(self):
+        """
+        Rewrites the synced records once there are twice as many as the last rewrite left,
+        so rewrites take amortized constant time per record
+        """
+        if self.synced_records > 2 * self.compacted_records + 64:
+            records = compact_records(self.disk.records())
+            self.disk.rewrite(records)
+            self.synced_records = self.compacted_records = sum(
+                record_size(record) for record in records)
+
+    def crash(self):
+        "Loses every write that wasn't synced, and every message waiting on one"
+        self.disk.drop_unsynced()
+        self.syncing = self.unsynced = False
+        self.syncing_sends = []
+        self.unsynced_sends = []
+        self.syncing_floor = self.syncing_length = None
+        self.unsynced_floor = self.unsynced_length = None
+        self.syncing_records = self.unsynced_records = 0
+
+    def records(self):
+        "Returns the durable records"
+        return self.disk.records()
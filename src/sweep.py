@@ -0,0 +1,254 @@
+"""
+Runs independent seeded simulations across a process pool, for every combination of
+run settings, streaming results back as each run finishes.
+"""
+
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from random import Random
+from world_broker import WorldBroker
+from fuzz import draw_step
+from log_sinks import NullSink, RingBufferSink
+from tracing import Tracer, OFF
+
+
+def run_seed(settings, seed, steps):
+    """
+    Runs one simulation, drawing every step from a PRNG seeded with seed.
+    Returns a result map, which includes the steps run so far if an invariant failed.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), **settings)
+    start = time.perf_counter()
+    trace = []
+    failure = run_steps(broker, Random(seed), steps, trace, teardown=True)
+    return run_result(settings, seed, None, broker, failure, trace, start)
+
+
+# pylint: disable=too-many-arguments
+def run_branches(settings, seed, prefix_steps, branches, steps):
+    """
+    Runs prefix_steps steps drawn from a PRNG seeded with seed, then checkpoints the world,
+    and runs each branch on a fork of it for the rest of the steps, drawn from a PRNG seeded
+    with the seed and the branch. Returns a result map for each branch, or for the prefix
+    alone if it failed. A failing result's trace includes the prefix.
+    """
+    broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), **settings)
+    start = time.perf_counter()
+    prefix = []
+    failure = run_steps(broker, Random(seed), prefix_steps, prefix, teardown=False)
+    if failure:
+        return [run_result(settings, seed, None, broker, failure, prefix, start)]
+    checkpoint = broker.checkpoint()
+    results = []
+    for branch in range(branches):
+        start = time.perf_counter()
+        fork = checkpoint.fork(NullSink())
+        trace = list(prefix)
+        failure = run_steps(fork, Random("{}/{}".format(seed, branch)), steps - prefix_steps,
+                            trace, teardown=True)
+        results.append(run_result(settings, seed, branch, fork, failure, trace, start))
+    return results
+
+
+def run_steps(broker, rng, steps, trace, teardown):
+    """
+    Runs steps drawn from rng, appending each to trace, then the end of run checks if
+    teardown is set. Returns the failure message, or None if none.
+    """
+    try:
+        for _ in range(steps):
+            step = draw_step(broker, rng)
+            trace.append(step)
+            broker.execute_step(step)
+        if teardown:
+            broker.teardown()
+    except AssertionError as error:
+        return str(error) or 'AssertionError'
+    return None
+
+
+# pylint: disable=too-many-arguments
+def run_result(settings, seed, branch, broker, failure, trace, start):
+    "Returns the result map of a run"
+    return {'settings': settings,
+            'seed': seed,
+            'branch': branch,
+            'failure': failure,
+            'trace': trace if failure else None,
+            'simulated_ms': broker.current_time,
+            'leader_changes': broker.leader_changes,
+            'leaderless_ms': broker.leaderless_time(),
+            'elapsed': time.perf_counter() - start}
+
+
+def replay(settings, trace, log=None, tracer=None):
+    """
+    Runs the given steps on a new broker, logging to log if given.
+    Returns the failure message, or None if none.
+    """
+    if log is None:
+        broker = WorldBroker(log=NullSink(), tracer=Tracer(OFF), **settings)
+    else:
+        broker = WorldBroker(log=log, tracer=tracer, **settings)
+    try:
+        for step in trace:
+            broker.execute_step(step)
+        broker.teardown()
+    except AssertionError as error:
+        return str(error) or 'AssertionError'
+    return None
+
+
+def trace_size(trace):
+    "Orders traces by the number of faults they inject, then by their length"
+    return (sum(len(step['adverse_events']) for step in trace), len(trace))
+
+
+def shrink(settings, trace):
+    """
+    Greedily drops adverse events and message delays from a failing trace, keeping each
+    removal that still fails. Steps themselves are kept, since later events start at
+    absolute times.
+    """
+    trace = [dict(step) for step in trace]
+    for step in trace:
+        if step['delays']:
+            candidate = dict(step, delays=[])
+            if replay(settings, _with(trace, step, candidate)):
+                step.update(candidate)
+        index = 0
+        while index < len(step['adverse_events']):
+            events = step['adverse_events']
+            candidate = dict(step, adverse_events=events[:index] + events[index + 1:])
+            if replay(settings, _with(trace, step, candidate)):
+                step.update(candidate)
+            else:
+                index += 1
+    return trace
+
+
+def _with(trace, old_step, new_step):
+    "Returns a copy of trace with old_step replaced by new_step"
+    return [new_step if step is old_step else step for step in trace]
+
+
+def format_trace(trace):
+    "Returns a printable version of a trace"
+    lines = []
+    for index, step in enumerate(trace):
+        lines.append("Step {}: delays={}".format(index, step['delays']))
+        for event in step['adverse_events']:
+            lines.append("    {}".format(event.event_map))
+    return "\n".join(lines)
+
+
+# pylint: disable=too-many-arguments
+def settings_combinations(catastrophy_levels, ms_per_steps, max_ms_per_events,
+                          cluster_sizes=(5,), pre_votes=(False,), check_quorums=(False,)):
+    "Returns the WorldBroker settings for every combination of the given values"
+    return [{'catastrophy_level': catastrophy,
+             'ms_per_step': ms_per_step,
+             'max_ms_per_event': max_ms_per_event,
+             'cluster_size': cluster_size,
+             'pre_vote': pre_vote,
+             'check_quorum': check_quorum}
+            for catastrophy, ms_per_step, max_ms_per_event, cluster_size, pre_vote, check_quorum
+            in itertools.product(catastrophy_levels, ms_per_steps, max_ms_per_events,
+                                 cluster_sizes, pre_votes, check_quorums)]
+
+
+# pylint: disable=too-many-locals
+# pylint: disable=too-many-arguments
+def run_sweep(combinations, seeds, steps, jobs, stop_on_failure=True, log_size=50,
+              tracer=None, output=print, branches=1, prefix_steps=0):
+    """
+    Runs every seed for every settings combination on a pool of jobs processes. With more
+    than one branch, each seed runs prefix_steps steps once, and then that many branches
+    forked from there.
+    Prints each result as it arrives and a summary table at the end, followed by the
+    smallest failing trace and the last log_size events it logged.
+    Returns the list of failing results.
+    """
+    tasks = ((settings, seed) for settings in combinations for seed in range(seeds))
+    stats = {settings_key(settings): {'runs': 0, 'failures': 0, 'simulated_ms': 0,
+                                      'leader_changes': 0, 'leaderless_ms': 0}
+             for settings in combinations}
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = set()
+        stopping = False
+        while True:
+            # Keep a bounded number of runs in flight, so huge sweeps don't queue up front.
+            while not stopping and len(pending) < 2 * jobs:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                if branches > 1:
+                    pending.add(executor.submit(run_branches, task[0], task[1], prefix_steps,
+                                                branches, steps))
+                else:
+                    pending.add(executor.submit(run_seed, task[0], task[1], steps))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.cancelled():
+                    continue
+                results = future.result()
+                for result in results if isinstance(results, list) else [results]:
+                    key = settings_key(result['settings'])
+                    stats[key]['runs'] += 1
+                    stats[key]['simulated_ms'] += result['simulated_ms']
+                    stats[key]['leader_changes'] += result['leader_changes']
+                    stats[key]['leaderless_ms'] += result['leaderless_ms']
+                    output("{} seed={}{} {} ({:.2f}s)".format(
+                        key, result['seed'],
+                        '' if result['branch'] is None else ' branch={}'.format(result['branch']),
+                        result['failure'] or 'ok', result['elapsed']))
+                    if result['failure']:
+                        stats[key]['failures'] += 1
+                        failures.append(result)
+                        if stop_on_failure and not stopping:
+                            stopping = True
+                            for other in pending:
+                                other.cancel()
+    elapsed = time.perf_counter() - start
+
+    output("")
+    output("{:>12} {:>12} {:>16} {:>12} {:>8} {:>12} {:>8} {:>10} {:>14} {:>14} {:>18}".format(
+        'catastrophy', 'ms_per_step', 'max_ms_per_event', 'cluster_size', 'pre_vote',
+        'check_quorum', 'runs', 'failures', 'sim-ms/run', 'elections/run', 'leaderless-ms/run'))
+    for key, stat in stats.items():
+        runs = max(1, stat['runs'])
+        output("{:>12} {:>12} {:>16} {:>12} {:>8} {:>12} {:>8} {:>10} {:>14.0f} {:>14.1f} "
+               "{:>18.0f}".format(key[0], key[1], key[2], key[3], key[4], key[5], stat['runs'],
+                                  stat['failures'], stat['simulated_ms'] / runs,
+                                  stat['leader_changes'] / runs,
+                                  stat['leaderless_ms'] / runs))
+    total_runs = sum(stat['runs'] for stat in stats.values())
+    output("{} runs in {:.2f}s: {:.1f} runs/sec, {} failures".format(
+        total_runs, elapsed, total_runs / elapsed, len(failures)))
+
+    if failures:
+        smallest = min(failures, key=lambda result: trace_size(result['trace']))
+        trace = shrink(smallest['settings'], smallest['trace'])
+        log = RingBufferSink(log_size)
+        failure = replay(smallest['settings'], trace, log, tracer)
+        output("")
+        output("Minimal failing trace for {} seed={}: {}".format(
+            settings_key(smallest['settings']), smallest['seed'], failure))
+        output(format_trace(trace))
+        output("")
+        output("Last {} events:".format(log_size))
+        for event in log:
+            output(event)
+    return failures
+
+
+def settings_key(settings):
+    "Returns a hashable, printable summary of a settings map"
+    return (settings['catastrophy_level'], settings['ms_per_step'], settings['max_ms_per_event'],
+            settings['cluster_size'], settings.get('pre_vote', False),
+            settings.get('check_quorum', False))
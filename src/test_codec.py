@@ -0,0 +1,134 @@
+"""
+Checks every message type decodes to what was encoded, across the edge cases of each field
+kind, that decoded entries slice like lists, and that malformed bytes raise DecodeError.
+"""
+
+import unittest
+from codec import encode, decode, DecodeError, HEADER, VERSION, MESSAGE_TYPES, CONFIGURATION
+from membership import Configuration
+from message import AppendEntries, AppendEntriesResponse, RequestVote, RequestVoteResponse
+from message import PreVote, PreVoteResponse, TimeoutNow, InstallSnapshot
+from message import InstallSnapshotResponse, Message
+from multiraft import GroupMessage, CoalescedHeartbeats
+
+LARGE = 2 ** 70 + 3
+JOINT = Configuration({0, 1, 5}, learners={6}, old_voters={0, 1, 2})
+COMMANDS = [None, 0, 127, 128, -1, -128, LARGE, -LARGE, True, False, b'', b'\x00\xff',
+            '', 'café', (), (1, 2), (3, (None, 'x', -4)), JOINT, Configuration({0})]
+ENTRIES = list(zip([1, 1, 2, 300, LARGE] * 4, COMMANDS))
+HEARTBEAT = AppendEntries(4, 1, 10, 3, [], 9, 17)
+
+EXAMPLES = [
+    AppendEntries(1, 0, 0, 0, [], 0),
+    AppendEntries(5, 2, 7, None, ENTRIES, 6, 12),
+    AppendEntries(LARGE, 127, 128, LARGE, [(2, (7, 8, 9))], LARGE, LARGE),
+    AppendEntriesResponse(3, True, 40, read_round=8),
+    AppendEntriesResponse(3, False, 40, 2, 31, 0),
+    RequestVote(9, 4, 1000, 8),
+    RequestVote(9, 4, 0, 0, True),
+    RequestVoteResponse(9, True),
+    RequestVoteResponse(0, False),
+    PreVote(10, 3, 55, 9),
+    PreVoteResponse(10, False),
+    TimeoutNow(LARGE),
+    InstallSnapshot(6, 1, 500, 5, 0, b'snapshot', False, Configuration({0, 1, 2})),
+    InstallSnapshot(6, 1, 500, 5, 1 << 20, b'', True, JOINT),
+    InstallSnapshotResponse(6, 500, 1024, False),
+    InstallSnapshotResponse(6, 500, 0, True),
+    GroupMessage(0, RequestVote(2, 1, 3, 1)),
+    GroupMessage(LARGE, AppendEntries(5, 2, 7, None, ENTRIES[:5], 6)),
+    GroupMessage(3, GroupMessage(4, TimeoutNow(1))),
+    CoalescedHeartbeats([]),
+    CoalescedHeartbeats([(0, HEARTBEAT), (19, AppendEntriesResponse(4, True, 10, 0, 0, 17)),
+                         (LARGE, GroupMessage(2, HEARTBEAT))]),
+    GroupMessage(1, CoalescedHeartbeats([(5, HEARTBEAT)])),
+]
+
+
+def plain(value):
+    "Returns a value with messages, entries and configurations turned into comparable ones"
+    if isinstance(value, Message):
+        return (value.__class__.__name__,) + tuple(plain(getattr(value, name))
+                                                   for name in value.__slots__)
+    if isinstance(value, Configuration):
+        return ('Configuration', value.voters, value.learners, value.old_voters)
+    if isinstance(value, (list, tuple)) or value.__class__.__name__ == 'Entries':
+        return [plain(item) for item in value]
+    return value
+
+
+class CodecTest(unittest.TestCase):
+    "Encodes and decodes the examples"
+
+    def test_examples_cover_every_type(self):
+        "Every message type has an example"
+        self.assertEqual({example.__class__ for example in EXAMPLES}, set(MESSAGE_TYPES))
+
+    def test_round_trip(self):
+        "Each example decodes to a message with the same fields, which encodes the same"
+        for example in EXAMPLES:
+            data = encode(example)
+            decoded = decode(data)
+            self.assertIs(decoded.__class__, example.__class__)
+            self.assertEqual(plain(decoded), plain(example))
+            self.assertEqual(encode(decoded), data)
+
+    def test_optional_uint(self):
+        "A prev_log_term of None stays distinct from 0"
+        for term in (None, 0, 1, LARGE):
+            decoded = decode(encode(AppendEntries(1, 0, 5, term, [], 0)))
+            self.assertEqual(decoded.prev_log_term, term)
+
+    def test_values(self):
+        "Commands keep their types, except lists, which decode as tuples"
+        decoded = decode(encode(AppendEntries(1, 0, 0, 0, ENTRIES, 0)))
+        for (_, command), (_, original) in zip(decoded.entries, ENTRIES):
+            self.assertIs(command.__class__, original.__class__)
+        command = decode(encode(AppendEntries(1, 0, 0, 0, [(1, [1, [2]])], 0))).entries[0][1]
+        self.assertEqual(command, (1, (2,)))
+        data = decode(encode(InstallSnapshot(1, 0, 2, 1, 0, bytearray(b'ab'), True, JOINT)))
+        self.assertEqual(data.data, b'ab')
+        self.assertTrue(data.configuration.is_joint())
+
+    def test_entry_slices(self):
+        "Decoded entries index and slice like the list they were encoded from"
+        entries = decode(encode(AppendEntries(1, 0, 0, 0, ENTRIES, 0))).entries
+        self.assertEqual(len(entries), len(ENTRIES))
+        for index in range(-len(ENTRIES), len(ENTRIES)):
+            self.assertEqual(plain(entries[index]), plain(ENTRIES[index]))
+        for piece in (slice(2, 7), slice(None, 3), slice(-4, None), slice(5, 5),
+                      slice(None, None, -1), slice(1, None, 3)):
+            self.assertEqual(plain(entries[piece]), plain(ENTRIES[piece]))
+            self.assertEqual(plain(entries[piece][1:]), plain(ENTRIES[piece][1:]))
+        # A slice encodes like the list it stands for.
+        self.assertEqual(encode(AppendEntries(1, 0, 2, 1, entries[2:9], 0)),
+                         encode(AppendEntries(1, 0, 2, 1, ENTRIES[2:9], 0)))
+
+    def test_decode_errors(self):
+        "Bytes this codec didn't encode are rejected, rather than misread"
+        data = encode(RequestVote(9, 4, 1000, 8))
+        with self.assertRaisesRegex(DecodeError, 'version'):
+            decode(HEADER.pack(VERSION + 1, 2) + data[HEADER.size:])
+        with self.assertRaisesRegex(DecodeError, 'type'):
+            decode(HEADER.pack(VERSION, len(MESSAGE_TYPES)) + data[HEADER.size:])
+        with self.assertRaisesRegex(DecodeError, 'left over'):
+            decode(data + b'\x00')
+        nested = encode(GroupMessage(1, TimeoutNow(3)))
+        with self.assertRaisesRegex(DecodeError, 'version'):
+            decode(nested[:3] + HEADER.pack(VERSION + 1, 6) + nested[5:])
+        snapshot = encode(InstallSnapshot(1, 0, 2, 1, 0, b'', True, Configuration({0})))
+        tag = snapshot.index(bytes([CONFIGURATION]), HEADER.size + 6)
+        with self.assertRaisesRegex(DecodeError, 'tag'):
+            decode(snapshot[:tag] + b'\xff' + snapshot[tag + 1:])
+        self.assertTrue(issubclass(DecodeError, ValueError))
+
+    def test_encode_errors(self):
+        "Negative integers don't fit an unsigned field, and unknown values aren't encoded"
+        with self.assertRaises(ValueError):
+            encode(TimeoutNow(-1))
+        with self.assertRaises(TypeError):
+            encode(AppendEntries(1, 0, 0, 0, [(1, {'a': 1})], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+"""
+Checks a leader cut off from its followers only serves reads on its lease while the clocks
+keep within max_clock_drift of each other, which nodes don't notice them leave, and that the
+simulator keeps ClockSkew jumps within it.
+"""
+
+import unittest
+from events import ClockSkew, ReceiveDrop, TransmitDrop
+from world_broker import WorldBroker
+
+
+class LeaseTest(unittest.TestCase):
+    "Runs a three node cluster with leader leases, a ms at a time"
+
+    def setUp(self):
+        self.replies = {}  # request_id -> counter value
+
+    def make_broker(self, max_clock_drift, bound_skews=True):
+        """
+        Returns a broker with an elected leader. Unless bound_skews is set, ClockSkew moves
+        clocks as far as it's told, as clocks the nodes wrongly trust would.
+        """
+        broker = WorldBroker(cluster_size=3, ms_per_step=1, leader_leases=True,
+                             read_mode='lease', max_clock_drift=max_clock_drift)
+        if not bound_skews:
+            broker.time_broker['max_clock_spread'] = None
+
+        def respond(client_id, request_id, result):
+            "Notes the reply, to the writer's client 1 or the reader's client 0"
+            self.assertEqual(client_id, int(request_id == 1))
+            self.replies[request_id] = result
+        broker.respond = respond
+        nodes = broker.power_broker['nodes']
+        while not any(node.is_leader() for node in nodes.values()):
+            self.step(broker)
+        for _ in range(300):
+            self.step(broker)
+        return broker
+
+    @staticmethod
+    def step(broker):
+        "Runs the world for a step, with no adverse events"
+        broker.execute_step({'delays': [], 'adverse_events': []})
+
+    def cut_off_leader(self, broker, leader_skew, follower_skew):
+        """
+        Cuts the leader off from the followers, and jumps the clocks by the skews. A
+        follower starts an election as soon as its lease runs out. Once the new leader has
+        applied an increment, has the old one read on its lease every ms. Returns the old
+        leader, and what the reads returned.
+        """
+        nodes = broker.power_broker['nodes']
+        old = next(node for node in nodes.values() if node.is_leader())
+        now = broker.current_time
+        broker.dispatch_event(ReceiveDrop(start_time=now, affected_nodes={old.node_id},
+                                          event_length=1))
+        for node_id in nodes:
+            broker.dispatch_event(TransmitDrop(start_time=now, event_length=1,
+                                               affected_node_pair=(old.node_id, node_id)))
+            skew = leader_skew if node_id == old.node_id else follower_skew
+            broker.dispatch_event(ClockSkew(start_time=now, affected_node=node_id,
+                                            skew_amount=skew, event_length=1))
+        followers = [node for node in nodes.values() if node is not old]
+        new = None
+        request_id = 0
+        while broker.current_time < now + 600:
+            self.step(broker)
+            if new is None:
+                expired = [node for node in followers if node.local_time() >= node.lease_until]
+                if expired and not any(node.is_candidate() for node in followers):
+                    expired[0].timer_trip()
+                new = next((node for node in followers if node.is_leader()), None)
+                if new is not None:
+                    request_id = 1
+                    new.submit(1, request_id)
+            elif new.state_machine.value == 1:
+                request_id += 1
+                old.submit(0, request_id, 'lease')
+        self.assertEqual(self.replies[1], 1)
+        self.assertGreater(request_id, 10)
+        return old, [self.replies[read] for read in range(2, request_id + 1)
+                     if read in self.replies]
+
+    def test_skew_beyond_drift_reads_stale(self):
+        "A leader whose clock fell behind further than allowed reads on an expired lease"
+        broker = self.make_broker(50, bound_skews=False)
+        _, reads = self.cut_off_leader(broker, -100, 100)
+        self.assertIn(0, reads)
+
+    def test_skew_within_drift(self):
+        "Within the drift, the lease runs out first, and reads wait for a ReadIndex round"
+        broker = self.make_broker(50, bound_skews=False)
+        old, reads = self.cut_off_leader(broker, -25, 25)
+        self.assertEqual(reads, [])
+        self.assertTrue(old.is_leader())
+        self.assertTrue(old.pending_reads)
+        self.assertTrue(all(read[0] > old.confirmed_round for read in old.pending_reads))
+
+    def test_skews_kept_within_drift(self):
+        "The simulator cuts jumps short of taking a clock max_clock_drift / 2 from another"
+        broker = self.make_broker(50)
+        offsets = broker.time_broker['node_time_offsets']
+        old, reads = self.cut_off_leader(broker, -100, 100)
+        self.assertEqual(reads, [])
+        self.assertEqual([offsets[node_id] - offsets[old.node_id] for node_id in offsets
+                          if node_id != old.node_id], [25, 25])
+
+
+if __name__ == '__main__':
+    unittest.main()
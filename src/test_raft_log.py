@@ -0,0 +1,167 @@
+"""
+Checks RaftLog against a plain list of terms, over random appends, truncations and
+compactions, and that a leader finds where a follower's diverged log matches its own in a
+round trip per term.
+"""
+
+import unittest
+from random import Random
+from message import AppendEntriesResponse
+from raft_log import RaftLog
+from world_broker import WorldBroker
+
+
+class RaftLogTest(unittest.TestCase):
+    "Compares a RaftLog with a list holding the term of every entry, compacted or not"
+
+    def check(self, log, terms, snapshot_index):
+        "Checks every query on log matches the list"
+        self.assertEqual(log.snapshot_index, snapshot_index)
+        self.assertEqual(log.last_index(), len(terms))
+        self.assertEqual(log.last_term(), terms[-1] if terms else 0)
+        for index in range(snapshot_index, len(terms) + 1):
+            self.assertEqual(log.term_at(index), terms[index - 1] if index else 0)
+        held = range(snapshot_index + 1, len(terms) + 1)
+        for term in set(terms) | {0, max(terms, default=0) + 1}:
+            indexes = [index for index in held if terms[index - 1] == term]
+            self.assertEqual(log.first_index_of_term(term), indexes[0] if indexes else None)
+            self.assertEqual(log.last_index_of_term(term), indexes[-1] if indexes else None)
+
+    def test_matches_list(self):
+        "Runs random operations on both, checking they agree after each"
+        for seed in range(200):
+            rng = Random(seed)
+            log = RaftLog()
+            terms = []
+            snapshot_index = 0
+            for _ in range(60):
+                action = rng.random()
+                if action < 0.6:
+                    term = (terms[-1] if terms else 0) + (rng.random() < 0.3)
+                    log.append(term, (term, len(terms)))
+                    terms.append(term)
+                elif action < 0.8 and len(terms) > snapshot_index:
+                    index = rng.randint(snapshot_index + 1, len(terms))
+                    log.truncate(index)
+                    del terms[index - 1:]
+                elif terms:
+                    index = rng.randint(0, len(terms))
+                    log.compact(index)
+                    snapshot_index = max(snapshot_index, index)
+                self.check(log, terms, snapshot_index)
+
+    @staticmethod
+    def make_log(terms):
+        "Returns a RaftLog with an entry for each of terms"
+        log = RaftLog()
+        for index, term in enumerate(terms, 1):
+            log.append(term, (term, index))
+        return log
+
+    def test_compact_at_run_boundaries(self):
+        """
+        Compacts up to the first and last entry of each term's run, and checks entries
+        appended afterwards start a new run or extend the last one
+        """
+        terms = [1, 1, 1, 2, 2, 3, 3, 3]
+        for index in range(len(terms) + 1):
+            log = self.make_log(terms)
+            log.compact(index)
+            self.check(log, terms, index)
+            self.assertEqual(log.entries(index + 1, len(terms) + 1),
+                             [(term, (term, held)) for held, term in
+                              enumerate(terms[index:], index + 1)])
+            log.append(3, None)
+            log.append(4, None)
+            self.check(log, terms + [3, 4], index)
+            # Compacting again, to no further than before, changes nothing.
+            log.compact(index)
+            self.check(log, terms + [3, 4], index)
+
+    def test_install_snapshot_at_run_boundaries(self):
+        """
+        Installs snapshots ending at the first and last entry of each term's run. The entries
+        after the snapshot are kept only if its last entry matches the log's.
+        """
+        terms = [1, 1, 1, 2, 2, 3, 3, 3]
+        for index in range(1, len(terms) + 1):
+            log = self.make_log(terms)
+            log.install_snapshot(index, terms[index - 1])
+            self.check(log, terms, index)
+
+            log = self.make_log(terms)
+            log.install_snapshot(index, terms[index - 1] + 1)
+            self.check(log, terms[:index - 1] + [terms[index - 1] + 1], index)
+            log.append(terms[index - 1] + 1, None)
+            self.check(log, terms[:index - 1] + [terms[index - 1] + 1] * 2, index)
+
+        # A snapshot past the end of the log replaces all of it.
+        log = self.make_log(terms)
+        log.install_snapshot(10, 4)
+        self.check(log, terms + [4, 4], 10)
+        log.append(5, None)
+        self.check(log, terms + [4, 4, 5], 10)
+
+    def test_entries(self):
+        "Checks entries returns (term, command) tuples, cut short at the end of the log"
+        log = RaftLog()
+        for index, term in enumerate([1, 1, 2, 3, 3], 1):
+            log.append(term, index)
+        self.assertEqual(log.entries(2, 5), [(1, 2), (2, 3), (3, 4)])
+        self.assertEqual(log.entries(4, 10), [(3, 4), (3, 5)])
+        self.assertEqual(log.entries(6, 10), [])
+
+
+class CatchUpTest(unittest.TestCase):
+    "Checks the conflict hints followers send let a leader skip a term per round trip"
+
+    def catch_up(self, leader_terms, follower_terms):
+        """
+        Starts a three node cluster in which two nodes have logs of leader_terms and the
+        third one of follower_terms, and runs it until one of the two is elected and the
+        third matches its log. Returns how many times the third rejected AppendEntries.
+        """
+        broker = WorldBroker(cluster_size=3)
+        nodes = broker.power_broker['nodes']
+        for node_id, node in nodes.items():
+            terms = follower_terms if node_id == 2 else leader_terms
+            for index, term in enumerate(terms):
+                node.log.append(term, '{}:{}'.format(term, index))
+            node.term = max(leader_terms + follower_terms)
+        rejections = []
+
+        def counting(receive):
+            "Wraps a node's receive, noting each rejection from the follower"
+            def receive_counting(sender, message):
+                if sender == 2 and isinstance(message, AppendEntriesResponse) and \
+                        not message.success:
+                    rejections.append(message.index)
+                receive(sender, message)
+            return receive_counting
+        for node_id in (0, 1):
+            nodes[node_id].receive = counting(nodes[node_id].receive)
+
+        for _ in range(10):
+            broker.execute_step({'delays': [], 'adverse_events': []})
+        leader = next(node for node in nodes.values() if node.is_leader())
+        self.assertNotEqual(leader.node_id, 2)
+        self.assertEqual(nodes[2].log.entries(1, leader.log.last_index() + 1),
+                         leader.log.entries(1, leader.log.last_index() + 1))
+        return len(rejections)
+
+    def test_diverged_tail(self):
+        "A follower with a long tail from one term the leader lacks is skipped past at once"
+        self.assertEqual(self.catch_up([1] * 50 + [3] * 50, [1] * 50 + [2] * 2000), 1)
+
+    def test_diverged_terms(self):
+        "Each term of a diverged tail costs at most a round trip, however many entries it holds"
+        self.assertLessEqual(self.catch_up([1] * 20 + [5] * 500,
+                                       [1] * 20 + [2] * 300 + [3] * 300 + [4] * 300), 3)
+
+    def test_short_log(self):
+        "A follower missing entries has the leader continue from the end of its log"
+        self.assertEqual(self.catch_up([1] * 20 + [2] * 500, [1] * 20), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""
+Checks a follower reassembles the chunks of an InstallSnapshot, whatever order they arrive
+in, ignores stale ones, and keeps the entries after a snapshot that its log matches.
+"""
+
+import unittest
+from random import Random
+from membership import Configuration
+from message import InstallSnapshot
+from state_machine import Counter
+from world_broker import WorldBroker
+
+CONFIGURATION = Configuration({0, 1, 2})
+
+
+def snapshot_of(value):
+    "Returns the snapshot of a Counter at value"
+    counter = Counter()
+    counter.value = value
+    return counter.snapshot()
+
+
+def chunks_of(data, size, term=2, index=10, last_term=1):
+    "Splits a snapshot into the InstallSnapshot messages a leader would send"
+    return [InstallSnapshot(term, 0, index, last_term, offset, data[offset:offset + size],
+                            offset + size >= len(data), CONFIGURATION)
+            for offset in range(0, len(data), size)]
+
+
+class InstallSnapshotTest(unittest.TestCase):
+    "Sends chunks to a follower of a three node cluster, from node 0 in term 2"
+
+    def setUp(self):
+        self.broker = WorldBroker(cluster_size=3)
+        self.node = self.broker.power_broker['nodes'][2]
+        self.node.term = 2
+        self.responses = []
+
+        def send_after_sync(origin, data, destinations):
+            "Notes the follower's responses"
+            self.assertEqual((origin, destinations), (2, (0,)))
+            self.responses.append(data)
+        self.broker.send_after_sync = send_after_sync
+
+    def deliver(self, messages):
+        "Has the follower receive each message, returning what it replied"
+        del self.responses[:]
+        for message in messages:
+            self.node.receive(0, message)
+        return [(response.last_included_index, response.received, response.installed)
+                for response in self.responses]
+
+    def fill_log(self, terms):
+        "Gives the follower a log with an entry in each of the terms"
+        for index, term in enumerate(terms, 1):
+            self.node.log.append(term, '{}:{}'.format(term, index))
+
+    def assert_installed(self, index, term, value):
+        "Checks the follower holds the snapshot and the state machine it describes"
+        self.assertEqual((self.node.log.snapshot_index, self.node.log.snapshot_term),
+                         (index, term))
+        self.assertEqual((self.node.commit_index, self.node.last_applied), (index, index))
+        self.assertEqual(self.node.state_machine.value, value)
+        self.assertIsNone(self.node.incoming_snapshot)
+        self.assertEqual(self.broker.file_broker[2].records()[-1][:3], ('snapshot', index, term))
+
+    def test_reassembles_chunks(self):
+        "Chunks sent in order are acknowledged one by one, and installed with the last"
+        data = snapshot_of(7)
+        chunks = chunks_of(data, 5)
+        self.assertGreater(len(chunks), 3)
+        replies = self.deliver(chunks)
+        self.assertEqual(replies, [(10, min(len(data), 5 * count), count == len(chunks))
+                                   for count in range(1, len(chunks) + 1)])
+        self.assert_installed(10, 1, 7)
+
+    def test_out_of_order_chunks(self):
+        """
+        Chunks in any order, sent more than once, are acknowledged up to the first gap, and
+        the snapshot is installed once, when the gap closes
+        """
+        data = snapshot_of(12345)
+        for seed in range(20):
+            self.setUp()
+            rng = Random(seed)
+            chunks = chunks_of(data, 3)
+            order = chunks + rng.sample(chunks, 4)
+            rng.shuffle(order)
+            replies = self.deliver(order)
+            arrived = set()
+            expected = []
+            for chunk in order:
+                arrived.add(chunk.offset)
+                received = 0
+                while received in arrived:
+                    received += 3
+                received = min(received, len(data))
+                if expected and expected[-1][2]:
+                    # Once installed, the snapshot is behind the commit index.
+                    expected.append((10, 0, True))
+                else:
+                    expected.append((10, received, received == len(data)))
+            self.assertEqual(replies, expected)
+            self.assert_installed(10, 1, 12345)
+
+    def test_stale_chunks(self):
+        "Chunks from an old term, or of a snapshot the follower has moved past, change nothing"
+        old_term = self.deliver(chunks_of(snapshot_of(3), 4, term=1))
+        self.assertEqual(old_term[0], (10, 0, False))
+        self.assertIsNone(self.node.incoming_snapshot)
+        self.assertEqual(self.node.log.snapshot_index, 0)
+
+        older = chunks_of(snapshot_of(3), 4, index=10)
+        newer = chunks_of(snapshot_of(9), 4, index=20)
+        # Part of an older snapshot arrives, with a gap, so some of it is held out of order.
+        self.assertEqual(self.deliver([older[0], older[2], older[3]])[-1], (10, 4, False))
+        # The leader has since taken a later snapshot, and the follower starts on that one.
+        self.assertEqual(self.deliver(newer)[-1], (20, len(snapshot_of(9)), True))
+        self.assert_installed(20, 1, 9)
+        self.assertEqual(self.deliver([older[1], older[4]]), [(10, 0, True)] * 2)
+        self.assert_installed(20, 1, 9)
+
+    def test_keeps_matching_suffix(self):
+        "Entries after a snapshot the log matches are kept, along with their configurations"
+        self.fill_log([1] * 15 + [2] * 15)
+        later = Configuration({0, 1, 2, 3})
+        self.node.configurations.append((25, later))
+        self.deliver(chunks_of(snapshot_of(10), 8, index=12, last_term=1))
+        self.assert_installed(12, 1, 10)
+        self.assertEqual(self.node.log.last_index(), 30)
+        self.assertEqual(self.node.log.entries(13, 31),
+                         [(term, '{}:{}'.format(term, index))
+                          for index, term in enumerate([1] * 15 + [2] * 15, 1)][12:])
+        self.assertEqual(self.node.configurations, [(12, CONFIGURATION), (25, later)])
+
+    def test_discards_conflicting_log(self):
+        "A log that doesn't hold the snapshot's last entry is replaced by the snapshot"
+        self.fill_log([1] * 15 + [2] * 15)
+        self.node.configurations.append((25, Configuration({0, 1, 2, 3})))
+        self.deliver(chunks_of(snapshot_of(10), 8, index=20, last_term=3))
+        self.assert_installed(20, 3, 10)
+        self.assertEqual(self.node.log.last_index(), 20)
+        self.assertEqual(len(self.node.log), 0)
+        self.assertEqual(self.node.configurations, [(20, CONFIGURATION)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,193 @@
+"""
+Checks NodeStorage's group commit tracks what is durable across overlapping syncs and crashes,
+and that disks replay to the state their synced records describe, across syncs, crashes,
+rewrites and segment rollovers.
+"""
+
+import shutil
+import tempfile
+import unittest
+from random import Random
+from storage import NodeStorage, SimulatedDisk, SegmentedDisk, compact_records, replay
+
+
+def state_of(records):
+    "Returns what replaying the records gives, as plain values"
+    state = replay(records)
+    log = state['log']
+    return (state['term'], state['voted_for'], state['snapshot'], log.snapshot_index,
+            log.snapshot_term, log.entries(log.snapshot_index + 1, log.last_index() + 1))
+
+
+class NodeStorageTest(unittest.TestCase):
+    "Drives NodeStorage over a SimulatedDisk"
+
+    def test_durable_length_with_overlapping_syncs(self):
+        "Writes made while a sync runs, truncations among them, only count once synced"
+        storage = NodeStorage(SimulatedDisk())
+        storage.write(('append', 1, [(1, 'a'), (1, 'b')]), 2)
+        self.assertEqual(storage.durable_length(), 0)
+        first = storage.start_sync()
+        storage.write(('append', 3, [(1, 'c')]), 3)
+        storage.write(('truncate', 2), 1)
+        storage.write(('append', 2, [(2, 'd')]), 2)
+        self.assertEqual(storage.durable_length(), 0)
+        storage.complete_sync(first)
+        # The first sync covers both entries, but the second one was since truncated.
+        self.assertEqual(storage.durable_length(), 1)
+        second = storage.start_sync()
+        self.assertEqual(storage.durable_length(), 1)
+        self.assertEqual(storage.complete_sync(first), [])
+        self.assertEqual(storage.durable_length(), 1)
+        storage.complete_sync(second)
+        self.assertEqual(storage.durable_length(), 2)
+        self.assertFalse(storage.pending())
+        self.assertEqual(state_of(storage.records())[-1], [(1, 'a'), (2, 'd')])
+
+    def test_sends_wait_for_their_sync(self):
+        "A message is released by the first sync that covers every write made before it"
+        storage = NodeStorage(SimulatedDisk())
+        storage.write(('state', 1, None), 0)
+        storage.send_after_sync('first', [1])
+        first = storage.start_sync()
+        storage.write(('state', 2, None), 0)
+        storage.send_after_sync('second', [2])
+        self.assertEqual(storage.complete_sync(first), [('first', [1])])
+        second = storage.start_sync()
+        storage.send_after_sync('third', [3])
+        self.assertEqual(storage.complete_sync(second), [('second', [2]), ('third', [3])])
+
+    def test_crash(self):
+        "A crash loses the writes no sync finished, and the sends held for them, only"
+        storage = NodeStorage(SimulatedDisk())
+        storage.write(('state', 1, 0), 0)
+        storage.write(('append', 1, [(1, 'a')]), 1)
+        storage.send_after_sync('synced', [1])
+        self.assertEqual(storage.complete_sync(storage.start_sync()), [('synced', [1])])
+        storage.write(('append', 2, [(1, 'b')]), 2)
+        storage.send_after_sync('syncing', [1])
+        syncing = storage.start_sync()
+        storage.write(('state', 2, 1), 2)
+        storage.send_after_sync('unsynced', [2])
+        storage.crash()
+        self.assertFalse(storage.pending())
+        self.assertEqual(storage.syncing_sends + storage.unsynced_sends, [])
+        self.assertEqual(storage.durable_length(), 1)
+        self.assertEqual(storage.complete_sync(syncing), [])
+        self.assertEqual(state_of(storage.records()), (1, 0, None, 0, 0, [(1, 'a')]))
+        storage.write(('state', 3, None), 1)
+        storage.send_after_sync('restarted', [0])
+        self.assertEqual(storage.complete_sync(storage.start_sync()), [('restarted', [0])])
+        self.assertEqual(state_of(storage.records())[:2], (3, None))
+
+    def test_compacts_synced_records(self):
+        "Synced records are rewritten once they outgrow the last rewrite, to the same state"
+        disk = SimulatedDisk()
+        storage = NodeStorage(disk)
+        written = []
+        for index in range(1, 301):
+            record = ('append', index, [(index // 50, index)])
+            storage.write(record, index)
+            written.append(record)
+            if index % 7 == 0:
+                storage.complete_sync(storage.start_sync())
+        storage.complete_sync(storage.start_sync())
+        self.assertGreater(storage.compacted_records, 0)
+        self.assertLess(len(disk.synced), len(written))
+        self.assertEqual(state_of(storage.records()), state_of(written))
+
+
+class DiskTest(unittest.TestCase):
+    """
+    Runs random writes, syncs, crashes and rewrites on a disk, checking it holds the synced
+    records a model of it does, and that they replay to the state of every record synced
+    """
+
+    def draw_record(self, rng, records):
+        "Returns a record that can follow the records"
+        state = replay(records)
+        log = state['log']
+        term = max(state['term'], log.last_term()) + (rng.random() < 0.2)
+        choice = rng.random()
+        if choice < 0.15:
+            return ('state', term, rng.choice([None, 0, 1, 2]))
+        if choice < 0.25 and log.last_index() > log.snapshot_index:
+            return ('truncate', rng.randint(log.snapshot_index + 1, log.last_index()))
+        if choice < 0.3 and log.last_index() > log.snapshot_index:
+            index = rng.randint(log.snapshot_index + 1, log.last_index())
+            return ('snapshot', index, log.term_at(index), 'data {}'.format(index), (0, 1, 2))
+        index = rng.randint(log.snapshot_index + 1, log.last_index() + 1)
+        return ('append', index, [(term, 'x' * rng.randint(0, 40))
+                                  for _ in range(rng.randint(1, 4))])
+
+    # pylint: disable=too-many-branches
+    def exercise(self, make_disk, seed, reopen=None):
+        """
+        Runs random operations on the disk make_disk returns. With reopen, also reopens it
+        now and then, once every record written is synced.
+        """
+        rng = Random(seed)
+        disk = make_disk()
+        synced, unsynced = [], []
+        history = []  # every record synced, rewrites aside
+        mark = None  # a mark, and how many unsynced records it covers
+        for _ in range(150):
+            choice = rng.random()
+            if choice < 0.6:
+                record = self.draw_record(rng, history + unsynced)
+                disk.write(record)
+                unsynced.append(record)
+            elif choice < 0.7:
+                mark = (disk.mark(), len(unsynced))
+            elif choice < 0.8:
+                if mark is None:
+                    mark = (disk.mark(), len(unsynced))
+                disk.sync(mark[0])
+                synced += unsynced[:mark[1]]
+                history += unsynced[:mark[1]]
+                del unsynced[:mark[1]]
+                mark = None
+            elif choice < 0.87:
+                disk.drop_unsynced()
+                unsynced, mark = [], None
+            elif choice < 0.95:
+                # Rewrites only happen between syncs, while no mark is outstanding.
+                synced = compact_records(disk.records())
+                disk.rewrite(synced)
+                mark = None
+            elif reopen is not None and not unsynced:
+                disk = reopen(disk)
+                mark = None
+            self.assertEqual(disk.records(), synced)
+            self.assertEqual(state_of(synced), state_of(history))
+        disk.sync(disk.mark())
+        self.assertEqual(state_of(disk.records()), state_of(history + unsynced))
+        return disk
+
+    def test_simulated_disk(self):
+        "Checks the in-memory disk"
+        for seed in range(50):
+            self.exercise(SimulatedDisk, seed)
+
+    def test_segmented_disk(self):
+        "Checks segment files, with segments small enough to roll over every few records"
+        directory = tempfile.mkdtemp(prefix='raft-test-')
+        self.addCleanup(shutil.rmtree, directory)
+        most_segments = [0]
+
+        def reopen(disk):
+            "Closes the disk and opens its directory again"
+            most_segments[0] = max(most_segments[0], len(disk.segments))
+            disk.close()
+            return SegmentedDisk(disk.directory, segment_bytes=256)
+        for seed in range(50):
+            path = '{}/{}'.format(directory, seed)
+            disk = self.exercise(lambda path=path: SegmentedDisk(path, segment_bytes=256),
+                                 seed, reopen)
+            most_segments[0] = max(most_segments[0], len(disk.segments))
+            disk.close()
+        self.assertGreater(most_segments[0], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Deadline ordered node timers, used by the time broker.
+"""
+
+from heapq import heappush, heappop, heapify
+
+
+class NodeTimers:
+    """
+    Holds at most one pending timer per node in a heap ordered by the global time at which
+    it trips. Deadlines are kept in node local time, so a clock skew moves the trip time.
+
+    Re-arming or clearing a timer doesn't touch the heap; the superseded entry is dropped
+    lazily when it reaches the head, so the cost of firing scales with expiring timers.
+    """
+
+    def __init__(self, node_time_offsets):
+        self.node_time_offsets = node_time_offsets
+        self.deadlines = {}  # node_id -> (local deadline, sequence number of the live entry)
+        self.heap = []  # list[tuple(global trip time, sequence number, node_id)]
+        self.sequence = 0
+
+    def __getitem__(self, node_id):
+        "Returns the local time deadline of a node's timer, or None if it isn't set"
+        if node_id in self.deadlines:
+            return self.deadlines[node_id][0]
+        return None
+
+    def __contains__(self, node_id):
+        return node_id in self.deadlines
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def set(self, node_id, deadline):
+        "Arms a node's timer, replacing any pending one"
+        self.sequence += 1
+        self.deadlines[node_id] = (deadline, self.sequence)
+        # A timer trips on the first tick where the adjusted time passes the deadline.
+        trip_time = deadline - self.node_time_offsets[node_id] + 1
+        heappush(self.heap, (trip_time, self.sequence, node_id))
+        if len(self.heap) > 4 * len(self.deadlines) + 64:
+            self.compact()
+
+    def clear(self, node_id):
+        "Disarms a node's timer"
+        self.deadlines.pop(node_id, None)
+
+    def clear_all(self):
+        "Disarms every timer"
+        self.deadlines = {}
+        self.heap = []
+
+    def reschedule(self, node_id):
+        "Recomputes the trip time of a node's timer after its clock offset changed"
+        if node_id in self.deadlines:
+            self.set(node_id, self.deadlines[node_id][0])
+
+    def compact(self):
+        "Drops every superseded entry from the heap"
+        self.heap = [entry for entry in self.heap if self.is_live(entry)]
+        heapify(self.heap)
+
+    def is_live(self, entry):
+        "Checks that a heap entry hasn't been superseded or cleared"
+        _, sequence, node_id = entry
+        return node_id in self.deadlines and self.deadlines[node_id][1] == sequence
+
+    def next_trip_time(self):
+        "Returns the global time at which the next timer trips, or None if none are set"
+        while self.heap and not self.is_live(self.heap[0]):
+            heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def pop_expired(self, current_time):
+        """
+        Disarms and returns the ids of every node whose timer has tripped by current_time,
+        in node id order.
+        """
+        expired = []
+        while self.heap and self.heap[0][0] <= current_time:
+            entry = heappop(self.heap)
+            if self.is_live(entry):
+                del self.deadlines[entry[2]]
+                expired.append(entry[2])
+        return sorted(expired)
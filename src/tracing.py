@@ -0,0 +1,52 @@
+"""
+Leveled, per-category filtering of the debug event log.
+
+Call sites check a precomputed flag before building a log entry, so a disabled
+category costs one attribute lookup: no dict is allocated and the broker isn't called.
+
+    if self.tracer.term_debug:
+        self.test_log({...})
+"""
+
+OFF = 0
+INFO = 1  # State transitions that actually happen
+DEBUG = 2  # Every call, including ones that change nothing
+
+LEVELS = {'off': OFF, 'info': INFO, 'debug': DEBUG}
+
+STATE = 'state'  # Node type changes
+VOTE = 'vote'  # Votes cast
+TERM = 'term'  # Term updates
+TIMER = 'timer'  # Timer trips
+MESSAGE = 'message'  # Message delivery
+FAULT = 'fault'  # Adverse events injected by the simulator
+
+CATEGORIES = (STATE, VOTE, TERM, TIMER, MESSAGE, FAULT)
+
+
+# pylint: disable=too-few-public-methods
+class Tracer:
+    """
+    Holds one boolean attribute per category and level, named <category>_<level>,
+    e.g. state_info or term_debug.
+    """
+
+    def __init__(self, level=DEBUG, categories=CATEGORIES):
+        self.level = level
+        self.categories = frozenset(categories)
+        for category in CATEGORIES:
+            for level_name, level_value in LEVELS.items():
+                if level_value != OFF:
+                    setattr(self, category + '_' + level_name,
+                            category in self.categories and level >= level_value)
+
+
+def parse_tracer(level_name, categories):
+    "Builds a Tracer from a level name and a comma separated list of categories"
+    if categories == 'all':
+        return Tracer(LEVELS[level_name])
+    chosen = [category for category in categories.split(',') if category]
+    for category in chosen:
+        if category not in CATEGORIES:
+            raise ValueError("Unknown trace category: {}".format(category))
+    return Tracer(LEVELS[level_name], chosen)
@@ -1,80 +1,199 @@
 """
-The main emulator of the world, and bootstrapper of tests.
+The main emulator of the world. world_machine.py runs it under Hypothesis.
 """
 
-import unittest
 import collections
-from random import Random
-from heapq import heappush, heappop
-
-
-from hypothesis.stateful import GenericStateMachine
-from hypothesis.strategies import sampled_from, just, integers, one_of
-from hypothesis.strategies import fixed_dictionaries, sets, lists, permutations
-import hypothesis.strategies
+from heapq import heappush, heappop, heapify
 
 # pylint: disable=unused-wildcard-import
 # pylint: disable=wildcard-import
 from events import *
-from node import Node
-# from copy import deepcopy
+from node import Node, node_conf
+from timers import NodeTimers
+from invariants import InvariantChecker, OneLeaderPerTerm, CommittedEntriesMatch
+from tracing import Tracer
+from network import NetworkBroker
+from storage import NodeStorage, SimulatedDisk, make_disk
+from client import Client
+from multiraft import GroupBroker, Host, CoalescedHeartbeats
+from checkpoint import Checkpoint, ForkableRandom
+from codec import encode
+from linearizability import History, check_history
 
 # pylint: disable=too-many-instance-attributes
-class WorldBroker(GenericStateMachine):
+class WorldBroker:
     "TODO"
-    def __init__(self, log=None, catastrophy_level=0, ms_per_step=700, max_ms_per_event=400):
+    # pylint: disable=too-many-arguments
+    def __init__(self, log=None, catastrophy_level=0, ms_per_step=700, max_ms_per_event=400,
+                 skip_idle_time=True, tracer=None, cluster_size=5, max_entries_per_append=64,
+                 max_appends_in_flight=4, proposal_interval=None, disk='memory', fsync_latency=0,
+                 crash_on_power_down=False, storage_dir=None, snapshot_interval=1000,
+                 snapshot_chunk_size=1024, clients=0, client_timeout=100,
+                 max_requests_per_entry=64, read_fraction=0.0, read_mode='read_index',
+                 leader_leases=False, max_clock_drift=50, pre_vote=False, check_quorum=False,
+                 spare_nodes=0, groups=1, host_tick_ms=10, count_bytes=False, fast_check=False):
         # Run/Test Settings
         self.catastrophy_level = catastrophy_level
         self.time_window_length = ms_per_step
         self.event_window_length = max_ms_per_event
+        # When set, the event loop jumps straight to the next pending event or timer
+        # instead of stepping through every idle millisecond.
+        self.skip_idle_time = skip_idle_time
         self.message_send_delay = 6
 
         self.delays = []
         self.delay_index = 0
-        self.leaders_history = collections.defaultdict(set)
-
-        self.test_logging = log or []
 
-        # Initialize the cluster
-        self.node_ids = range(5)
-        conf = {'election_timeout_window': (150, 300),
-                'heartbeat_timeout': 50,
-                'nodes': set(self.node_ids)}
-
-        # Event Queue
+        # Invariants are checked as nodes change state, rather than every tick
+        one_leader_per_term = OneLeaderPerTerm()
+        self.leaders_history = one_leader_per_term.leaders_history
+        self.invariants = InvariantChecker([one_leader_per_term, CommittedEntriesMatch()])
+
+        self.test_logging = log if log is not None else []
+        # Decides which categories of events are logged. Nodes read it on creation.
+        self.tracer = tracer or Tracer()
+
+        # Initialize the cluster. The first cluster_size nodes are its voters. Spare nodes
+        # run, but aren't members until a leader adds them, and membership changes are
+        # drawn among the adverse events when there are any.
+        self.node_ids = range(cluster_size + spare_nodes)
+        self.spare_nodes = spare_nodes
+        # The settings are described in node.DEFAULT_CONF.
+        conf = node_conf(cluster_size, max_entries_per_append=max_entries_per_append,
+                         max_appends_in_flight=max_appends_in_flight,
+                         snapshot_interval=snapshot_interval,
+                         snapshot_chunk_size=snapshot_chunk_size,
+                         max_requests_per_entry=max_requests_per_entry,
+                         client_timeout=client_timeout, read_fraction=read_fraction,
+                         read_mode=read_mode, leader_leases=leader_leases,
+                         max_clock_drift=max_clock_drift, pre_vote=pre_vote,
+                         check_quorum=check_quorum)
+
+        # Event Queue, a heap of (start_time, sequence, event)
         self.current_time = 0
         self.action_queue = []
+        self.event_sequence = 0
+        # Counters for benchmarking
+        self.events_dispatched = 0
+        self.messages_sent = 0
+        # With count_bytes, the bytes of encoded messages sent over each (origin,
+        # destination) link, duplicates included. Encoding every message is slow, so it's
+        # off by default.
+        self.link_bytes = collections.Counter() if count_bytes else None
+        # Elections won, and ms without a leader in two-way contact with a majority
+        self.leader_changes = 0
+        self.leaderless_ms = 0
+        self.leaderless_since = 0  # when the current leaderless spell began, or None
+        # Whether a node's type, power or the network changed since leadership was last
+        # checked, and the configuration of each leader it checked then
+        self.leadership_changed = True
+        self.leader_configurations = []
 
         # File Management
-        # Currently, we're modeling ideal, synchronous files system operations
-        self.file_broker = {k: {} for k in self.node_ids}
+        # Each node's writes take fsync_latency ms to become durable, and are grouped into
+        # one sync while another is in progress. With crash_on_power_down, a node loses its
+        # unsynced writes when it goes down, and restarts from what it synced.
+        self.fsync_latency = fsync_latency
+        self.crash_on_power_down = crash_on_power_down
+        self.file_broker = {k: NodeStorage(make_disk(disk, k, storage_dir)) for k in self.node_ids}
+        self.unsynced_nodes = set()  # nodes with writes that no finished sync covers
+
+        # Multi-Raft: with more than one group, each host runs a node of every group, and
+        # the world sends messages to, powers and skews hosts rather than nodes. Group
+        # timers trip on host ticks every host_tick_ms, and the heartbeats one host sends
+        # another in a ms share one message.
+        self.hosts = {}
+        self.raft_groups = []  # each group's broker
+        self.heartbeat_outbox = {}  # (origin, destination) -> [(group, message)]
+        self.group_messages_sent = 0
+        if groups > 1:
+            assert not (clients or proposal_interval or fsync_latency or crash_on_power_down), \
+                "groups take no clients, and write to ideal disks"
+            self.hosts = {k: Host(k, self, host_tick_ms) for k in self.node_ids}
+            for group in range(groups):
+                group_broker = GroupBroker(self, group)
+                self.raft_groups.append(group_broker)
+                for k in self.node_ids:
+                    rng = ForkableRandom(group * len(self.node_ids) + k)
+                    self.hosts[k].nodes.append(Node(k, conf, rng, group_broker))
+            # Leaderless spells are only tracked for a single group.
+            self.leaderless_since = None
 
         # Power Management
-        self.power_broker = {'nodes': {k: Node(k, conf, Random(k), self) for k in self.node_ids},
-                             'down_nodes': {}}
+        if self.hosts:
+            nodes = dict(self.hosts)
+        else:
+            nodes = {k: Node(k, conf, ForkableRandom(k), self) for k in self.node_ids}
+        self.power_broker = {'nodes': nodes, 'down_nodes': {}}
 
         # Time Management
-        self.time_broker = {'node_time_offsets': {k: 0 for k in self.node_ids},
-                            'node_timers': {k: None for k in self.node_ids}}
+        # With leases, ClockSkew keeps every two clocks within max_clock_drift / 2 ms of each
+        # other, so none moves more than max_clock_drift ms against another over a lease.
+        node_time_offsets = {k: 0 for k in self.node_ids}
+        self.time_broker = {'node_time_offsets': node_time_offsets,
+                            'node_timers': NodeTimers(node_time_offsets),
+                            'max_clock_spread': max_clock_drift // 2 if leader_leases else None}
 
         # Network Management
-        self.network_broker = {'connections':
-                               set([(f, t) for f in self.node_ids
-                                    for t in self.node_ids if t != f]),
-                               'delays': {(f, t): 0 for f in self.node_ids
-                                          for t in self.node_ids if t != f},
-                               'duplicates': {(f, t): 0 for f in self.node_ids
-                                              for t in self.node_ids if t != f}}
+        self.network_broker = NetworkBroker()
+
+        # Client Management
+        # A client proposes a new command every proposal_interval ms, if set.
+        self.proposal_interval = proposal_interval
+        self.client_broker = {'leader': None,  # the last node known to be elected
+                              'proposal_times': {},  # index -> (term, time proposed)
+                              'proposals_dropped': 0,
+                              'committed_index': 0,
+                              # commit latency in ms -> number of proposals
+                              'commit_latencies': collections.Counter(),
+                              'clients': {k: Client(k, conf, self) for k in range(clients)},
+                              'ops_completed': 0,
+                              # ms from a client's request to its reply -> number of requests
+                              'op_latencies': collections.Counter(),
+                              # What clients asked and were told, checked for linearizability
+                              # on teardown. Proposals change the count unseen by clients, so
+                              # there is none with them.
+                              'history': History() if proposal_interval is None else None}
+        # Whether teardown checks the history with the counter's fast path, rather than
+        # searching, whose cost grows exponentially with the requests in flight at once
+        self.fast_check = fast_check
+        self.batching_nodes = set()  # nodes holding client requests to propose this ms
 
         # The nodes should be "Brought up" after all the brokers are in place
         for node in self.power_broker['nodes'].values():
             node.setup()
+        if proposal_interval:
+            self.schedule(ProposeEntry(start_time=proposal_interval, command=0))
+        for client in self.client_broker['clients'].values():
+            client.send_next()
 
     def log(self, entry):
         "Updates a submitted entry with information about the current time, and appends it"
         entry['global_time'] = self.current_time
         self.test_logging.append(entry)
 
+    def state_changed(self, node, transition):
+        "Called by a node after a state transition, so that invariants are checked"
+        self.invariants.notify(node, transition)
+        if transition == 'change_type':
+            self.leadership_changed = True
+            if node.is_leader():
+                self.client_broker['leader'] = node.node_id
+                self.leader_changes += 1
+        elif transition == 'commit' and node.is_leader():
+            self.record_commits(node)
+
+    def record_commits(self, leader):
+        "Records the latency of each proposal that the leader's commit index now covers"
+        client_broker = self.client_broker
+        proposal_times = client_broker['proposal_times']
+        for index in range(client_broker['committed_index'] + 1, leader.commit_index + 1):
+            proposed = proposal_times.pop(index, None)
+            if proposed is not None and proposed[0] == leader.term_at(index):
+                client_broker['commit_latencies'][self.current_time - proposed[1]] += 1
+        client_broker['committed_index'] = max(client_broker['committed_index'],
+                                               leader.commit_index)
+
     def get_node_for_testing(self, node_id):
         '''Return the canonical version of a node given its node_id.
         For testing purposes only. This is required for verifying
@@ -83,90 +202,6 @@ class WorldBroker(GenericStateMachine):
 
         return self.power_broker['down_nodes'].get(node_id, self.power_broker['nodes'][node_id])
 
-    # Begin Helper functions for event generation
-    def gen_basic_event(self, event_type, additional_map):
-        "TODO"
-        base_map = {'start_time': integers(min_value=self.current_time,
-                                           max_value=self.time_window_length + self.current_time),
-                    'event_length': integers(min_value=1, max_value=self.event_window_length)}
-        base_map.update(additional_map)
-        return fixed_dictionaries(base_map).flatmap(lambda x: just(event_type(x)))
-
-    def gen_node(self):
-        "TODO"
-        return sampled_from(self.node_ids)
-
-    def gen_node_set(self):
-        "TODO"
-        return sets(self.gen_node())
-
-    def gen_node_pair(self):
-        "TODO"
-        return permutations(self.node_ids).flatmap(lambda x: just((x[0], x[1])))
-
-    def gen_node_pairs(self):
-        "TODO"
-        return sets(self.gen_node_pair())
-
-    # Begin Event Generators
-
-    def gen_power_event(self):
-        "TODO"
-        return self.gen_basic_event(PowerDown, {'affected_node': self.gen_node()})
-
-    def gen_clock_event(self):
-        "TODO"
-        return self.gen_basic_event(ClockSkew,
-                                    {'affected_node': self.gen_node(),
-                                     'skew_amount': integers(min_value=-100, max_value=100)})
-
-    def gen_network_event(self):
-        "TODO"
-        return one_of(
-            self.gen_basic_event(SendDelay,
-                                 {'affected_nodes': self.gen_node_set(),
-                                  'delay': integers(min_value=1,
-                                                    max_value=self.event_window_length)}),
-            self.gen_basic_event(SendDrop,
-                                 {'affected_nodes': self.gen_node_set()}),
-            self.gen_basic_event(ReceiveDrop,
-                                 {'affected_nodes': self.gen_node_set(),
-                                  'delay': integers(min_value=1,
-                                                    max_value=self.event_window_length)}),
-            self.gen_basic_event(TransmitDrop,
-                                 {'affected_node_pair': self.gen_node_pair(),
-                                  'delay': integers(min_value=1,
-                                                    max_value=self.event_window_length)}),
-            self.gen_basic_event(SendDuplicate,
-                                 {'affected_node': (self.gen_node()),
-                                  'delay': integers(min_value=1,
-                                                    max_value=self.event_window_length)}))
-
-    def gen_adverse_event(self):
-        "TODO"
-        return one_of(self.gen_network_event(), self.gen_power_event(), self.gen_clock_event())
-
-    # Check that we have at most one leader per term.
-    # Also, update leader_history.
-    def check_leader_history(self):
-        "TODO"
-        for node_id in self.power_broker['nodes']:
-            node = self.get_node_for_testing(node_id)
-            if node.is_leader():
-                self.leaders_history[node.term].add(node.node_id)
-        for term in self.leaders_history:
-            if not len(self.leaders_history[term]) <= 1:
-                print(self.leaders_history)
-                assert False
-
-    def steps(self):
-        "TODO"
-        delays = lists(integers(1, self.message_send_delay))
-        adverse_events = lists(self.gen_adverse_event(), max_size=self.catastrophy_level)
-        randomness = {'delays': delays, 'adverse_events': adverse_events}
-        return fixed_dictionaries(randomness)
-
-    # pylint: disable=arguments-differ
     def execute_step(self, randomness):
         """
         steps is a list of steps (possibly len() 0)
@@ -179,29 +214,125 @@ class WorldBroker(GenericStateMachine):
         # Add a set of events to the action_queue, an the corresponding events to heal it
         for event in randomness['adverse_events']:
             reversals = event.backout()
-            heappush(self.action_queue, event)
+            self.schedule(event)
             for rev in reversals:
-                heappush(self.action_queue, rev)
+                self.schedule(rev)
 
         # Run the event loop
         run_until = self.current_time + self.time_window_length
         while self.current_time <= run_until:
-            # Handle any event at the current slice in time
-
-            while self.action_queue and self.action_queue[0].get_start_time() == self.current_time:
-                self.dispatch_event(heappop(self.action_queue))
-            # Trip timers if timer is past timeout.
-            for node_id in self.node_ids:
-                if self.time_broker['node_timers'][node_id]:
-                    adjusted_time = self.current_time \
-                                    + self.time_broker['node_time_offsets'][node_id]
-                    if adjusted_time > self.time_broker['node_timers'][node_id]:
-                        self.log({'event_type':'timer_trip', 'affected_node':node_id})
-                        self.power_broker['nodes'][node_id].timer_trip()
+            self.run_tick()
             self.current_time += 1
-            self.check_leader_history()
-
+            if self.skip_idle_time:
+                # Nothing can change between two pending events, so skip the idle time.
+                next_time = self.next_event_time()
+                if next_time is None or next_time > run_until:
+                    next_time = run_until + 1
+                self.current_time = next_time
+
+    def run_tick(self):
+        "Handle any event at the current slice in time, then trip any expired timers"
+        while self.action_queue and self.action_queue[0][0] == self.current_time:
+            self.dispatch_event(heappop(self.action_queue)[2])
+            if self.unsynced_nodes:
+                self.start_syncs()
+        # Requests received this ms are proposed together.
+        if self.batching_nodes:
+            self.flush_requests()
+        # Trip timers if timer is past timeout.
+        for node_id in self.time_broker['node_timers'].pop_expired(self.current_time):
+            if self.tracer.timer_info:
+                self.log({'event_type':'timer_trip', 'affected_node':node_id})
+            self.power_broker['nodes'][node_id].timer_trip()
+            if self.unsynced_nodes:
+                self.start_syncs()
+        if self.hosts:
+            if self.heartbeat_outbox:
+                self.flush_heartbeats()
+        else:
+            self.track_leadership()
+
+    def flush_heartbeats(self):
+        "Sends every host's heartbeats for this ms, one message to each other host"
+        outbox = self.heartbeat_outbox
+        self.heartbeat_outbox = {}
+        for origin, destination in sorted(outbox):
+            self.broadcast(origin, CoalescedHeartbeats(outbox[origin, destination]),
+                           (destination,))
+
+    def track_leadership(self):
+        "Starts or ends a leaderless spell, if one began or ended this ms"
+        # Nothing else decides whether there's a leader, so only check again after a change.
+        if not self.leadership_changed and all(
+                leader.configuration() is configuration
+                for leader, configuration in self.leader_configurations):
+            return
+        self.leadership_changed = False
+        leaderless = not self.has_leader()
+        if leaderless and self.leaderless_since is None:
+            self.leaderless_since = self.current_time
+        elif not leaderless and self.leaderless_since is not None:
+            self.leaderless_ms += self.current_time - self.leaderless_since
+            self.leaderless_since = None
+
+    def has_leader(self):
+        """
+        Checks whether an up leader can exchange messages with a majority of its voters,
+        counting itself, and notes the configuration of each leader it checks
+        """
+        nodes = self.power_broker['nodes']
+        down_nodes = self.power_broker['down_nodes']
+        connected = self.network_broker.connected
+        self.leader_configurations = []
+        for node_id in self.node_ids:
+            if node_id in down_nodes or not nodes[node_id].is_leader():
+                continue
+            self.leader_configurations.append((nodes[node_id],
+                                               nodes[node_id].configuration()))
+            reachable = set(peer for peer in self.node_ids
+                            if peer == node_id or (peer not in down_nodes and
+                                                   connected(node_id, peer) and
+                                                   connected(peer, node_id)))
+            if nodes[node_id].configuration().has_quorum(reachable):
+                return True
+        return False
+
+    def leaderless_time(self):
+        "Returns the ms so far without a leader that could commit"
+        if self.leaderless_since is None:
+            return self.leaderless_ms
+        return self.leaderless_ms + self.current_time - self.leaderless_since
+
+    def next_event_time(self):
+        """
+        Returns the earliest time, no sooner than current_time, at which either the head of
+        the action_queue starts or a node timer trips. Returns None if nothing is pending.
+        """
+        candidates = []
+        if self.action_queue:
+            candidates.append(self.action_queue[0][0])
+        next_trip_time = self.time_broker['node_timers'].next_trip_time()
+        if next_trip_time is not None:
+            candidates.append(next_trip_time)
+        if not candidates:
+            return None
+        return max(self.current_time, min(candidates))
+
+    def checkpoint(self):
+        """
+        Returns a checkpoint of the world as it is now, which any number of worlds can be
+        forked from to run on from here. Only works with simulated disks.
+        """
+        assert all(isinstance(storage.disk, SimulatedDisk)
+                   for storage in self.all_storage()), "only simulated disks can be copied"
+        return Checkpoint(self)
 
+    def all_storage(self):
+        "Returns the storage of every node, of every group"
+        storage = list(self.file_broker.values())
+        for group_broker in self.raft_groups:
+            storage.extend(group_broker.file_broker.values())
+        return storage
 
     def teardown(self):
         "TODO"
@@ -209,55 +340,198 @@ class WorldBroker(GenericStateMachine):
         # if self.current_time > self.time_window_length / 2:
             #-TODO: this check should be stronger.
             #-TODO: heal before checking for other catastrophy levels.
-            if not self.leaders_history:
+            if not self.raft_groups and not self.leaders_history:
                 assert False
+            for group_broker in self.raft_groups:
+                assert group_broker.leaders_history, \
+                    "group {} never elected a leader".format(group_broker.group)
+        history = self.client_broker['history']
+        if history is not None:
+            violation = check_history(history, fast=self.fast_check)
+            assert violation is None, violation
 
     # Event Dispatch
     def dispatch_event(self, event):
         "TODO"
-        self.log(event.event_map)
+        self.events_dispatched += 1
+        if isinstance(event, (DeliverMessage, ClientEvent, FileEvent)):
+            if self.tracer.message_info:
+                self.log(event.event_map)
+        elif self.tracer.fault_info:
+            self.log(event.event_map)
         if isinstance(event, NetworkEvent):
             event.handle(self.power_broker['nodes'], self.network_broker)
+            if not isinstance(event, DeliverMessage):
+                self.leadership_changed = True
         elif isinstance(event, PowerEvent):
+            self.leadership_changed = True
             if isinstance(event, PowerDown):
                 # Special cross-broker concern, clear timer
-                self.time_broker['node_timers'][event.event_map['affected_node']] = None
+                self.time_broker['node_timers'].clear(event.affected_node)
+                if self.crash_on_power_down and \
+                        event.affected_node not in self.power_broker['down_nodes']:
+                    self.file_broker[event.affected_node].crash()
+                    self.unsynced_nodes.discard(event.affected_node)
+            elif isinstance(event, StopPowerDown) and self.crash_on_power_down and \
+                    event.affected_node in self.power_broker['down_nodes']:
+                event.handle(self.power_broker['nodes'], self.power_broker)
+                self.restart_node(event.affected_node)
+                return
             event.handle(self.power_broker['nodes'], self.power_broker)
+            # A host keeps its group timers while down, and trips any that expired once up.
+            if isinstance(event, StopPowerDown) and event.affected_node in self.hosts:
+                self.hosts[event.affected_node].arm()
         elif isinstance(event, TimerEvent):
             event.handle(self.power_broker['nodes'], self.time_broker)
+        elif isinstance(event, FileEvent):
+            event.handle(self.power_broker['nodes'], self.file_broker)
+        elif isinstance(event, ClientEvent):
+            event.handle(self.power_broker['nodes'], self.client_broker)
+            if isinstance(event, ProposeEntry):
+                self.schedule(ProposeEntry(start_time=self.current_time + self.proposal_interval,
+                                           command=event.command + 1))
+
+    def restart_node(self, node_id):
+        "Replaces a node that came back up after a crash with one recovered from its disk"
+        crashed = self.power_broker['nodes'][node_id]
+        node = Node(node_id, crashed.conf, crashed.rng, self)
+        node.recover(self.file_broker[node_id].records())
+        self.power_broker['nodes'][node_id] = node
+        node.setup()
+
+    def schedule(self, event):
+        "Queues an event, after any already queued to start at the same time"
+        self.event_sequence += 1
+        event.sequence = self.event_sequence
+        heappush(self.action_queue, (event.start_time, event.sequence, event))
 
     # Handle Timer Events
 
     def set_timeout(self, node_id, timeout):
         "TODO"
-        self.time_broker['node_timers'][node_id] = self.current_time + \
-            self.time_broker['node_time_offsets'][node_id] + timeout
+        self.time_broker['node_timers'].set(
+            node_id, self.current_time + self.time_broker['node_time_offsets'][node_id] + timeout)
+
+    def local_time(self, node_id):
+        "Returns the time on a node's clock"
+        return self.current_time + self.time_broker['node_time_offsets'][node_id]
 
     def clear_timer(self, node_id):
         "TODO"
-        self.time_broker['node_timers'][node_id] = None
+        self.time_broker['node_timers'].clear(node_id)
+
+    # Handle File Events
+
+    def persist(self, node_id, record, log_length):
+        "Writes a record to a node's disk. It is synced once the node's handler returns."
+        if self.fsync_latency:
+            self.file_broker[node_id].write(record, log_length)
+            self.unsynced_nodes.add(node_id)
+        else:
+            # An ideal disk syncs as it writes, so nothing ever waits on it.
+            self.file_broker[node_id].write_synced(record, log_length)
+
+    def start_syncs(self):
+        "Starts a sync for every node with unsynced writes, unless one is already running"
+        for node_id in sorted(self.unsynced_nodes):
+            storage = self.file_broker[node_id]
+            if storage.syncing:
+                continue
+            if not storage.unsynced:
+                self.unsynced_nodes.discard(node_id)
+                continue
+            self.schedule(SyncComplete(start_time=self.current_time + self.fsync_latency,
+                                       affected_node=node_id, sync_id=storage.start_sync()))
+
+    def send_after_sync(self, origin, data, destinations):
+        "Sends a message once every write origin has made so far is durable"
+        storage = self.file_broker[origin]
+        if storage.pending():
+            storage.send_after_sync(data, destinations)
+        else:
+            self.broadcast(origin, data, destinations)
+
+    # Handle Client Events
+
+    def batching(self, node_id):
+        "Called by a node holding client requests, so that it proposes them at the end of the ms"
+        self.batching_nodes.add(node_id)
+
+    def flush_requests(self):
+        "Has every node holding client requests propose them"
+        for node_id in sorted(self.batching_nodes):
+            self.power_broker['nodes'][node_id].flush_requests()
+        self.batching_nodes.clear()
+        if self.unsynced_nodes:
+            self.start_syncs()
+
+    def respond(self, client_id, request_id, result):
+        "Sends a reply to a client"
+        self.schedule(ClientResponse(start_time=self.current_time + self.client_delay(),
+                                     client_id=client_id, request_id=request_id,
+                                     result=result))
+
+    def client_delay(self):
+        "Draws the delay of a message between a client and a node, as broadcast does"
+        if not self.delays:
+            return 1
+        delay = self.delays[self.delay_index]
+        self.delay_index = (self.delay_index + 1) % len(self.delays)
+        return delay
 
     # Handle Network Events
 
     def send_to(self, origin, destination, data):
         "TODO"
         assert origin != destination
+        self.broadcast(origin, data, (destination,))
 
-        delay = 1
-        if self.delays:
-            delay = self.delays[self.delay_index]
-            self.delay_index = (self.delay_index + 1) % len(self.delays)
-
-        event_time = self.current_time + delay + self.network_broker['delays'][(origin, destination)]
-        event_map = {'affected_node': destination,
-                     'start_time': event_time,
-                     'data': data,
-                     'sender': origin}
-
-        heappush(self.action_queue, DeliverMessage(event_map))
-
-# pylint: disable=invalid-name
-TestSet = WorldBroker.TestCase
+    # pylint: disable=too-many-locals
+    def broadcast(self, origin, data, destinations=None):
+        """
+        Sends the same message to every node in destinations (by default, the whole
+        cluster) except origin. The message is shared between recipients, so it must not be
+        modified once sent.
 
-if __name__ == '__main__':
-    unittest.main()
+        Delay and duplication are decided for every link in one pass, and the deliveries
+        are queued together. Whether a link drops the message is decided on delivery.
+        """
+        if destinations is None:
+            destinations = self.node_ids
+        network_broker = self.network_broker
+        # Duplication is set per sender, and applies to every link from it.
+        copies = range(1 + network_broker.duplicates(origin))
+        delays = self.delays
+        delay_index = self.delay_index
+        sequence = self.event_sequence
+        entries = []
+        for destination in destinations:
+            if destination == origin:
+                continue
+            send_time = self.current_time + network_broker.link_delay(origin, destination)
+            for _ in copies:
+                delay = 1
+                if delays:
+                    delay = delays[delay_index]
+                    delay_index = (delay_index + 1) % len(delays)
+                sequence += 1
+                delivery = DeliverMessage(send_time + delay, destination, origin, data)
+                delivery.sequence = sequence
+                entries.append((delivery.start_time, sequence, delivery))
+        self.delay_index = delay_index
+        self.event_sequence = sequence
+        self.messages_sent += len(entries)
+        if self.link_bytes is not None and entries:
+            size = len(encode(data)) * len(copies)
+            for destination in destinations:
+                if destination != origin:
+                    self.link_bytes[(origin, destination)] += size
+
+        queue = self.action_queue
+        # Rebuilding the heap is linear, which beats pushing each entry once there are many.
+        if len(entries) * max(1, len(queue).bit_length()) > len(queue):
+            queue.extend(entries)
+            heapify(queue)
+        else:
+            for entry in entries:
+                heappush(queue, entry)
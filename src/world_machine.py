@@ -0,0 +1,114 @@
+"""
+The Hypothesis state machine over the simulated world, and the test that searches it for a
+run breaking an invariant. Hypothesis draws each step's delays and adverse events from
+strategies, so that it can shrink a failing run. Only this module needs Hypothesis; seeded
+runs draw their steps with fuzz.draw_step instead.
+"""
+
+import unittest
+from hypothesis.stateful import GenericStateMachine
+from hypothesis.strategies import sampled_from, just, integers, one_of, booleans
+from hypothesis.strategies import fixed_dictionaries, sets, lists, permutations, tuples
+
+# pylint: disable=unused-wildcard-import
+# pylint: disable=wildcard-import
+from events import *
+from world_broker import WorldBroker
+
+
+class WorldMachine(WorldBroker, GenericStateMachine):
+    "A WorldBroker whose steps Hypothesis draws"
+
+    # Begin Helper functions for event generation
+    def gen_basic_event(self, event_type, additional_map):
+        "TODO"
+        base_map = {'start_time': integers(min_value=self.current_time,
+                                           max_value=self.time_window_length + self.current_time),
+                    'event_length': integers(min_value=1, max_value=self.event_window_length)}
+        base_map.update(additional_map)
+        return fixed_dictionaries(base_map).map(lambda x: event_type(**x))
+
+    def gen_node(self):
+        "TODO"
+        return sampled_from(self.node_ids)
+
+    def gen_node_set(self):
+        "TODO"
+        return sets(self.gen_node())
+
+    def gen_node_pair(self):
+        "TODO"
+        return permutations(self.node_ids).flatmap(lambda x: just((x[0], x[1])))
+
+    def gen_node_pairs(self):
+        "TODO"
+        return sets(self.gen_node_pair())
+
+    # Begin Event Generators
+
+    def gen_power_event(self):
+        "TODO"
+        return self.gen_basic_event(PowerDown, {'affected_node': self.gen_node()})
+
+    def gen_clock_event(self):
+        "TODO"
+        return self.gen_basic_event(ClockSkew,
+                                    {'affected_node': self.gen_node(),
+                                     'skew_amount': integers(min_value=-100, max_value=100)})
+
+    def gen_network_event(self):
+        "TODO"
+        return one_of(
+            self.gen_basic_event(SendDelay,
+                                 {'affected_nodes': self.gen_node_set(),
+                                  'delay': integers(min_value=1,
+                                                    max_value=self.event_window_length)}),
+            self.gen_basic_event(SendDrop,
+                                 {'affected_nodes': self.gen_node_set()}),
+            self.gen_basic_event(ReceiveDrop,
+                                 {'affected_nodes': self.gen_node_set()}),
+            self.gen_basic_event(TransmitDrop,
+                                 {'affected_node_pair': self.gen_node_pair()}),
+            self.gen_basic_event(SendDuplicate,
+                                 {'affected_node': (self.gen_node())}))
+
+    def gen_adverse_event(self):
+        "TODO"
+        return one_of(self.gen_network_event(), self.gen_power_event(), self.gen_clock_event())
+
+    def gen_membership_change(self):
+        "Generates an AddNode or RemoveNode event for any node, like fuzz.draw_membership_change"
+        start_time = integers(min_value=self.current_time,
+                              max_value=self.time_window_length + self.current_time)
+        return one_of(
+            fixed_dictionaries({'start_time': start_time, 'node_id': self.gen_node(),
+                                'learner': booleans()}).map(lambda x: AddNode(**x)),
+            fixed_dictionaries({'start_time': start_time, 'node_id': self.gen_node()}).map(
+                lambda x: RemoveNode(**x)))
+
+    def steps(self):
+        "TODO"
+        delays = lists(integers(1, self.message_send_delay))
+        adverse_events = lists(self.gen_adverse_event(), max_size=self.catastrophy_level)
+        if self.spare_nodes:
+            # Membership changes are drawn apart from faults, as fuzz.draw_step does.
+            adverse_events = tuples(adverse_events,
+                                    lists(self.gen_membership_change(), max_size=2)).map(
+                                        lambda x: x[0] + x[1])
+        randomness = {'delays': delays, 'adverse_events': adverse_events}
+        return fixed_dictionaries(randomness)
+
+
+class MembershipMachine(WorldMachine):
+    "A WorldMachine with spare nodes, so that its steps add and remove nodes too"
+
+    def __init__(self):
+        super().__init__(spare_nodes=2)
+
+
+# pylint: disable=invalid-name
+TestSet = WorldMachine.TestCase
+TestMembership = MembershipMachine.TestCase
+
+if __name__ == '__main__':
+    unittest.main()